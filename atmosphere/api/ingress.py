@@ -16,41 +16,141 @@
 
 """
 
+import collections
+import contextlib
+import os
+
 from flask import Blueprint
+from flask import current_app
 from flask import request
-from flask import abort
 from flask import jsonify
+from werkzeug.exceptions import HTTPException
 
 from atmosphere.app import create_app
+from atmosphere import event_archive
 from atmosphere import exceptions
+from atmosphere import metrics
+from atmosphere import payload
+from atmosphere import profiler
 from atmosphere import utils
 from atmosphere import models
 
 blueprint = Blueprint('ingress', __name__)
 
+ARCHIVE_BATCH_SIZE = 100
+
 
 def init_application(config=None):
     """init_application"""
     app = create_app(config)
     app.register_blueprint(blueprint)
+
+    if app.config.get('INGEST_SPLICE_LATE_EVENTS') is None:
+        app.config['INGEST_SPLICE_LATE_EVENTS'] = os.environ.get(
+            'INGEST_SPLICE_LATE_EVENTS', 'false').lower() in ('1', 'true')
+    if app.config.get('INGEST_MAX_BODY_SIZE') is None:
+        app.config['INGEST_MAX_BODY_SIZE'] = \
+                int(os.environ.get('INGEST_MAX_BODY_SIZE',
+                                   payload.MAX_BODY_SIZE))
+
+    event_archive.init_app(app)
+    metrics.init_app(app)
     return app
 
 
+def _decode(events):
+    while True:
+        with metrics.stage('decode'):
+            event_data = next(events, None)
+        if event_data is None:
+            return
+        yield event_data
+
+
+def _archive(events):
+    """Archive raw events as they are decoded, before processing them.
+
+    The segment is only flushed once every `ARCHIVE_BATCH_SIZE` events.
+    """
+    count = 0
+    try:
+        for event_data in events:
+            event_archive.record([event_data], flush=False)
+            count += 1
+            if count % ARCHIVE_BATCH_SIZE == 0:
+                event_archive.flush_segment()
+            yield event_data
+    finally:
+        if count % ARCHIVE_BATCH_SIZE:
+            event_archive.flush_segment()
+
+
+def _drain(events):
+    """Archive the rest of a batch which is not processed."""
+    if not current_app.config.get('EVENT_ARCHIVE_DIR'):
+        return
+    # NOTE: The body might be invalid further on, which should not hide why
+    #       processing stopped.
+    with contextlib.suppress(HTTPException):
+        collections.deque(events, maxlen=0)
+
+
+def _process(event_data):
+    """Process a single event, returning a response if it was not applied."""
+    profiler.tag(event_data['event_type'])
+    with metrics.stage('normalize'):
+        # NOTE: Normalize a copy since the raw event might not be archived
+        #       yet.
+        event_data = utils.normalize_event(dict(event_data))
+
+    try:
+        if event_data['event_type'] == models.PROJECT_DELETED:
+            models.Resource.close_project(
+                event_data['traits']['project_id'],
+                event_data['generated'])
+        else:
+            models.Resource.get_or_create(
+                event_data,
+                splice=current_app.config.get('INGEST_SPLICE_LATE_EVENTS',
+                                              False))
+    except exceptions.EventTooOld:
+        metrics.INGEST_EVENTS.labels('too_old').inc()
+        return 'Event Too Old', 202
+    except exceptions.IgnoredEvent:
+        metrics.INGEST_EVENTS.labels('ignored').inc()
+        return 'Ignored Event', 202
+    except exceptions.UnsupportedEventType:
+        metrics.INGEST_EVENTS.labels('unsupported').inc()
+        raise
+
+    metrics.INGEST_EVENTS.labels('applied').inc()
+    return None
+
+
 @blueprint.route('/v1/event', methods=['POST'])
 def event():
-    """event"""
-    if request.json is None:
-        abort(400)
+    """event
 
-    for event_data in request.json:
-        print(jsonify(event_data).get_data(True))
-        event_data = utils.normalize_event(event_data)
+    Events can be sent as JSON or MessagePack, optionally compressed.  They
+    are decoded and processed one at a time while the body is being read,
+    so the events preceding an invalid one in a batch are still processed.
+    """
+    max_size = current_app.config.get('INGEST_MAX_BODY_SIZE',
+                                      payload.MAX_BODY_SIZE)
+    events = _archive(_decode(payload.get_events(request, max_size)))
 
+    with contextlib.closing(events):
         try:
-            models.Resource.get_or_create(event_data)
-        except exceptions.EventTooOld:
-            return 'Event Too Old', 202
-        except exceptions.IgnoredEvent:
-            return 'Ignored Event', 202
+            for event_data in events:
+                print(jsonify(event_data).get_data(True))
+                response = _process(event_data)
+                if response is not None:
+                    # NOTE: The rest of the batch is not processed, but it
+                    #       still needs to be archived.
+                    _drain(events)
+                    return response
+        except Exception:
+            _drain(events)
+            raise
 
     return '', 204
@@ -14,24 +14,29 @@
 
 """Usage API."""
 
+from datetime import datetime
+from datetime import timedelta
 import os
 import dateutil.parser
 
 from flask import abort
 from flask import Blueprint
+from flask import current_app
 from flask import request
 from flask import jsonify
-from keystonemiddleware import auth_token
-from oslo_config import cfg
 
 from atmosphere.app import create_app
+from atmosphere import cache
+from atmosphere import metrics
 from atmosphere import models
+from atmosphere import rating
+from atmosphere import timeseries
 
-CONF = cfg.CONF
 CONFIG_FILES = ['atmosphere.conf']
 
 
 blueprint = Blueprint('usage', __name__)
+blueprint.before_request(models.use_read_replica)
 
 
 def _get_config_files(env=None):
@@ -43,26 +48,158 @@ def _get_config_files(env=None):
 
 def init_application(config=None):
     """Create usage API application."""
+    # NOTE: keystonemiddleware and oslo.config are only needed once the
+    #       application is created, not when importing the blueprint.
+    # pylint: disable=import-outside-toplevel
+    from keystonemiddleware import auth_token
+    from oslo_config import cfg
+
     app = create_app(config)
     app.register_blueprint(blueprint)
 
+    if app.config.get('USAGE_MAX_RESOURCES') is None:
+        app.config['USAGE_MAX_RESOURCES'] = \
+                int(os.environ.get('USAGE_MAX_RESOURCES', 10000))
+    if app.config.get('USAGE_MAX_BUCKETS') is None:
+        app.config['USAGE_MAX_BUCKETS'] = \
+                int(os.environ.get('USAGE_MAX_BUCKETS', 10000))
+    if app.config.get('CHANGES_PAGE_SIZE') is None:
+        app.config['CHANGES_PAGE_SIZE'] = \
+                int(os.environ.get('CHANGES_PAGE_SIZE', 1000))
+    if app.config.get('CHANGES_SETTLE_SECONDS') is None:
+        app.config['CHANGES_SETTLE_SECONDS'] = \
+                int(os.environ.get('CHANGES_SETTLE_SECONDS', 10))
+
     conf_files = _get_config_files()
     cfg.CONF([], project='atmosphere', default_config_files=conf_files)
 
-    authtoken_config = dict(CONF.keystone_authtoken)
+    authtoken_config = dict(cfg.CONF.keystone_authtoken)
     authtoken_config['log_name'] = app.name
 
+    token_cache = _get_token_cache(app)
+    if token_cache is not None:
+        authtoken_config['cache'] = cache.ENVIRON_KEY
+
     app.wsgi_app = auth_token.AuthProtocol(app.wsgi_app, authtoken_config)
+    if token_cache is not None:
+        app.wsgi_app = cache.TokenCacheMiddleware(app.wsgi_app, token_cache)
+    metrics.init_app(app)
     return app
 
 
+def _get_token_cache(app):
+    defaults = {
+        'TOKEN_CACHE': None,
+        'TOKEN_CACHE_SIZE': 1024,
+        'TOKEN_CACHE_TTL': 300,
+        'TOKEN_CACHE_NAME': 'tokens',
+    }
+    for key, default in defaults.items():
+        if app.config.get(key) is None:
+            app.config[key] = os.environ.get(key, default)
+    for key in ('TOKEN_CACHE_SIZE', 'TOKEN_CACHE_TTL'):
+        app.config[key] = int(app.config[key])
+
+    return cache.get_token_cache(app.config)
+
+
+def _get_projects():
+    """Get the projects that a request is scoped to.
+
+    Admins can override the project by passing `project_id` once or more, or
+    `project_id=all` for every project.  This returns the list of projects
+    (or `None` for all of them) and if the results should be grouped by
+    project in the response.
+    """
+    projects = [request.headers['X-Project-Id']]
+    if 'admin' not in request.headers['X-Roles']:
+        return projects, False
+
+    requested = request.args.getlist('project_id')
+    if 'all' in requested:
+        return None, True
+    if len(requested) > 0:
+        projects = requested
+
+    return projects, len(projects) > 1
+
+
 @blueprint.route('/v1/resources')
 def list_resources():
     """List all resources for a specific project."""
     # Project ID from request (or allow override if admin)
-    project_id = request.headers['X-Project-Id']
-    if 'admin' in request.headers['X-Roles'] and 'project_id' in request.args:
-        project_id = request.args['project_id']
+    projects, grouped = _get_projects()
+
+    try:
+        start = dateutil.parser.isoparse(request.args['start'])
+        end = dateutil.parser.isoparse(request.args['end'])
+    except (KeyError, ValueError):
+        abort(400)
+
+    limit = current_app.config.get('USAGE_MAX_RESOURCES')
+    with metrics.USAGE_QUERY_SECONDS.time():
+        resources = models.Resource.get_all_by_time_range(start, end,
+                                                          projects,
+                                                          limit=limit)
+    metrics.USAGE_QUERY_RESOURCES.observe(len(resources))
+    if not grouped:
+        return jsonify([r.serialize for r in resources])
+
+    data = {}
+    for resource in resources:
+        data.setdefault(resource.project, []).append(resource.serialize)
+    return jsonify(data)
+
+
+@blueprint.route('/v1/usage/timeseries')
+def get_usage_timeseries():
+    """Get the seconds of usage per bucket and spec.
+
+    Open periods are counted until now, so the current bucket is partial
+    and the ones in the future are empty.
+    """
+    projects, _ = _get_projects()
+
+    granularity = request.args.get('granularity', 'day')
+    try:
+        start = dateutil.parser.isoparse(request.args['start'])
+        end = dateutil.parser.isoparse(request.args['end'])
+    except (KeyError, ValueError):
+        abort(400)
+    if granularity not in timeseries.GRANULARITIES or start >= end:
+        abort(400)
+
+    max_buckets = current_app.config.get('USAGE_MAX_BUCKETS', 10000)
+    if timeseries.truncate(start, granularity) + \
+            timeseries.GRANULARITIES[granularity] * max_buckets < end:
+        abort(400)
+
+    now = datetime.now()
+    intervals = [(started_at, now if ended_at is None else ended_at, spec_id)
+                 for started_at, ended_at, spec_id
+                 in models.Period.get_intervals(start, end, projects)]
+    starts, series = timeseries.sum_by_bucket(intervals, start, end,
+                                              granularity)
+    specs = {}
+    if series:
+        specs = {spec.id: spec for spec in models.Spec.query.filter(
+            models.Spec.id.in_(list(series)))}
+
+    return jsonify({
+        'granularity': granularity,
+        'buckets': [bucket.isoformat() for bucket in starts],
+        'series': [{
+            'type': specs[spec_id].type,
+            'spec': specs[spec_id].serialize,
+            'seconds': seconds,
+        } for spec_id, seconds in sorted(series.items())],
+    })
+
+
+@blueprint.route('/v1/charges')
+def get_charges():
+    """Get the charges of the usage in a range, by project if grouped."""
+    projects, grouped = _get_projects()
 
     try:
         start = dateutil.parser.isoparse(request.args['start'])
@@ -70,5 +207,79 @@ def list_resources():
     except (KeyError, ValueError):
         abort(400)
 
-    resources = models.Resource.get_all_by_time_range(start, end, project_id)
-    return jsonify([r.serialize for r in resources])
+    charges = rating.compute_charges(start, end, projects)
+    for invoice in charges.values():
+        invoice['total'] = str(invoice['total'])
+        for line in invoice['lines']:
+            line['charge'] = str(line['charge'])
+    if grouped:
+        return jsonify(charges)
+
+    return jsonify(charges.get(projects[0], {'total': '0.00', 'lines': []}))
+
+
+def _serialize_active(resource):
+    period = resource.periods[0]
+    return {
+        'uuid': resource.uuid,
+        'type': resource.type,
+        'project': resource.project,
+        'started_at': period.started_at,
+        'spec': period.spec.serialize,
+    }
+
+
+@blueprint.route('/v1/active')
+def list_active():
+    """List the resources active now (or at a time) with their spec."""
+    projects, grouped = _get_projects()
+
+    at = None
+    if 'at' in request.args:
+        try:
+            at = dateutil.parser.isoparse(request.args['at'])
+        except ValueError:
+            abort(400)
+
+    limit = current_app.config.get('USAGE_MAX_RESOURCES')
+    resources = models.Resource.get_active(projects, at=at, limit=limit)
+    if not grouped:
+        return jsonify([_serialize_active(r) for r in resources])
+
+    data = {}
+    for resource in resources:
+        data.setdefault(resource.project, []).append(
+            _serialize_active(resource))
+    return jsonify(data)
+
+
+@blueprint.route('/v1/changes')
+def list_changes():
+    """List the resources whose periods changed after a cursor.
+
+    The `cursor` of the response is passed as `since` to get the next page,
+    until `more` is false.  Deleted resources are listed in `deleted`.
+    """
+    projects, _ = _get_projects()
+
+    page_size = current_app.config.get('CHANGES_PAGE_SIZE', 1000)
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', page_size)), page_size)
+    except ValueError:
+        abort(400)
+    if since < 0 or limit < 1:
+        abort(400)
+
+    settle = current_app.config.get('CHANGES_SETTLE_SECONDS', 10)
+    settled_before = datetime.now() - timedelta(seconds=settle)
+    resources, uuids, cursor, more = models.ResourceChange.get_page(
+        since, limit, settled_before, projects)
+
+    return jsonify({
+        'resources': [resources[u].serialize for u in uuids
+                      if u in resources],
+        'deleted': [u for u in uuids if u not in resources],
+        'cursor': cursor,
+        'more': more,
+    })
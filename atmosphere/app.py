@@ -15,31 +15,103 @@
 """App
 
 """
+import functools
+import importlib
 import os
-import pkg_resources
 
-import sentry_sdk
 from flask import Flask
-from sentry_sdk.integrations.flask import FlaskIntegration
-from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
+from flask.cli import AppGroup
 
 from atmosphere import models
+from atmosphere import profiler
+from atmosphere import statements
 
+try:
+    from importlib import metadata
+except ImportError:  # pragma: no cover
+    import importlib_metadata as metadata
 
-VERSION = pkg_resources.get_distribution("atmosphere").version
+# NOTE: Modules providing management commands, by the name of their group.
+#       Their `init_app` registers the commands and their configuration.
+COMMANDS = {
+    'archive': ('atmosphere.archive',),
+    'compact': ('atmosphere.compaction',),
+    'data': ('atmosphere.data_migrations',),
+    'events': ('atmosphere.event_archive', 'atmosphere.bulk_import'),
+    'rating': ('atmosphere.rating',),
+}
 
-sentry_sdk.init(
-    release="atmosphere@%s" % VERSION,
-    integrations=[
-        FlaskIntegration(),
-        SqlalchemyIntegration()
-    ],
-)
+
+class CommandGroup(AppGroup):
+    """CommandGroup
+
+    Replaces `app.cli` so that the modules providing management commands are
+    only imported once the `flask` CLI lists or runs them, which keeps them
+    out of the WSGI applications.
+    """
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+        self.loaded = set()
+
+    def load_commands(self, name):
+        """Import the modules providing a group of commands, once."""
+        if name in self.loaded:
+            return
+        self.loaded.add(name)
+        for module_name in COMMANDS[name]:
+            importlib.import_module(module_name).init_app(self.app)
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in COMMANDS:
+            self.load_commands(cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def list_commands(self, ctx):
+        for name in COMMANDS:
+            self.load_commands(name)
+        return super().list_commands(ctx)
+
+
+@functools.lru_cache()
+def get_version():
+    """Get the installed version of atmosphere."""
+    try:
+        return metadata.version('atmosphere')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+@functools.lru_cache()
+def init_sentry():
+    """Initialize Sentry once, only if a DSN is configured.
+
+    `sentry_sdk` is slow to import, so it is only imported when errors are
+    actually going to be reported.
+    """
+    if not os.environ.get('SENTRY_DSN'):
+        return
+
+    # pylint: disable=import-outside-toplevel
+    import sentry_sdk
+    from sentry_sdk.integrations.flask import FlaskIntegration
+    from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
+
+    sentry_sdk.init(
+        release="atmosphere@%s" % get_version(),
+        integrations=[
+            FlaskIntegration(),
+            SqlalchemyIntegration()
+        ],
+    )
 
 
 def create_app(config=None):
     """create_app"""
+    init_sentry()
     app = Flask(__name__)
+    app.cli = CommandGroup(app)
 
     if config is not None:
         app.config.from_object(config)
@@ -48,10 +120,23 @@ def create_app(config=None):
     if app.config.get('SQLALCHEMY_DATABASE_URI') is None:
         app.config['SQLALCHEMY_DATABASE_URI'] = \
                 os.environ.get('DATABASE_URI', 'sqlite:///:memory:')
+    if app.config.get('SQLALCHEMY_READ_DATABASE_URI') is None:
+        app.config['SQLALCHEMY_READ_DATABASE_URI'] = \
+                os.environ.get('DATABASE_READ_URI')
+    if app.config.get('SQLALCHEMY_READ_ENGINE_OPTIONS') is None:
+        app.config['SQLALCHEMY_READ_ENGINE_OPTIONS'] = {}
+    if app.config.get('SQLALCHEMY_READ_MAX_STALENESS') is None:
+        app.config['SQLALCHEMY_READ_MAX_STALENESS'] = \
+                float(os.environ.get('DATABASE_READ_MAX_STALENESS', 5))
+    if app.config.get('SQLALCHEMY_READ_LAG_CHECK_INTERVAL') is None:
+        app.config['SQLALCHEMY_READ_LAG_CHECK_INTERVAL'] = float(
+            os.environ.get('DATABASE_READ_LAG_CHECK_INTERVAL', 1))
     if app.config['DEBUG']:
         app.config['SQLALCHEMY_ECHO'] = True
 
     models.db.init_app(app)
+    statements.init_app(app)
+    profiler.init_app(app)
 
     package_dir = os.path.abspath(os.path.dirname(__file__))
     migrations_path = os.path.join(package_dir, 'migrations')
@@ -0,0 +1,117 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Archive
+
+Moves the periods which were closed before the retention window
+(`PERIOD_RETENTION_DAYS`) from the `period` table into `period_archive`.
+This is done in small batches, each in its own transaction, so that neither
+table is locked for long.  It is meant to run periodically using the
+`flask archive periods` command.  The change feed is pruned the same way
+after `CHANGE_RETENTION_DAYS` using `flask archive changes`.
+"""
+
+import datetime
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select
+
+from atmosphere import models
+from atmosphere.models import db
+
+
+def archive_periods(before, batch_size=1000, sleep=0):
+    """Archive the periods closed before a date and return how many."""
+    period = models.Period.__table__
+    archive = models.ArchivedPeriod.__table__
+    bucket = models.PeriodBucket.__table__
+    columns = [period.c[c.name] for c in archive.columns]
+
+    total = 0
+    while True:
+        query = select([period.c.id]).where(
+            period.c.ended_at < before).order_by(period.c.id).limit(batch_size)
+        ids = [row.id for row in db.session.execute(query)]
+        if not ids:
+            break
+
+        db.session.execute(archive.insert().from_select(
+            [c.name for c in columns],
+            select(columns).where(period.c.id.in_(ids))))
+        db.session.execute(
+            bucket.delete().where(bucket.c.period_id.in_(ids)))
+        db.session.execute(period.delete().where(period.c.id.in_(ids)))
+        db.session.commit()
+
+        total += len(ids)
+        if sleep:
+            time.sleep(sleep)
+
+    return total
+
+
+cli = AppGroup('archive', help='Manage archived data.')
+
+
+@cli.command('periods')
+@click.option('--retention-days', type=int,
+              help='Archive periods closed before this many days ago.')
+@click.option('--batch-size', type=int, default=1000, show_default=True,
+              help='Number of periods to archive per transaction.')
+@click.option('--sleep', type=float, default=0, show_default=True,
+              help='Seconds to sleep between batches.')
+def archive_periods_command(retention_days, batch_size, sleep):
+    """Move old closed periods into the archive table."""
+    if retention_days is None:
+        retention_days = current_app.config['PERIOD_RETENTION_DAYS']
+    before = datetime.datetime.now() - datetime.timedelta(days=retention_days)
+
+    total = archive_periods(before, batch_size=batch_size, sleep=sleep)
+    click.echo('Archived %d periods closed before %s' %
+               (total, before.isoformat()))
+
+
+@cli.command('changes')
+@click.option('--retention-days', type=int,
+              help='Delete changes recorded before this many days ago.')
+@click.option('--batch-size', type=int, default=1000, show_default=True,
+              help='Number of changes to delete per transaction.')
+@click.option('--sleep', type=float, default=0, show_default=True,
+              help='Seconds to sleep between batches.')
+def prune_changes_command(retention_days, batch_size, sleep):
+    """Delete old rows of the change feed."""
+    if retention_days is None:
+        retention_days = current_app.config['CHANGE_RETENTION_DAYS']
+    before = datetime.datetime.now() - datetime.timedelta(days=retention_days)
+
+    total = models.ResourceChange.prune(before, batch_size=batch_size,
+                                        sleep=sleep)
+    click.echo('Deleted %d changes recorded before %s' %
+               (total, before.isoformat()))
+
+
+def init_app(app):
+    """init_app"""
+    if app.config.get('PERIOD_RETENTION_DAYS') is None:
+        app.config['PERIOD_RETENTION_DAYS'] = \
+                int(os.environ.get('PERIOD_RETENTION_DAYS', 365))
+    if app.config.get('CHANGE_RETENTION_DAYS') is None:
+        app.config['CHANGE_RETENTION_DAYS'] = \
+                int(os.environ.get('CHANGE_RETENTION_DAYS', 30))
+
+    app.cli.add_command(cli)
@@ -0,0 +1,239 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bulk import
+
+Offline import of historical Ceilometer events from JSONL dumps (optionally
+gzipped), used to backfill a region without going through the ingress API.
+The events are grouped by resource (along with the deletions of its
+project) and sorted by `generated`, then every resource is built in memory
+following the same rules as `Resource.get_or_create()` and the rows are
+inserted in large batches.
+
+This expects nothing else to be writing to the database while it runs, and
+skips resources which already exist.
+"""
+
+import collections
+import gzip
+import json
+
+import click
+from flask.cli import with_appcontext
+
+from atmosphere import event_archive
+from atmosphere import exceptions
+from atmosphere import models
+from atmosphere import utils
+from atmosphere.models import db
+
+
+def read_dump(path):
+    """Read the events of a JSONL dump, gzipped if it ends with `.gz`."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as dump:
+        for line in dump:
+            if line.strip():
+                yield json.loads(line)
+
+
+class SpecCache:
+    """Specs by digest, creating the missing ones as needed."""
+
+    def __init__(self):
+        self.ids = dict(db.session.query(models.Spec.digest, models.Spec.id))
+
+    def get_id(self, spec_cls, event):
+        """Get the ID of the spec of an event."""
+        attributes = {name: event['traits'][name]
+                      for name in spec_cls.get_attribute_names()}
+        digest = models.Spec.get_digest(
+            spec_cls.__mapper__.polymorphic_identity, attributes)
+        if digest not in self.ids:
+            spec = spec_cls(digest=digest, **attributes)
+            db.session.add(spec)
+            db.session.flush()
+            self.ids[digest] = spec.id
+        return self.ids[digest]
+
+
+def build_resource(events, specs):
+    """Build a resource and its periods from its sorted events.
+
+    This mirrors `Resource.get_or_create()` being called for each event (and
+    `Resource.close_project()` for project deletions), and returns the
+    resource row (`None` if no event created it) and the list of its period
+    rows.
+    """
+    resource = None
+    periods = []
+    for event in events:
+        if event['event_type'] == models.PROJECT_DELETED:
+            if resource is None:
+                continue
+            ended_at = event['generated']
+            resource['updated_at'] = max(resource['updated_at'], ended_at)
+            if periods and periods[-1]['ended_at'] is None and \
+                    periods[-1]['started_at'] <= ended_at:
+                periods[-1]['ended_at'] = ended_at
+            continue
+
+        try:
+            resource_cls, spec_cls = models.get_model_type_from_event(
+                event['event_type'])
+        except (exceptions.IgnoredEvent, exceptions.UnsupportedEventType):
+            continue
+
+        traits = event['traits']
+        if resource is None:
+            resource = {
+                'uuid': traits['resource_id'],
+                'type': resource_cls.__mapper__.polymorphic_identity,
+                'project': traits['project_id'],
+                'updated_at': event['generated'],
+            }
+        if resource['updated_at'] > event['generated']:
+            continue
+        if resource_cls.is_event_ignored(event):
+            continue
+
+        spec_id = specs.get_id(spec_cls, event)
+
+        if not periods:
+            started_at = traits.get('created_at') or traits.get('launched_at')
+            if started_at is None:
+                continue
+            periods.append({'started_at': started_at, 'ended_at': None,
+                            'spec_id': spec_id})
+
+        period = periods[-1]
+        if period['ended_at'] is not None:
+            continue
+
+        if resource_cls.is_event_delete(event):
+            period['ended_at'] = traits.get('deleted_at', event['generated'])
+        elif period['spec_id'] != spec_id:
+            period['ended_at'] = event['generated']
+            periods.append({'started_at': event['generated'],
+                            'ended_at': None, 'spec_id': spec_id})
+
+        resource['updated_at'] = event['generated']
+
+    return resource, periods
+
+
+class Importer:
+    """Importer"""
+
+    def __init__(self, batch_size=10000):
+        self.batch_size = batch_size
+        self.specs = SpecCache()
+        self.period_id = models.Period.get_last_id()
+        self.rows = {models.Resource: [], models.Period: [],
+                     models.PeriodBucket: []}
+        self.counts = collections.Counter()
+
+    def add(self, events):
+        """Build and queue the rows of a resource from its events."""
+        resource, periods = build_resource(events, self.specs)
+        if resource is None:
+            self.counts['skipped'] += 1
+            return
+
+        self.rows[models.Resource].append(resource)
+        for period in periods:
+            self.period_id += 1
+            period['id'] = self.period_id
+            period['resource_uuid'] = resource['uuid']
+            period['duration_ms'] = models.Period.get_duration_ms(
+                period['started_at'], period['ended_at'])
+            self.rows[models.Period].append(period)
+            if period['ended_at'] is not None:
+                self.rows[models.PeriodBucket].extend(
+                    models.PeriodBucket.get_rows(period['id'],
+                                                 period['started_at'],
+                                                 period['ended_at']))
+
+        self.counts['resources'] += 1
+        self.counts['periods'] += len(periods)
+        if len(self.rows[models.Period]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Insert the queued rows."""
+        models.ResourceChange.record(
+            db.session, [(r['uuid'], r['project'])
+                         for r in self.rows[models.Resource]])
+        for model, rows in self.rows.items():
+            if rows:
+                db.session.execute(model.__table__.insert(), rows)
+            del rows[:]
+        db.session.commit()
+
+
+def import_events(events, batch_size=10000):
+    """Import raw events and return the counts of what was imported."""
+    by_resource = collections.defaultdict(list)
+    deletions = collections.defaultdict(list)
+    for event in events:
+        if event['event_type'] == models.PROJECT_DELETED:
+            project = event_archive.get_trait(event, 'project_id')
+            deletions[project].append(event)
+            continue
+        resource_id = event_archive.get_trait(event, 'resource_id')
+        if resource_id is not None:
+            by_resource[resource_id].append(event)
+
+    existing = set()
+    uuids = sorted(by_resource)
+    for i in range(0, len(uuids), 1000):
+        existing.update(uuid for uuid, in db.session.query(
+            models.Resource.uuid).filter(
+                models.Resource.uuid.in_(uuids[i:i + 1000])))
+
+    importer = Importer(batch_size=batch_size)
+    importer.counts['existing'] = len(existing)
+    for uuid in uuids:
+        if uuid in existing:
+            continue
+        events = by_resource.pop(uuid)
+        project = event_archive.get_trait(events[0], 'project_id')
+        events = [utils.normalize_event(dict(e))
+                  for e in events + deletions.get(project, [])]
+        events.sort(key=lambda e: e['generated'])
+        importer.add(events)
+    importer.flush()
+
+    return importer.counts
+
+
+@click.command('import')
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--batch-size', type=int, default=10000, show_default=True,
+              help='Number of periods to insert per transaction.')
+@with_appcontext
+def import_command(paths, batch_size):
+    """Import JSONL (or gzipped JSONL) dumps of Ceilometer events."""
+    def read_all():
+        for path in paths:
+            yield from read_dump(path)
+
+    counts = import_events(read_all(), batch_size=batch_size)
+    click.echo(', '.join('%s: %d' % (key, counts[key]) for key in (
+        'resources', 'periods', 'existing', 'skipped')))
+
+
+def init_app(app):
+    """init_app"""
+    event_archive.cli.add_command(import_command)
@@ -0,0 +1,162 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Token cache
+
+The `auth_token` middleware can use any object with a memcache-like interface
+that it finds in the WSGI environment (using the `cache` option) to store the
+result of token validations.  The caches in here are meant to be used that
+way in deployments that do not have memcached, keyed by the token hash that
+`auth_token` already generates.
+"""
+
+import collections
+import json
+import threading
+import time
+
+from dateutil import parser
+
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+ENVIRON_KEY = 'atmosphere.token_cache'
+
+
+def _get_expiry(value):
+    """Get the expiry time of a cached token (if it has one)."""
+    try:
+        data = json.loads(value)
+        expires_at = data['token']['expires_at']
+        return parser.isoparse(expires_at).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenCache:
+    """Bounded in-process TTL-LRU token cache
+
+    Entries are kept for the lowest of the time requested by `auth_token`,
+    the configured TTL (which should be kept under the revocation interval
+    of the deployment) and the expiry of the token itself.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_timeout(self, value, ttl=0):
+        """Get the number of seconds that a value can be cached for."""
+        timeout = self.ttl
+        if ttl:
+            timeout = min(timeout, ttl)
+
+        expiry = _get_expiry(value)
+        if expiry is not None:
+            timeout = min(timeout, expiry - time.time())
+
+        return timeout
+
+    def get(self, key):
+        """get"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+
+            deadline, value = entry
+            if deadline <= time.time():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, **kwargs):
+        """set"""
+        timeout = self._get_timeout(value, kwargs.get('time', 0))
+        if timeout <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (time.time() + timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """delete"""
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class UwsgiTokenCache(TokenCache):
+    """Token cache shared across uWSGI workers
+
+    This stores tokens inside a uWSGI cache, which lives in shared memory
+    (or a memory-mapped file) and so is shared by all the workers of an
+    instance.  The size and eviction policy of the cache are configured in
+    uWSGI, for example using `--cache2 name=tokens,items=1024,purge_lru=1`.
+    """
+
+    def __init__(self, name='tokens', ttl=300):
+        if uwsgi is None:
+            raise RuntimeError('uWSGI token cache requires running in uWSGI')
+
+        super().__init__(ttl=ttl)
+        self.name = name
+
+    def get(self, key):
+        """get"""
+        return uwsgi.cache_get(key, self.name)
+
+    def set(self, key, value, **kwargs):
+        """set"""
+        timeout = int(self._get_timeout(value, kwargs.get('time', 0)))
+        if timeout <= 0:
+            return
+        uwsgi.cache_update(key, value, timeout, self.name)
+
+    def delete(self, key):
+        """delete"""
+        uwsgi.cache_del(key, self.name)
+
+
+def get_token_cache(config):
+    """Get the token cache configured for an application (if any)."""
+    backend = config.get('TOKEN_CACHE')
+    ttl = config.get('TOKEN_CACHE_TTL')
+
+    if backend == 'memory':
+        return TokenCache(maxsize=config.get('TOKEN_CACHE_SIZE'), ttl=ttl)
+    if backend == 'uwsgi':
+        return UwsgiTokenCache(name=config.get('TOKEN_CACHE_NAME'), ttl=ttl)
+    return None
+
+
+class TokenCacheMiddleware:
+    """Expose a token cache to `auth_token` using the WSGI environment."""
+
+    def __init__(self, app, cache):
+        self.app = app
+        self.cache = cache
+
+    def __call__(self, environ, start_response):
+        environ[ENVIRON_KEY] = self.cache
+        return self.app(environ, start_response)
@@ -0,0 +1,120 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compaction
+
+Merges consecutive closed periods of a resource which share the same spec
+(where one ends exactly when the next one starts) into a single period.
+Resources are walked in batches, each compacted in its own transaction with
+the resources locked so that ingest does not race with it.  Open periods
+are never touched.
+"""
+
+import time
+
+import click
+from flask.cli import AppGroup
+
+from atmosphere import models
+from atmosphere.models import db
+
+
+def get_merges(periods):
+    """Get the chains of periods to merge.
+
+    The periods must be sorted by resource and start time, this returns a
+    list of chains (each a list of at least two periods).
+    """
+    chains = []
+    chain = []
+    for period in periods:
+        if chain and chain[-1].resource_uuid == period.resource_uuid and \
+                chain[-1].spec_id == period.spec_id and \
+                chain[-1].ended_at == period.started_at:
+            chain.append(period)
+            continue
+        if len(chain) > 1:
+            chains.append(chain)
+        chain = [period]
+    if len(chain) > 1:
+        chains.append(chain)
+    return chains
+
+
+def compact_batch(uuids):
+    """Compact the periods of some resources and return the rows reclaimed."""
+    models.Resource.query.filter(
+        models.Resource.uuid.in_(uuids)
+    ).with_entities(models.Resource.uuid).with_for_update().all()
+
+    periods = models.Period.query.filter(
+        models.Period.resource_uuid.in_(uuids),
+        models.Period.ended_at.isnot(None),
+    ).order_by(models.Period.resource_uuid, models.Period.started_at)
+
+    reclaimed = 0
+    for chain in get_merges(periods):
+        chain[0].ended_at = chain[-1].ended_at
+        for period in chain[1:]:
+            db.session.delete(period)
+        reclaimed += len(chain) - 1
+    db.session.commit()
+
+    return reclaimed
+
+
+def compact_periods(batch_size=1000, sleep=0):
+    """Compact the periods of every resource and return the rows reclaimed."""
+    reclaimed = 0
+    last = None
+    while True:
+        query = db.session.query(models.Resource.uuid).order_by(
+            models.Resource.uuid)
+        if last is not None:
+            query = query.filter(models.Resource.uuid > last)
+        uuids = [uuid for uuid, in query.limit(batch_size)]
+        if not uuids:
+            break
+
+        reclaimed += compact_batch(uuids)
+        last = uuids[-1]
+        if sleep:
+            time.sleep(sleep)
+
+    return reclaimed
+
+
+cli = AppGroup('compact', help='Compact stored data.')
+
+
+@cli.command('periods')
+@click.option('--batch-size', type=int, default=1000, show_default=True,
+              help='Number of resources to compact per transaction.')
+@click.option('--sleep', type=float, default=0, show_default=True,
+              help='Seconds to sleep between batches.')
+@click.option('--interval', type=float,
+              help='Keep running, compacting every this many seconds.')
+def compact_periods_command(batch_size, sleep, interval):
+    """Merge consecutive closed periods with the same spec."""
+    while True:
+        reclaimed = compact_periods(batch_size=batch_size, sleep=sleep)
+        click.echo('Reclaimed %d periods' % reclaimed)
+        if interval is None:
+            break
+        time.sleep(interval)
+
+
+def init_app(app):
+    """init_app"""
+    app.cli.add_command(cli)
@@ -0,0 +1,218 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Data migrations
+
+Backfills which are too large to run inside an Alembic migration.  Every
+migration walks its table by primary key ranges, updating one batch per
+transaction and recording how far it got in the `data_migration` table, so
+that it can be interrupted and resumed at any time.  They are run after
+`flask db upgrade` using `flask data migrate`.
+"""
+
+import datetime
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_
+from sqlalchemy import BigInteger
+from sqlalchemy import select
+from sqlalchemy import type_coerce
+
+from atmosphere import models
+from atmosphere.models import db
+
+MIGRATIONS = {}
+
+
+def register(migration):
+    """Register a data migration class."""
+    MIGRATIONS[migration.name] = migration
+    return migration
+
+
+class DataMigration:
+    """DataMigration
+
+    Subclasses set `name` and `table`, and implement `migrate_range()`.
+    """
+
+    name = None
+    table = None
+
+    @property
+    def key(self):
+        """Primary key column used to walk the table."""
+        return list(self.table.primary_key.columns)[0]
+
+    def get_range_clause(self, lower, upper):
+        """Get the clause matching keys in the `(lower, upper]` range."""
+        clauses = []
+        if lower is not None:
+            clauses.append(self.key > lower)
+        if upper is not None:
+            clauses.append(self.key <= upper)
+        return and_(*clauses)
+
+    def migrate_range(self, lower, upper):
+        """Migrate the rows with a key in the `(lower, upper]` range.
+
+        Either bound is `None` when the range is open on that side.
+        """
+        raise NotImplementedError
+
+    def get_state(self):
+        """Get (and create if needed) the progress of this migration."""
+        state = models.DataMigrationState.query.get(self.name)
+        if state is None:
+            state = models.DataMigrationState(
+                name=self.name, updated_at=datetime.datetime.now())
+            db.session.add(state)
+        return state
+
+    def _get_upper(self, lower, batch_size):
+        query = select([self.key]).order_by(self.key)
+        if lower is not None:
+            query = query.where(self.key > lower)
+        query = query.offset(batch_size - 1).limit(1)
+        return db.session.execute(query).scalar()
+
+    def run(self, batch_size=1000, sleep=0):
+        """Run the migration until it completes and return the batch count."""
+        state = self.get_state()
+        batches = 0
+        while state.completed_at is None:
+            lower = state.last_key
+            if lower is not None:
+                lower = self.key.type.python_type(lower)
+            upper = self._get_upper(lower, batch_size)
+
+            self.migrate_range(lower, upper)
+
+            state.updated_at = datetime.datetime.now()
+            if upper is None:
+                state.completed_at = state.updated_at
+            else:
+                state.last_key = str(upper)
+            db.session.commit()
+
+            batches += 1
+            if sleep and state.completed_at is None:
+                time.sleep(sleep)
+
+        return batches
+
+
+@register
+class PeriodDuration(DataMigration):
+    """Backfill `duration_ms` of the closed periods."""
+
+    name = 'period-duration'
+    table = models.Period.__table__
+
+    def migrate_range(self, lower, upper):
+        table = self.table
+        db.session.execute(table.update().where(and_(
+            self.get_range_clause(lower, upper),
+            table.c.ended_at.isnot(None),
+            table.c.duration_ms.is_(None),
+        )).values(duration_ms=models.Period.get_duration_ms_expression(
+            type_coerce(table.c.started_at, BigInteger),
+            type_coerce(table.c.ended_at, BigInteger))))
+
+
+@register
+class ArchivedPeriodDuration(PeriodDuration):
+    """Backfill `duration_ms` of the archived periods."""
+
+    name = 'archived-period-duration'
+    table = models.ArchivedPeriod.__table__
+
+
+@register
+class ResourceChangeProject(DataMigration):
+    """Backfill `project` of the changes recorded before it was stored.
+
+    Changes of resources which were deleted since then are left without a
+    project.
+    """
+
+    name = 'resource-change-project'
+    table = models.ResourceChange.__table__
+
+    def migrate_range(self, lower, upper):
+        table = self.table
+        resource = models.Resource.__table__
+        db.session.execute(table.update().where(and_(
+            self.get_range_clause(lower, upper),
+            table.c.project.is_(None),
+        )).values(project=select([resource.c.project]).where(
+            resource.c.uuid == table.c.resource_uuid).as_scalar()))
+
+
+cli = AppGroup('data', help='Manage online data migrations.')
+
+
+@cli.command('migrate')
+@click.argument('names', nargs=-1)
+@click.option('--batch-size', type=int,
+              help='Number of rows to migrate per transaction.')
+@click.option('--sleep', type=float,
+              help='Seconds to sleep between batches.')
+def migrate_command(names, batch_size, sleep):
+    """Run pending data migrations (all of them by default)."""
+    if batch_size is None:
+        batch_size = current_app.config['DATA_MIGRATION_BATCH_SIZE']
+    if sleep is None:
+        sleep = current_app.config['DATA_MIGRATION_SLEEP']
+
+    for name in names or MIGRATIONS:
+        if name not in MIGRATIONS:
+            raise click.ClickException('Unknown data migration: %s' % name)
+        batches = MIGRATIONS[name]().run(batch_size=batch_size, sleep=sleep)
+        click.echo('%s: migrated %d batches' % (name, batches))
+
+
+@cli.command('status')
+def status_command():
+    """Show the progress of every data migration."""
+    for name in MIGRATIONS:
+        state = models.DataMigrationState.query.get(name)
+        if state is None:
+            status = 'pending'
+        elif state.completed_at is not None:
+            status = 'completed at %s' % state.completed_at.isoformat()
+        else:
+            status = 'in progress (last key: %s)' % state.last_key
+        click.echo('%s: %s' % (name, status))
+
+
+def init_app(app):
+    """init_app"""
+    defaults = {
+        'DATA_MIGRATION_BATCH_SIZE': 1000,
+        'DATA_MIGRATION_SLEEP': 0,
+    }
+    for key, default in defaults.items():
+        if app.config.get(key) is None:
+            app.config[key] = os.environ.get(key, default)
+    app.config['DATA_MIGRATION_BATCH_SIZE'] = \
+        int(app.config['DATA_MIGRATION_BATCH_SIZE'])
+    app.config['DATA_MIGRATION_SLEEP'] = \
+        float(app.config['DATA_MIGRATION_SLEEP'])
+
+    app.cli.add_command(cli)
@@ -0,0 +1,550 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Event archive
+
+Keeps an append-only copy of the raw events received by the ingress API in
+`EVENT_ARCHIVE_DIR`, so that resources and periods can be rebuilt from them
+using `flask events rebuild` after fixing how events are processed.
+
+Every process writes gzipped JSON lines into its own segment, which is
+completed after `EVENT_ARCHIVE_SEGMENT_EVENTS` events.  A completed segment
+gets an index next to it with its time range, resources and projects, so
+that a rebuild only reads the segments it needs.
+"""
+
+import atexit
+import collections
+import copy
+import glob
+import gzip
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import click
+from dateutil import parser
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event as sa_event
+from sqlalchemy import func
+from sqlalchemy import select
+
+from atmosphere import exceptions
+from atmosphere import models
+from atmosphere import utils
+from atmosphere.models import db
+
+SEGMENT_SUFFIX = '.jsonl.gz'
+INDEX_SUFFIX = '.idx'
+
+_COUNTER = itertools.count()
+
+
+def get_trait(event, name):
+    """Get the value of a trait of a raw event."""
+    for trait in event.get('traits', []):
+        if trait[0] == name:
+            return trait[2]
+    return None
+
+
+def get_index_path(path):
+    """get_index_path"""
+    return path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+
+class SegmentWriter:
+    """SegmentWriter"""
+
+    def __init__(self, directory, max_events):
+        self.directory = directory
+        self.max_events = max_events
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.path = None
+        self.file = None
+        self.index = None
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        name = '%d-%d-%d' % (time.time() * 1000000, self.pid, next(_COUNTER))
+        self.path = os.path.join(self.directory, name + SEGMENT_SUFFIX)
+        self.file = gzip.open(self.path, 'wt', encoding='utf-8')
+        self.index = {'events': 0, 'start': None, 'end': None,
+                      'resources': set(), 'projects': set()}
+
+    def _add_to_index(self, event):
+        generated = parser.parse(event['generated']).isoformat()
+        index = self.index
+        index['events'] += 1
+        if index['start'] is None or generated < index['start']:
+            index['start'] = generated
+        if index['end'] is None or generated > index['end']:
+            index['end'] = generated
+        for key, trait in (('resources', 'resource_id'),
+                           ('projects', 'project_id')):
+            value = get_trait(event, trait)
+            if value is not None:
+                index[key].add(value)
+
+    def write(self, events, flush=True):
+        """Append events to the current segment."""
+        with self.lock:
+            for event in events:
+                if self.file is None:
+                    self._open()
+                self.file.write(json.dumps(event))
+                self.file.write('\n')
+                self._add_to_index(event)
+                if self.index['events'] >= self.max_events:
+                    self._close()
+            if flush and self.file is not None:
+                self.file.flush()
+
+    def flush(self):
+        """Flush the current segment (if any)."""
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def _close(self):
+        self.file.close()
+
+        index = dict(self.index)
+        index['resources'] = sorted(index['resources'])
+        index['projects'] = sorted(index['projects'])
+        index_path = get_index_path(self.path)
+        with open(index_path + '.tmp', 'w') as index_file:
+            json.dump(index, index_file)
+        os.rename(index_path + '.tmp', index_path)
+
+        self.path = self.file = self.index = None
+
+    def close(self):
+        """Complete the current segment (if any)."""
+        with self.lock:
+            if self.file is not None:
+                self._close()
+
+
+def _get_writer(app):
+    writer = app.extensions.get('event_archive')
+    # NOTE: Workers forked after the writer was created need their own.
+    if writer is None or writer.pid != os.getpid():
+        writer = SegmentWriter(app.config['EVENT_ARCHIVE_DIR'],
+                               app.config['EVENT_ARCHIVE_SEGMENT_EVENTS'])
+        app.extensions['event_archive'] = writer
+        atexit.register(writer.close)
+    return writer
+
+
+def record(events, flush=True):
+    """Archive raw events if the archive is enabled."""
+    if current_app.config.get('EVENT_ARCHIVE_DIR'):
+        _get_writer(current_app).write(events, flush=flush)
+
+
+def flush_segment():
+    """Flush the current segment if the archive is enabled."""
+    if current_app.config.get('EVENT_ARCHIVE_DIR'):
+        _get_writer(current_app).flush()
+
+
+def get_segments(directory):
+    """Get all segments, oldest first."""
+    return sorted(glob.glob(os.path.join(directory, '*' + SEGMENT_SUFFIX)))
+
+
+def read_index(path):
+    """Read the index of a segment, `None` if it was never completed."""
+    try:
+        with open(get_index_path(path)) as index_file:
+            return json.load(index_file)
+    except FileNotFoundError:
+        return None
+
+
+def read_segment(path):
+    """Read the events of a segment, including incomplete ones."""
+    with gzip.open(path, 'rt', encoding='utf-8') as segment:
+        try:
+            for line in segment:
+                if line.endswith('\n'):
+                    yield json.loads(line)
+        except EOFError:
+            # NOTE: The segment was not completed (or is still being
+            #       written), everything flushed so far is still usable.
+            return
+
+
+def _matches(event, projects, start, end):
+    if projects is not None and get_trait(event, 'project_id') not in projects:
+        return False
+    generated = parser.parse(event['generated'])
+    if start is not None and generated < start:
+        return False
+    if end is not None and generated > end:
+        return False
+    return True
+
+
+def _is_project_deleted(event):
+    return event['event_type'] == models.PROJECT_DELETED
+
+
+def _find_project_resources(directory, projects):
+    resources = set()
+    for path in get_segments(directory):
+        index = read_index(path)
+        if index is not None and not set(index['projects']) & projects:
+            continue
+        for event in read_segment(path):
+            resource_id = get_trait(event, 'resource_id')
+            if resource_id is not None and \
+                    get_trait(event, 'project_id') in projects:
+                resources.add(resource_id)
+    return resources
+
+
+def find_resources(directory, projects=None, start=None, end=None):
+    """Get the resources with archived events matching the filters.
+
+    A matching project deletion selects every resource of that project.
+    """
+    resources = set()
+    deleted_projects = set()
+    for path in get_segments(directory):
+        index = read_index(path)
+        if index is not None:
+            if projects is not None and \
+                    not set(index['projects']) & set(projects):
+                continue
+            if start is not None and index['end'] < start.isoformat():
+                continue
+            if end is not None and index['start'] > end.isoformat():
+                continue
+        for event in read_segment(path):
+            resource_id = get_trait(event, 'resource_id')
+            if _is_project_deleted(event):
+                if _matches(event, projects, start, end):
+                    deleted_projects.add(get_trait(event, 'project_id'))
+            elif resource_id is not None and \
+                    _matches(event, projects, start, end):
+                resources.add(resource_id)
+
+    if deleted_projects:
+        resources |= _find_project_resources(directory, deleted_projects)
+    return resources
+
+
+def locate_events(directory, resources):
+    """Get the segments with archived events of some resources.
+
+    The segments of a resource include the ones with deletions of its
+    project.  This returns a dictionary of every resource to its segments,
+    oldest first, without keeping any of the events.
+    """
+    segments = collections.defaultdict(set)
+    deletions = collections.defaultdict(set)
+    projects = {}
+    skipped = []
+    for path in get_segments(directory):
+        index = read_index(path)
+        if index is not None and not set(index['resources']) & resources:
+            skipped.append((path, index))
+            continue
+        for event in read_segment(path):
+            if _is_project_deleted(event):
+                deletions[get_trait(event, 'project_id')].add(path)
+                continue
+            resource_id = get_trait(event, 'resource_id')
+            if resource_id in resources:
+                segments[resource_id].add(path)
+                projects.setdefault(resource_id,
+                                    get_trait(event, 'project_id'))
+
+    # NOTE: Project deletions have no resource, so the segments skipped above
+    #       are still read if they have events of the same projects.
+    for path, index in skipped:
+        if not set(index['projects']) & set(projects.values()):
+            continue
+        for event in read_segment(path):
+            if _is_project_deleted(event):
+                deletions[get_trait(event, 'project_id')].add(path)
+
+    return {uuid: sorted(paths | deletions.get(projects[uuid], set()))
+            for uuid, paths in segments.items()}
+
+
+def collect_events(segments, resources):
+    """Get all the events of some resources from segments, in order.
+
+    The events of a resource include the deletions of its project.
+    """
+    events = collections.defaultdict(list)
+    deletions = collections.defaultdict(list)
+    for path in segments:
+        for event in read_segment(path):
+            if _is_project_deleted(event):
+                deletions[get_trait(event, 'project_id')].append(event)
+                continue
+            resource_id = get_trait(event, 'resource_id')
+            if resource_id in resources:
+                events[resource_id].append(event)
+
+    for resource_events in events.values():
+        project = get_trait(resource_events[0], 'project_id')
+        resource_events.extend(deletions.get(project, []))
+        resource_events.sort(key=lambda e: parser.parse(e['generated']))
+    return events
+
+
+def is_complete(uuid, events):
+    """Check if the archived events of a resource cover all of its history.
+
+    This is not the case if the archive was enabled after the resource was
+    created, which shows as a stored period starting before the creation
+    time of its first archived event, or ending before that event.
+    """
+    first = next(e for e in events if not _is_project_deleted(e))
+    first = utils.normalize_event(copy.deepcopy(first))
+    created_at = first['traits'].get('created_at') or \
+        first['traits'].get('launched_at')
+
+    for model in (models.Period, models.ArchivedPeriod):
+        started_at, ended_at = db.session.query(
+            func.min(model.started_at), func.min(model.ended_at),
+        ).filter(model.resource_uuid == uuid).one()
+        if started_at is None:
+            continue
+        if created_at is None:
+            return False
+        # NOTE: Stored times can be rounded to the millisecond.
+        if models.Period.get_duration_ms(started_at, created_at) > 0:
+            return False
+        if ended_at is not None and models.Period.get_duration_ms(
+                ended_at, first['generated']) > 0:
+            return False
+    return True
+
+
+def delete_resources(uuids):
+    """Delete resources with all their periods, without committing."""
+    period = models.Period.__table__
+    period_ids = select([period.c.id]).where(period.c.resource_uuid.in_(uuids))
+    bucket = models.PeriodBucket.__table__
+    archive = models.ArchivedPeriod.__table__
+    resource = models.Resource.__table__
+
+    deleted = db.session.execute(select([
+        resource.c.uuid, resource.c.project
+    ]).where(resource.c.uuid.in_(uuids))).fetchall()
+
+    db.session.execute(
+        bucket.delete().where(bucket.c.period_id.in_(period_ids)))
+    db.session.execute(
+        period.delete().where(period.c.resource_uuid.in_(uuids)))
+    db.session.execute(
+        archive.delete().where(archive.c.resource_uuid.in_(uuids)))
+    db.session.execute(resource.delete().where(resource.c.uuid.in_(uuids)))
+    models.ResourceChange.record(db.session, [tuple(r) for r in deleted])
+
+
+def replay(uuid, events):
+    """Replay the events of a resource and return the outcome counts.
+
+    Project deletions only close the periods of this resource.
+    """
+    counts = collections.Counter()
+    for event in events:
+        event = utils.normalize_event(copy.deepcopy(event))
+        try:
+            if _is_project_deleted(event):
+                models.Resource.close_project(event['traits']['project_id'],
+                                              event['generated'],
+                                              uuids=[uuid])
+            else:
+                models.Resource.get_or_create(event)
+        except exceptions.EventTooOld:
+            counts['too_old'] += 1
+        except exceptions.IgnoredEvent:
+            counts['ignored'] += 1
+        except exceptions.UnsupportedEventType:
+            counts['unsupported'] += 1
+        except exceptions.MultipleOpenPeriods:
+            db.session.rollback()
+            counts['conflict'] += 1
+        else:
+            counts['applied'] += 1
+    return counts
+
+
+def rebuild_resource(uuid, events):
+    """Replace a resource by replaying its events.
+
+    The resource is deleted and replayed in a single transaction, so that
+    it keeps its existing periods if the replay fails.  Processing events
+    commits as it goes, so these commits only release a savepoint (and
+    start the next one) until the replay is done.  Resources whose history
+    is not complete in the archive are left as they are and counted as
+    `incomplete`.
+    """
+    if not is_complete(uuid, events):
+        db.session.rollback()
+        return collections.Counter(incomplete=1)
+
+    session = db.session()
+    outer = session.transaction
+
+    def restart_savepoint(_, transaction):
+        if transaction.nested and transaction.parent is outer:
+            # Expire everything like a commit would, since the periods can
+            # be changed by set-based updates.
+            session.expire_all()
+            session.begin_nested()
+
+    # NOTE: pysqlite only starts a transaction when writing, so delete
+    #       before starting the first savepoint.
+    delete_resources([uuid])
+    session.begin_nested()
+    sa_event.listen(session, 'after_transaction_end', restart_savepoint)
+    try:
+        counts = replay(uuid, events)
+    except BaseException:
+        sa_event.remove(session, 'after_transaction_end', restart_savepoint)
+        # Roll back the savepoint, then the transaction around it
+        session.rollback()
+        session.rollback()
+        raise
+    sa_event.remove(session, 'after_transaction_end', restart_savepoint)
+    session.commit()
+    session.commit()
+    return counts
+
+
+def rebuild_partition(partition):
+    """Rebuild a partition of `(uuid, segments)` pairs.
+
+    Only the events of the resources of the partition are loaded, from the
+    segments which have any of them.
+    """
+    segments = sorted(set().union(*(paths for _, paths in partition)))
+    events = collect_events(segments, {uuid for uuid, _ in partition})
+
+    counts = collections.Counter()
+    for uuid, _ in partition:
+        counts.update(rebuild_resource(uuid, events.pop(uuid)))
+    return counts
+
+
+_WORKER_APP = None
+
+
+def _init_worker(config):
+    # pylint: disable=global-statement,import-outside-toplevel
+    global _WORKER_APP
+    from atmosphere.app import create_app
+
+    _WORKER_APP = create_app(type('Config', (), config))
+
+
+def _replay_partition(partition):
+    with _WORKER_APP.app_context():
+        return rebuild_partition(partition)
+
+
+def rebuild(directory, projects=None, start=None, end=None, processes=1,
+            batch_size=1000):
+    """Rebuild resources and periods from the archive.
+
+    This rebuilds every resource with an archived event matching the
+    filters, replaying all of its archived events (not only the ones in the
+    time window) so that its history is complete.  Every resource is
+    rebuilt in its own transaction.  Resources are partitioned in batches
+    of `batch_size` across a pool of processes, which read the events of
+    their batch from the segments, so that only the events of one batch per
+    process are in memory at once.
+    """
+    resources = find_resources(directory, projects, start, end)
+    segments = locate_events(directory, resources)
+
+    ordered = sorted(segments.items())
+    partitions = [ordered[i:i + batch_size]
+                  for i in range(0, len(ordered), batch_size)]
+    counts = collections.Counter()
+    if processes <= 1:
+        for partition in partitions:
+            counts.update(rebuild_partition(partition))
+    else:
+        config = {'SQLALCHEMY_DATABASE_URI':
+                  current_app.config['SQLALCHEMY_DATABASE_URI']}
+        with multiprocessing.Pool(processes, _init_worker,
+                                  (config,)) as pool:
+            for partition_counts in pool.imap_unordered(
+                    _replay_partition, partitions):
+                counts.update(partition_counts)
+
+    counts['resources'] = len(resources)
+    return counts
+
+
+cli = AppGroup('events', help='Manage the raw event archive.')
+
+
+@cli.command('rebuild')
+@click.option('--directory', help='Archive directory to replay.')
+@click.option('--project', 'projects', multiple=True,
+              help='Only rebuild resources of this project.')
+@click.option('--start', type=click.DateTime(),
+              help='Only rebuild resources with events after this time.')
+@click.option('--end', type=click.DateTime(),
+              help='Only rebuild resources with events before this time.')
+@click.option('--processes', type=int, default=os.cpu_count(),
+              show_default=True, help='Number of worker processes.')
+@click.option('--batch-size', type=int, default=1000, show_default=True,
+              help='Number of resources whose events are loaded at once.')
+def rebuild_command(directory, projects, start, end, processes, batch_size):
+    """Rebuild resources and periods from the archived events."""
+    directory = directory or current_app.config['EVENT_ARCHIVE_DIR']
+    if not directory:
+        raise click.ClickException('No event archive directory configured')
+
+    counts = rebuild(directory, projects=projects or None, start=start,
+                     end=end, processes=processes, batch_size=batch_size)
+    click.echo(', '.join('%s: %d' % (key, counts[key]) for key in (
+        'resources', 'applied', 'too_old', 'ignored', 'unsupported',
+        'conflict', 'incomplete')))
+    if counts['incomplete']:
+        click.echo('Warning: %d resources were left as they are, since their '
+                   'history started before the archive' % counts['incomplete'],
+                   err=True)
+
+
+def init_app(app):
+    """init_app"""
+    defaults = {
+        'EVENT_ARCHIVE_DIR': None,
+        'EVENT_ARCHIVE_SEGMENT_EVENTS': 100000,
+    }
+    for key, default in defaults.items():
+        if app.config.get(key) is None:
+            app.config[key] = os.environ.get(key, default)
+    app.config['EVENT_ARCHIVE_SEGMENT_EVENTS'] = \
+        int(app.config['EVENT_ARCHIVE_SEGMENT_EVENTS'])
+
+    app.cli.add_command(cli)
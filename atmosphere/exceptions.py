@@ -29,6 +29,11 @@ class MultipleOpenPeriods(exceptions.Conflict):
     description = 'Multiple open periods'
 
 
+class TooManyResources(exceptions.BadRequest):
+    """TooManyResources"""
+    description = 'Too many resources matched the query'
+
+
 class IgnoredEvent(Exception):
     """IgnoredEvent"""
     description = 'Ignored event type'
@@ -0,0 +1,93 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Metrics
+
+Prometheus metrics for both applications, exposed at `/metrics`.  When
+running with multiple uWSGI workers, `PROMETHEUS_MULTIPROC_DIR` must point to
+an empty directory shared by all of them *before* the application is
+imported, so that every worker writes its samples there and any of them can
+serve the aggregated metrics.
+"""
+
+import os
+
+import prometheus_client
+from prometheus_client import multiprocess
+from sqlalchemy import pool
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+INGEST_STAGE_SECONDS = prometheus_client.Histogram(
+    'atmosphere_ingest_stage_seconds',
+    'Time spent in each stage of processing incoming events',
+    ['stage'],
+)
+
+INGEST_EVENTS = prometheus_client.Counter(
+    'atmosphere_ingest_events_total',
+    'Number of incoming events processed, by outcome',
+    ['outcome'],
+)
+
+USAGE_QUERY_SECONDS = prometheus_client.Histogram(
+    'atmosphere_usage_query_seconds',
+    'Time spent querying resources for the usage API',
+)
+
+USAGE_QUERY_RESOURCES = prometheus_client.Histogram(
+    'atmosphere_usage_query_resources',
+    'Number of resources returned by usage API queries',
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000, float('inf')),
+)
+
+DB_POOL_CHECKOUT_SECONDS = prometheus_client.Histogram(
+    'atmosphere_db_pool_checkout_seconds',
+    'Time spent waiting to check out a connection from the pool',
+)
+
+
+def stage(name):
+    """Time a stage of event processing (as a decorator or context)."""
+    return INGEST_STAGE_SECONDS.labels(name).time()
+
+
+class TimedQueuePool(pool.QueuePool):
+    """Queue pool which records how long connections take to check out."""
+
+    def _do_get(self):
+        with DB_POOL_CHECKOUT_SECONDS.time():
+            return super()._do_get()
+
+
+def get_registry():
+    """Get the registry to collect metrics from."""
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return prometheus_client.REGISTRY
+
+    registry = prometheus_client.CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_app(environ, start_response):
+    """WSGI application serving the metrics."""
+    app = prometheus_client.make_wsgi_app(get_registry())
+    return app(environ, start_response)
+
+
+def init_app(app):
+    """Serve metrics at `/metrics` ahead of any other middleware."""
+    app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {
+        '/metrics': metrics_app,
+    })
@@ -0,0 +1,92 @@
+"""Added spec digest.
+
+Revision ID: 5c1c2a7c9f3e
+Revises: 90ae5785df01
+Create Date: 2021-03-02 10:12:41.518204
+
+"""
+import hashlib
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1c2a7c9f3e'
+down_revision = '90ae5785df01'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+spec = sa.table(
+    'spec',
+    sa.column('id', sa.Integer),
+    sa.column('type', sa.String),
+    sa.column('digest', sa.String),
+)
+
+SPEC_TABLES = {
+    'OS::Nova::Server': sa.table(
+        'instance_spec',
+        sa.column('id', sa.Integer),
+        sa.column('instance_type', sa.String),
+        sa.column('state', sa.String),
+    ),
+    'OS::Cinder::Volume': sa.table(
+        'volume_spec',
+        sa.column('id', sa.Integer),
+        sa.column('volume_type', sa.String),
+        sa.column('volume_size', sa.String),
+        sa.column('state', sa.String),
+    ),
+}
+
+
+def get_digest(spec_type, attributes):
+    values = {k: None if v is None else str(v)
+              for k, v in attributes.items()}
+    data = json.dumps([spec_type, values], sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def upgrade():
+    op.add_column('spec', sa.Column('digest', sa.String(length=64), nullable=True))
+
+    connection = op.get_bind()
+    existing_tables = sa.inspect(connection).get_table_names()
+    update = spec.update().where(spec.c.id == sa.bindparam('spec_id')).values(
+        digest=sa.bindparam('spec_digest'))
+    for spec_type, table in SPEC_TABLES.items():
+        if table.name not in existing_tables:
+            continue
+        names = [c.name for c in table.columns if c.name != 'id']
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                sa.select(table.columns)
+                .where(table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+
+            connection.execute(update, [{
+                'spec_id': row['id'],
+                'spec_digest': get_digest(
+                    spec_type, {name: row[name] for name in names}),
+            } for row in rows])
+            last_id = rows[-1]['id']
+
+    with op.batch_alter_table('spec') as batch_op:
+        batch_op.alter_column('digest', existing_type=sa.String(length=64),
+                              nullable=False)
+        batch_op.create_index(batch_op.f('ix_spec_digest'), ['digest'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('spec') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_spec_digest'))
+        batch_op.drop_column('digest')
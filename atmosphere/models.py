@@ -20,28 +20,168 @@
 # pylint: disable=no-member
 # pylint: disable=not-an-iterable
 from datetime import datetime
+from datetime import timedelta
+import hashlib
+import json
+import time
 
 from dateutil.relativedelta import relativedelta
+from flask import g
+from flask import has_app_context
+from flask_sqlalchemy import SignallingSession
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import and_
+from sqlalchemy import case
+from sqlalchemy import cast
+from sqlalchemy import event as sa_event
 from sqlalchemy import exc
+from sqlalchemy import func
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy import orm
+from sqlalchemy import select
+from sqlalchemy import type_coerce
+from sqlalchemy import union
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import exc as orm_exc
 from sqlalchemy.types import TypeDecorator
 from sqlalchemy import or_
 
 from atmosphere import exceptions
+from atmosphere import metrics
 
 session_options = {
     'autocommit': False
 }
 
-db = SQLAlchemy(session_options=session_options)
+
+class ReadReplica:
+    """ReadReplica"""
+
+    def __init__(self):
+        self.engine = None
+        self.lag = 0
+        self.checked_at = None
+
+    def get_engine(self, app):
+        """Get (and create if needed) the engine for the read-only bind."""
+        if self.engine is None:
+            options = dict(app.config['SQLALCHEMY_READ_ENGINE_OPTIONS'])
+            if app.config['SQLALCHEMY_ECHO']:
+                options['echo'] = True
+
+            uri = make_url(app.config['SQLALCHEMY_READ_DATABASE_URI'])
+            self.engine = db.create_engine(uri, options)
+        return self.engine
+
+    def get_lag(self, app):
+        """Measure how many seconds the replica is behind the primary.
+
+        Every check appends a heartbeat to the primary, and the lag is the
+        age of the oldest heartbeat which has not reached the replica yet.
+        Replicas apply writes in order, so this covers the writes to every
+        table from every process, within one check interval.  It is
+        measured at most once every `SQLALCHEMY_READ_LAG_CHECK_INTERVAL`
+        seconds.
+        """
+        now = time.monotonic()
+        interval = app.config['SQLALCHEMY_READ_LAG_CHECK_INTERVAL']
+        if self.checked_at is not None and now - self.checked_at < interval:
+            return self.lag
+
+        heartbeat = ReplicaHeartbeat.__table__
+        primary = db.get_engine(app)
+        replica_id = self.get_engine(app).execute(
+            select([func.max(heartbeat.c.id)])).scalar()
+        missing = select([heartbeat.c.beat_at]).order_by(
+            heartbeat.c.id).limit(1)
+        if replica_id is not None:
+            missing = missing.where(heartbeat.c.id > replica_id)
+        beat_at = primary.execute(missing).scalar()
+
+        # NOTE: Before the first heartbeat, there is nothing to measure.
+        self.lag = 0
+        if beat_at is not None:
+            self.lag = max((datetime.now() - beat_at).total_seconds(), 0)
+
+        primary.execute(heartbeat.insert().values(beat_at=datetime.now()))
+        if replica_id is not None:
+            primary.execute(heartbeat.delete().where(
+                heartbeat.c.id < replica_id))
+        self.checked_at = now
+        return self.lag
+
+    def is_stale(self, app):
+        """Check if the replica is lagging more than allowed."""
+        max_staleness = app.config['SQLALCHEMY_READ_MAX_STALENESS']
+        return self.get_lag(app) > max_staleness
+
+
+def use_read_replica():
+    """Send the queries of the current request to the read-only bind."""
+    g.use_read_replica = True
+
+
+class RoutingSession(SignallingSession):
+    """Session which can send reads to a read-only bind
+
+    Queries are only sent to the read-only bind if one is configured and the
+    current request asked for it with `use_read_replica()`.  They still go to
+    the primary database if this session has written anything, or if the
+    replica is lagging more than `SQLALCHEMY_READ_MAX_STALENESS` seconds
+    behind the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        """get_bind"""
+        replica = self._get_read_replica()
+        if replica is None:
+            return super().get_bind(mapper, clause)
+        return replica.get_engine(self.app)
+
+    def _get_read_replica(self):
+        if self._flushing or self.info.get('has_written'):
+            return None
+        if not has_app_context() or not g.get('use_read_replica'):
+            return None
+        if self.app.config.get('SQLALCHEMY_READ_DATABASE_URI') is None:
+            return None
+
+        replica = self.app.extensions.setdefault('read_replica',
+                                                 ReadReplica())
+        if replica.is_stale(self.app):
+            return None
+        return replica
+
+
+@sa_event.listens_for(RoutingSession, 'after_flush')
+def _record_write(session, _):
+    session.info['has_written'] = True
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """RoutingSQLAlchemy"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        options.setdefault('poolclass', metrics.TimedQueuePool)
+        return sa_url, options
+
+
+db = RoutingSQLAlchemy(session_options=session_options)
 migrate = Migrate()
 
 
 MONTH_START = relativedelta(day=1, hour=0, minute=0, second=0, microsecond=0)
+MONTH = relativedelta(months=1)
+
+PROJECT_DELETED = 'identity.project.deleted'
 
 
+@metrics.stage('dispatch')
 def get_model_type_from_event(event):
     """get_model_type_from_event"""
     if event.startswith('compute.instance'):
@@ -102,40 +242,127 @@ class Resource(db.Model, GetOrCreateMixin):
 
     uuid = db.Column(db.String(36), primary_key=True)
     type = db.Column(db.String(32), nullable=False)
-    project = db.Column(db.String(32), nullable=False)
+    project = db.Column(db.String(32), nullable=False, index=True)
     updated_at = db.Column(db.DateTime, nullable=False)
 
-    periods = db.relationship('Period', backref='resource', lazy='joined')
+    periods = db.relationship('Period', backref='resource', lazy='joined',
+                              order_by='Period.started_at')
 
     __mapper_args__ = {
         'polymorphic_on': type
     }
 
     @classmethod
-    def get_all_by_time_range(cls, start, end, project=None):
-        """Get all resources given a specific period."""
-        query = cls.query.join(Period).filter(
-            # Resources must have started before the end
-            Period.started_at <= end,
-            # Resources must be still active or ended after start
-            or_(
-                Period.ended_at >= start,
-                Period.ended_at.is_(None)
-            ),
+    def get_all_by_time_range(cls, start, end, project=None, limit=None):
+        """Get all resources given a specific period.
+
+        The project can either be a single project ID or a list of them, in
+        which case all of them are retrieved using a single query.  If a
+        limit is given and more resources match it, `TooManyResources` is
+        raised.  Archived periods are merged back into their resources, so
+        that historical ranges are answered transparently.
+        """
+        query = Period.filter_overlapping(
+            cls.query.join(Resource.periods), start, end)
+        archived = ArchivedPeriod.query.join(Resource).filter(
+            ArchivedPeriod.started_at <= end,
+            ArchivedPeriod.ended_at >= start,
         )
 
+        if isinstance(project, str):
+            project = [project]
         if project is not None:
-            query = query.filter(Resource.project == project)
+            query = query.filter(Resource.project.in_(project))
+            archived = archived.filter(Resource.project.in_(project))
+
+        if limit is not None:
+            matches = query.with_entities(Resource.uuid).union(
+                archived.with_entities(Resource.uuid))
+            if len(matches.limit(limit + 1).all()) > limit:
+                raise exceptions.TooManyResources()
+
+        # NOTE: Only the periods overlapping the range are loaded.
+        resources = query.options(
+            orm.contains_eager(Resource.periods)
+        ).populate_existing().all()
+        resources = cls._merge_archived(resources, archived.all())
 
-        resources = query.all()
         for resource in resources:
             for period in resource.periods:
-                db.session.expunge(period)
                 if period.started_at <= start:
                     period.started_at = start
                 if period.ended_at is None or period.ended_at >= end:
                     period.ended_at = end
-            resource.periods = [p for p in resource.periods if p.seconds != 0]
+            resource.periods = sorted(
+                (p for p in resource.periods if p.seconds != 0),
+                key=lambda p: p.started_at)
+
+        return resources
+
+    @classmethod
+    def get_active(cls, project=None, at=None, limit=None):
+        """Get the resources active at a time (or now) with their period.
+
+        Only the period active at that time is loaded for every resource,
+        which is found using the index on the resource and end of periods,
+        so that periods which ended before that time are never scanned.
+        Archived periods are only looked up for a time in the past.
+        """
+        active = Period.ended_at.is_(None)
+        if at is not None:
+            active = and_(Period.started_at <= at,
+                          or_(active, Period.ended_at > at))
+        query = cls.query.join(Resource.periods).filter(active)
+
+        if isinstance(project, str):
+            project = [project]
+        if project is not None:
+            query = query.filter(Resource.project.in_(project))
+        if limit is not None:
+            query = query.limit(limit + 1)
+
+        resources = query.options(
+            orm.contains_eager(Resource.periods)
+        ).populate_existing().all()
+
+        archived = []
+        if at is not None:
+            archived = ArchivedPeriod.query.join(Resource).filter(
+                ArchivedPeriod.started_at <= at, ArchivedPeriod.ended_at > at)
+            if project is not None:
+                archived = archived.filter(Resource.project.in_(project))
+            if limit is not None:
+                archived = archived.limit(limit + 1)
+            archived = archived.all()
+
+        resources = cls._merge_archived(resources, archived)
+        if limit is not None and len(resources) > limit:
+            raise exceptions.TooManyResources()
+
+        return resources
+
+    @classmethod
+    def _merge_archived(cls, resources, archived):
+        """Detach resources and merge archived periods into them.
+
+        Resources only having archived periods are loaded without any of
+        their other periods.
+        """
+        by_uuid = {resource.uuid: resource for resource in resources}
+        missing = {p.resource_uuid for p in archived} - set(by_uuid)
+        if missing:
+            resources += cls.query.filter(
+                Resource.uuid.in_(missing)
+            ).options(orm.noload(Resource.periods)).populate_existing().all()
+            by_uuid = {resource.uuid: resource for resource in resources}
+
+        for resource in resources:
+            db.session.expunge(resource)
+            for period in resource.periods:
+                db.session.expunge(period)
+        for archived_period in archived:
+            by_uuid[archived_period.resource_uuid].periods.append(
+                archived_period.to_period())
 
         return resources
 
@@ -161,20 +388,29 @@ class Resource(db.Model, GetOrCreateMixin):
         ).with_for_update()
 
     @classmethod
-    def get_or_create(cls, event):
-        """get_or_create"""
-        resource = super(Resource, cls).get_or_create(event)
+    def get_or_create(cls, event, splice=False):
+        """get_or_create
+
+        If `splice` is set, events older than the last update are spliced
+        into the history of periods instead of being rejected.
+        """
+        with metrics.stage('resource_lookup'):
+            resource = super(Resource, cls).get_or_create(event)
 
         # If the last update is newer than our last update, we assume that
         # another event has been processed that is newer (so we should ignore
         # this one).
         time = event['generated']
         if resource.updated_at is not None and resource.updated_at > time:
+            if splice:
+                with metrics.stage('splice'):
+                    return resource.splice(event)
             print('Event Too Old')
             raise exceptions.EventTooOld()
 
         # Update the last updated_at time now so any older events get rejected
-        db.session.commit()
+        with metrics.stage('commit'):
+            db.session.commit()
 
         # Check if we should ignore event
         if resource.__class__.is_event_ignored(event):
@@ -182,10 +418,13 @@ class Resource(db.Model, GetOrCreateMixin):
             raise exceptions.IgnoredEvent
 
         # Retrieve spec for this event
-        spec = Spec.get_or_create(event)
+        with metrics.stage('spec_lookup'):
+            spec = Spec.get_or_create(event)
 
-        # No existing period, start our first period.
-        if len(resource.periods) == 0:
+        # No existing period, start our first period (unless all of them have
+        # been archived, which means the resource is long gone).
+        if len(resource.periods) == 0 and \
+                not ArchivedPeriod.exists_for(resource):
             resource.periods.append(Period(
                 started_at=event['traits'].get('created_at') or
                 event['traits'].get('launched_at'),
@@ -217,10 +456,117 @@ class Resource(db.Model, GetOrCreateMixin):
 
         # Bump updated_at to event time (in order to avoid conflicts)
         resource.updated_at = time
-        db.session.commit()
+        with metrics.stage('commit'):
+            db.session.commit()
 
         return resource
 
+    @classmethod
+    def close_project(cls, project, ended_at, uuids=None):
+        """Close every open period of a project using set-based updates.
+
+        If `uuids` is set, only the periods of these resources are closed.
+        This returns the number of periods which were closed.
+        """
+        resource = Resource.__table__
+        period = Period.__table__
+
+        resources = resource.c.project == project
+        if uuids is not None:
+            resources = and_(resources, resource.c.uuid.in_(uuids))
+
+        # NOTE: Resources are updated (and locked) first, in the same order
+        #       as ingest does, to avoid deadlocks.
+        db.session.execute(resource.update().where(and_(
+            resources,
+            resource.c.updated_at < ended_at,
+        )).values(updated_at=ended_at))
+
+        open_periods = and_(
+            period.c.resource_uuid.in_(
+                select([resource.c.uuid]).where(resources)),
+            period.c.ended_at.is_(None),
+            period.c.started_at <= ended_at,
+        )
+        # NOTE: The resources are locked, so the periods selected here are
+        #       exactly the ones closed by the update below.
+        rows = db.session.execute(
+            select([period.c.id, period.c.resource_uuid,
+                    period.c.started_at]).where(open_periods)
+        ).fetchall()
+
+        if rows:
+            ended_at_ms = ended_at.timestamp() * 1000
+            started_at = type_coerce(period.c.started_at, db.BigInteger)
+            db.session.execute(period.update().where(open_periods).values(
+                ended_at=ended_at,
+                duration_ms=Period.get_duration_ms_expression(started_at,
+                                                              ended_at_ms)))
+
+            buckets = []
+            for row in rows:
+                buckets.extend(PeriodBucket.get_rows(
+                    row.id, row.started_at, ended_at))
+            db.session.execute(PeriodBucket.__table__.insert(), buckets)
+            ResourceChange.record(
+                db.session, [(row.resource_uuid, project) for row in rows])
+
+        with metrics.stage('commit'):
+            db.session.commit()
+
+        return len(rows)
+
+    def splice(self, event):
+        """Splice a late state change into the history of periods.
+
+        The period covering the time of the event is split, with the new
+        spec applying from the event until the end of that period.  For the
+        open period, it only applies until the last update, since the event
+        received then confirmed the spec of the open period.  Late deletions
+        and events older than the first period are still rejected.
+        """
+        if self.__class__.is_event_ignored(event):
+            raise exceptions.IgnoredEvent
+        if self.__class__.is_event_delete(event):
+            raise exceptions.EventTooOld()
+
+        time = event['generated']
+        period = next((p for p in self.periods if p.started_at <= time and
+                       (p.ended_at is None or time < p.ended_at)), None)
+        if period is None:
+            raise exceptions.EventTooOld()
+
+        spec = Spec.get_or_create(event)
+        if period.spec == spec:
+            return self
+
+        original_spec = period.spec
+        was_open = period.ended_at is None
+        ended_at = self.updated_at if was_open else period.ended_at
+
+        if time == period.started_at:
+            period.spec = spec
+            period.ended_at = ended_at
+        else:
+            period.ended_at = time
+            following = next((p for p in self.periods
+                              if p.started_at == ended_at), None)
+            if not was_open and following is not None and \
+                    following.spec == spec:
+                following.started_at = time
+            else:
+                self.periods.append(Period(started_at=time,
+                                           ended_at=ended_at, spec=spec))
+
+        if was_open:
+            self.periods.append(Period(started_at=ended_at,
+                                       spec=original_spec))
+
+        with metrics.stage('commit'):
+            db.session.commit()
+
+        return self
+
     def get_open_period(self):
         """get_open_period"""
         open_periods = list(filter(lambda p: p.ended_at is None, self.periods))
@@ -310,7 +656,55 @@ class BigIntegerDateTime(TypeDecorator):
         return datetime.fromtimestamp(value / 1000)
 
 
-class Period(db.Model):
+class DurationMixin:
+    """DurationMixin
+
+    Computes the `duration_ms` of periods, either in Python or in SQL.
+    """
+
+    @staticmethod
+    def get_duration_ms(started_at, ended_at):
+        """Get the milliseconds between two times, rounded half up."""
+        if ended_at is None:
+            return None
+        microseconds = (ended_at - started_at) // timedelta(microseconds=1)
+        return (microseconds + 500) // 1000
+
+    @staticmethod
+    def get_duration_ms_expression(started_at, ended_at):
+        """Get a SQL expression of `get_duration_ms()` on raw timestamps.
+
+        Raw timestamps are milliseconds which can have a fraction, so their
+        difference is rounded to the microsecond first and then half up to
+        an integer, in the same way as `get_duration_ms()`.
+        """
+        return cast(func.floor(func.round(ended_at - started_at, 3) + 0.5),
+                    db.BigInteger)
+
+    @classmethod
+    def get_clipped_duration_ms(cls, start, end):
+        """Get a SQL expression of the milliseconds of a period in a range.
+
+        Periods entirely inside the range use `duration_ms` as-is, the
+        others are clipped to the range and rounded like `duration_ms`.
+        This is only valid for periods overlapping the range.
+        """
+        start_ms = start.timestamp() * 1000
+        end_ms = end.timestamp() * 1000
+        started_at = type_coerce(cls.started_at, db.BigInteger)
+        ended_at = type_coerce(cls.ended_at, db.BigInteger)
+
+        clipped_start = case([(started_at < start_ms, start_ms)],
+                             else_=started_at)
+        clipped_end = case([(ended_at.is_(None), end_ms),
+                            (ended_at > end_ms, end_ms)], else_=ended_at)
+        return case([
+            (and_(started_at >= start_ms, ended_at <= end_ms,
+                  cls.duration_ms.isnot(None)), cls.duration_ms),
+        ], else_=cls.get_duration_ms_expression(clipped_start, clipped_end))
+
+
+class Period(db.Model, DurationMixin):
     """Period"""
 
     id = db.Column(db.Integer, primary_key=True)
@@ -318,9 +712,119 @@ class Period(db.Model):
                               nullable=False)
     started_at = db.Column(BigIntegerDateTime, nullable=False, index=True)
     ended_at = db.Column(BigIntegerDateTime, index=True)
+    duration_ms = db.Column(db.BigInteger)
 
     spec_id = db.Column(db.Integer, db.ForeignKey('spec.id'), nullable=False)
-    spec = db.relationship("Spec", lazy='joined')
+    spec = db.relationship("Spec", lazy='selectin')
+
+    __table_args__ = (
+        # NOTE: Finds the open period of a resource (or the ones ending
+        #       after a given time) without scanning all of its history.
+        db.Index('ix_period_resource_uuid_ended_at',
+                 'resource_uuid', 'ended_at'),
+    )
+
+    @classmethod
+    def get_last_id(cls):
+        """Get the largest ID used by a period, including archived ones.
+
+        Archived periods keep their ID, so IDs assigned outside of the
+        database have to start after both tables.
+        """
+        return max(
+            db.session.query(func.coalesce(func.max(table.id), 0)).scalar()
+            for table in (cls, ArchivedPeriod))
+
+    @classmethod
+    def filter_overlapping(cls, query, start, end):
+        """Restrict a query to the periods overlapping a range."""
+        # NOTE: Closed periods are found through the month buckets they
+        #       overlap and open ones through the `ended_at` index.  Their IDs
+        #       are joined as a derived table (rather than used in an `IN`
+        #       subquery, which MySQL runs once per row) so that the plan is
+        #       driven by the bucket primary key instead of `started_at`.
+        overlapping = union(
+            select([PeriodBucket.period_id.label('id')]).where(
+                PeriodBucket.bucket.between(start + MONTH_START, end)),
+            select([cls.id.label('id')]).where(
+                cls.ended_at.is_(None)).where(cls.started_at <= end),
+        ).alias('overlapping')
+
+        return query.join(overlapping, overlapping.c.id == cls.id).filter(
+            # Periods must have started before the end
+            cls.started_at <= end,
+            # Periods must be still active or ended after start
+            or_(cls.ended_at >= start, cls.ended_at.is_(None)),
+        )
+
+    @classmethod
+    def get_intervals(cls, start, end, project=None, with_project=False):
+        """Get the times and spec of the periods overlapping a range.
+
+        This only loads `(started_at, ended_at, spec_id)` rows, including
+        the ones of archived periods, without building any objects.  If
+        `with_project` is set, the project of the resource is added to them.
+        """
+        columns = [cls.started_at, cls.ended_at, cls.spec_id]
+        archived_columns = [ArchivedPeriod.started_at, ArchivedPeriod.ended_at,
+                            ArchivedPeriod.spec_id]
+        if with_project:
+            columns.append(Resource.project)
+            archived_columns.append(Resource.project)
+
+        query = cls.filter_overlapping(db.session.query(*columns),
+                                       start, end)
+        archived = db.session.query(*archived_columns).filter(
+            ArchivedPeriod.started_at <= end,
+            ArchivedPeriod.ended_at >= start)
+
+        if isinstance(project, str):
+            project = [project]
+        if with_project or project is not None:
+            query = query.join(Resource, Resource.uuid == cls.resource_uuid)
+            archived = archived.join(
+                Resource, Resource.uuid == ArchivedPeriod.resource_uuid)
+        if project is not None:
+            query = query.filter(Resource.project.in_(project))
+            archived = archived.filter(Resource.project.in_(project))
+
+        return query.all() + archived.all()
+
+    @classmethod
+    def get_durations(cls, start, end, project=None):
+        """Get the milliseconds used by every project and spec in a range.
+
+        The periods overlapping the range, including archived ones, are
+        clipped to it and summed in SQL.  This returns `(spec_id, project,
+        duration_ms)` rows, where open periods are counted until the end.
+        """
+        duration = func.sum(cls.get_clipped_duration_ms(start, end))
+        query = cls.filter_overlapping(
+            db.session.query(cls.spec_id, Resource.project, duration),
+            start, end,
+        ).join(Resource, Resource.uuid == cls.resource_uuid).filter(
+            cls.started_at < end,
+            or_(cls.ended_at > start, cls.ended_at.is_(None)),
+        ).group_by(cls.spec_id, Resource.project)
+
+        archived_duration = func.sum(
+            ArchivedPeriod.get_clipped_duration_ms(start, end))
+        archived = db.session.query(
+            ArchivedPeriod.spec_id, Resource.project, archived_duration,
+        ).join(
+            Resource, Resource.uuid == ArchivedPeriod.resource_uuid,
+        ).filter(
+            ArchivedPeriod.started_at < end,
+            ArchivedPeriod.ended_at > start,
+        ).group_by(ArchivedPeriod.spec_id, Resource.project)
+
+        if isinstance(project, str):
+            project = [project]
+        if project is not None:
+            query = query.filter(Resource.project.in_(project))
+            archived = archived.filter(Resource.project.in_(project))
+
+        return query.all() + archived.all()
 
     @property
     def seconds(self):
@@ -342,33 +846,265 @@ class Period(db.Model):
             }
 
 
+@sa_event.listens_for(Period, 'before_insert')
+@sa_event.listens_for(Period, 'before_update')
+def _set_duration(_, __, period):
+    period.duration_ms = Period.get_duration_ms(period.started_at,
+                                                period.ended_at)
+
+
+class PeriodBucket(db.Model):
+    """PeriodBucket
+
+    Maps every closed period to the months it overlaps, so that the periods
+    overlapping a time range can be found using the primary key instead of
+    scanning all the periods which started before its end.  Open periods
+    are not bucketed until they are closed.
+    """
+
+    bucket = db.Column(BigIntegerDateTime, primary_key=True)
+    period_id = db.Column(db.Integer,
+                          db.ForeignKey('period.id', ondelete='CASCADE'),
+                          primary_key=True, index=True)
+
+    @staticmethod
+    def get_buckets(started_at, ended_at):
+        """Get the start of every month overlapped by a time range."""
+        bucket = started_at + MONTH_START
+        while bucket <= ended_at:
+            yield bucket
+            bucket += MONTH
+
+    @classmethod
+    def get_rows(cls, period_id, started_at, ended_at):
+        """Get the rows to insert for a closed period."""
+        return [{'bucket': bucket, 'period_id': period_id}
+                for bucket in cls.get_buckets(started_at, ended_at)]
+
+
+@sa_event.listens_for(Period, 'after_insert')
+def _insert_buckets(_, connection, period):
+    if period.ended_at is None:
+        return
+    connection.execute(PeriodBucket.__table__.insert(), PeriodBucket.get_rows(
+        period.id, period.started_at, period.ended_at))
+
+
+@sa_event.listens_for(Period, 'after_update')
+def _update_buckets(mapper, connection, period):
+    state = sa_inspect(period)
+    if not (state.attrs.started_at.history.has_changes() or
+            state.attrs.ended_at.history.has_changes()):
+        return
+    _delete_buckets(mapper, connection, period)
+    _insert_buckets(mapper, connection, period)
+
+
+@sa_event.listens_for(Period, 'after_delete')
+def _delete_buckets(_, connection, period):
+    table = PeriodBucket.__table__
+    connection.execute(table.delete().where(table.c.period_id == period.id))
+
+
+class ResourceChange(db.Model):
+    """ResourceChange
+
+    Log of the resources whose periods changed, used as the change feed.
+    Its autoincrement ID is the cursor, which only grows as rows are added.
+    Rows are kept even if the resource is deleted so that consumers can
+    find out about it, which is why they have their own copy of the project.
+    """
+
+    __tablename__ = 'resource_change'
+
+    id = db.Column(db.Integer, primary_key=True)
+    resource_uuid = db.Column(db.String(36), nullable=False)
+    project = db.Column(db.String(32), index=True)
+    changed_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    @classmethod
+    def record(cls, connection, resources):
+        """Record changes to resources using a connection or session.
+
+        The resources are `(uuid, project)` pairs.
+        """
+        changed_at = datetime.now()
+        rows = [{'resource_uuid': uuid, 'project': project,
+                 'changed_at': changed_at}
+                for uuid, project in dict.fromkeys(resources)]
+        if rows:
+            connection.execute(cls.__table__.insert(), rows)
+
+    @classmethod
+    def get_page(cls, since, limit, settled_before, project=None):
+        """Get a page of changes after a cursor.
+
+        Changes more recent than `settled_before` are left out, along with
+        every change after them, since transactions which started earlier
+        might still commit rows with a lower ID.  This returns the changed
+        resources (as loaded, missing if deleted), the UUIDs of the changed
+        resources, the cursor of the next page and if there are more rows.
+        """
+        query = db.session.query(cls.id, cls.resource_uuid, cls.changed_at)
+        query = query.filter(cls.id > since)
+        if project is not None:
+            query = query.filter(cls.project.in_(project))
+        rows = query.order_by(cls.id).limit(limit + 1).all()
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        for i, row in enumerate(rows):
+            if row.changed_at >= settled_before:
+                rows, more = rows[:i], False
+                break
+
+        uuids = list(dict.fromkeys(row.resource_uuid for row in rows))
+        resources = {}
+        if uuids:
+            resources = {r.uuid: r for r in Resource.query.filter(
+                Resource.uuid.in_(uuids))}
+
+        cursor = rows[-1].id if rows else since
+        return resources, uuids, cursor, more
+
+    @classmethod
+    def prune(cls, before, batch_size=1000, sleep=0):
+        """Delete the changes recorded before a date and return how many."""
+        change = cls.__table__
+
+        total = 0
+        while True:
+            query = select([change.c.id]).where(
+                change.c.changed_at < before).order_by(change.c.id).limit(
+                    batch_size)
+            ids = [row.id for row in db.session.execute(query)]
+            if not ids:
+                break
+
+            db.session.execute(change.delete().where(change.c.id.in_(ids)))
+            db.session.commit()
+
+            total += len(ids)
+            if sleep:
+                time.sleep(sleep)
+
+        return total
+
+
+@sa_event.listens_for(Period, 'after_insert')
+@sa_event.listens_for(Period, 'after_delete')
+def _record_change(_, connection, period):
+    resource = period.__dict__.get('resource')
+    if resource is not None:
+        project = resource.project
+    else:
+        project = connection.execute(select([Resource.project]).where(
+            Resource.uuid == period.resource_uuid)).scalar()
+    ResourceChange.record(connection, [(period.resource_uuid, project)])
+
+
+@sa_event.listens_for(Period, 'after_update')
+def _record_update(mapper, connection, period):
+    state = sa_inspect(period)
+    if not any(state.attrs[name].history.has_changes()
+               for name in ('started_at', 'ended_at', 'spec', 'spec_id')):
+        return
+    _record_change(mapper, connection, period)
+
+
+class ArchivedPeriod(db.Model, DurationMixin):
+    """ArchivedPeriod
+
+    Closed periods which ended before the retention window, moved out of the
+    `period` table so that it stays sized to recent activity.
+    """
+
+    __tablename__ = 'period_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    resource_uuid = db.Column(db.String(36), db.ForeignKey('resource.uuid'),
+                              nullable=False, index=True)
+    started_at = db.Column(BigIntegerDateTime, nullable=False, index=True)
+    ended_at = db.Column(BigIntegerDateTime, nullable=False, index=True)
+    duration_ms = db.Column(db.BigInteger)
+
+    spec_id = db.Column(db.Integer, db.ForeignKey('spec.id'), nullable=False)
+    spec = db.relationship("Spec", lazy='selectin')
+
+    @classmethod
+    def exists_for(cls, resource):
+        """Check if a resource has any archived period."""
+        query = cls.query.filter_by(resource_uuid=resource.uuid)
+        return db.session.query(query.exists()).scalar()
+
+    def to_period(self):
+        """Get a transient period with the same data."""
+        return Period(id=self.id, resource_uuid=self.resource_uuid,
+                      started_at=self.started_at, ended_at=self.ended_at,
+                      duration_ms=self.duration_ms, spec_id=self.spec_id,
+                      spec=self.spec)
+
+
 class Spec(db.Model, GetOrCreateMixin):
-    """Spec"""
+    """Spec
+
+    Specs are immutable and identified by a digest of their type and
+    attributes, so they can be looked up using a single indexed column.
+    """
 
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(32))
+    digest = db.Column(db.String(64), nullable=False, unique=True, index=True)
 
     __mapper_args__ = {
         'polymorphic_on': type
     }
 
+    @staticmethod
+    def get_digest(spec_type, attributes):
+        """Get the digest of a spec type and its attributes."""
+        values = {k: None if v is None else str(v)
+                  for k, v in attributes.items()}
+        data = json.dumps([spec_type, values], sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def get_attribute_names(cls):
+        """get_attribute_names"""
+        return [c.name for c in cls.__table__.columns if c.name != 'id']
+
+    def compute_digest(self):
+        """compute_digest"""
+        attributes = {name: getattr(self, name)
+                      for name in self.get_attribute_names()}
+        return self.get_digest(self.__mapper__.polymorphic_identity,
+                               attributes)
+
     @classmethod
     def from_event(cls, event):
         """from_event"""
         _, cls = get_model_type_from_event(event['event_type'])
-        spec = {c.name: event['traits'][c.name]
-                for c in cls.__table__.columns if c.name != 'id'}
+        spec = {name: event['traits'][name]
+                for name in cls.get_attribute_names()}
 
-        return cls(**spec)
+        return cls(digest=cls.get_digest(
+            cls.__mapper__.polymorphic_identity, spec), **spec)
 
     @classmethod
     def query_from_event(cls, event):
         """query_from_event"""
         _, cls = get_model_type_from_event(event['event_type'])
-        spec = {c.name: event['traits'][c.name]
-                for c in cls.__table__.columns if c.name != 'id'}
+        spec = {name: event['traits'][name]
+                for name in cls.get_attribute_names()}
+
+        return cls.query.filter_by(digest=cls.get_digest(
+            cls.__mapper__.polymorphic_identity, spec))
 
-        return cls.query.filter_by(**spec)
+
+@sa_event.listens_for(Spec, 'before_insert', propagate=True)
+def _set_digest(_, __, spec):
+    if spec.digest is None:
+        spec.digest = spec.compute_digest()
 
 
 class InstanceSpec(Spec):
@@ -384,6 +1120,7 @@ class InstanceSpec(Spec):
 
     __mapper_args__ = {
         'polymorphic_identity': 'OS::Nova::Server',
+        'polymorphic_load': 'selectin',
     }
 
     @property
@@ -410,6 +1147,7 @@ class VolumeSpec(Spec):
 
     __mapper_args__ = {
         'polymorphic_identity': 'OS::Cinder::Volume',
+        'polymorphic_load': 'selectin',
     }
 
     @property
@@ -421,3 +1159,61 @@ class VolumeSpec(Spec):
             'volume_size': self.volume_size,
             'state': self.state,
             }
+
+
+class Price(db.Model):
+    """Price
+
+    Hourly rate of a spec type and name (the instance or volume type),
+    optionally only for a state, which applies from `effective_at` until
+    the next price of the same key.  Volume rates are per GB of their size.
+    Prices are versioned by adding new rows rather than updating them, so
+    past charges can always be recomputed.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(32), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    state = db.Column(db.String(255))
+    hourly_rate = db.Column(db.Numeric(20, 8), nullable=False)
+    effective_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('type', 'name', 'state', 'effective_at'),
+    )
+
+    @property
+    def serialize(self):
+        """Return object data in easily serializable format"""
+
+        return {
+            'type': self.type,
+            'name': self.name,
+            'state': self.state,
+            'hourly_rate': str(self.hourly_rate),
+            'effective_at': self.effective_at,
+            }
+
+
+class ReplicaHeartbeat(db.Model):
+    """ReplicaHeartbeat
+
+    Heartbeats written to the primary database when checking the lag of the
+    read replica.  Rows which reached the replica are pruned.
+    """
+
+    __tablename__ = 'replica_heartbeat'
+
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(BigIntegerDateTime, nullable=False)
+
+
+class DataMigrationState(db.Model):
+    """DataMigrationState"""
+
+    __tablename__ = 'data_migration'
+
+    name = db.Column(db.String(255), primary_key=True)
+    last_key = db.Column(db.String(255))
+    updated_at = db.Column(db.DateTime, nullable=False)
+    completed_at = db.Column(db.DateTime)
@@ -0,0 +1,189 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Payload
+
+Decodes the request bodies of the ingest API.  Bodies can be compressed
+using `Content-Encoding: gzip` (or `zstd` if the optional `zstandard`
+dependency is installed, using `pip install atmosphere[zstd]`) and encoded
+as a JSON (`Content-Type: application/json` or `application/*+json`) or
+MessagePack (`Content-Type: application/msgpack`) array of events.  Events
+are decoded one at a time while the body is read in chunks, so that memory
+does not grow with the size of the batch, and bodies are rejected as soon
+as they grow larger than `INGEST_MAX_BODY_SIZE` once decompressed.
+"""
+
+import codecs
+import gzip
+import json
+import re
+import zlib
+
+import msgpack
+from werkzeug import exceptions
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 64 * 1024
+MAX_BODY_SIZE = 64 * 1024 * 1024
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+JSON_TYPES = ('application/json',)
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def get_encodings():
+    """Get the content encodings which can be decoded."""
+    encodings = ['identity', 'gzip']
+    if zstandard is not None:
+        encodings.append('zstd')
+    return encodings
+
+
+def _open(stream, encoding):
+    if encoding in ('', 'identity'):
+        return stream
+    if encoding == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    raise exceptions.UnsupportedMediaType(
+        'Unsupported content encoding, use one of: %s' %
+        ', '.join(get_encodings()))
+
+
+class BoundedReader:
+    """BoundedReader
+
+    Reads a (possibly decompressing) stream, raising `RequestEntityTooLarge`
+    once more than `max_size` bytes were read and `BadRequest` if the
+    compressed data is invalid.
+    """
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, reader, max_size):
+        self.reader = reader
+        self.max_size = max_size
+        self.size = 0
+        self.errors = (OSError, EOFError, zlib.error)
+        if zstandard is not None:
+            self.errors += (zstandard.ZstdError,)
+
+    def read(self, size=CHUNK_SIZE):
+        """Read up to `size` bytes."""
+        try:
+            chunk = self.reader.read(min(size, self.max_size + 1 - self.size))
+        except self.errors as exc:
+            raise exceptions.BadRequest('Invalid compressed body') from exc
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise exceptions.RequestEntityTooLarge()
+        return chunk
+
+
+def _iter_json(reader):
+    """Decode the items of a JSON array as it is read."""
+    # pylint: disable=too-many-branches
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer, state, final = '', 'start', False
+
+    while not final:
+        chunk = reader.read()
+        final = not chunk
+        buffer += text.decode(chunk, final)
+
+        pos = 0
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            char = buffer[pos]
+            if state == 'start':
+                if char != '[':
+                    raise ValueError('Expected an array')
+                pos, state = pos + 1, 'first'
+            elif state == 'separator' or (state == 'first' and char == ']'):
+                if char not in ',]':
+                    raise ValueError('Expected a separator')
+                pos, state = pos + 1, 'value' if char == ',' else 'end'
+            elif state in ('first', 'value'):
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    if final:
+                        raise
+                    break
+                # NOTE: A value ending the buffer might continue in the next
+                #       chunk (such as a number), so wait for more data.
+                if end == len(buffer) and not final:
+                    break
+                yield item
+                pos, state = end, 'separator'
+            else:
+                raise ValueError('Extra data after the array')
+        buffer = buffer[pos:]
+
+    if state != 'end':
+        raise ValueError('Incomplete array')
+
+
+def _iter_msgpack(reader):
+    """Decode the items of a MessagePack array as it is read."""
+    unpacker = msgpack.Unpacker(reader, raw=False, read_size=CHUNK_SIZE)
+    for _ in range(unpacker.read_array_header()):
+        yield unpacker.unpack()
+    try:
+        unpacker.unpack()
+    except msgpack.OutOfData:
+        return
+    raise ValueError('Extra data after the array')
+
+
+def _iter_checked(items):
+    try:
+        for item in items:
+            if not isinstance(item, dict):
+                raise exceptions.BadRequest('Events must be objects')
+            yield item
+    except (ValueError, msgpack.UnpackException) as exc:
+        raise exceptions.BadRequest('Invalid body: %s' % exc) from exc
+
+
+def is_json(mimetype):
+    """Check if a mimetype is JSON, in the same way as Flask does."""
+    return mimetype in JSON_TYPES or (mimetype.startswith('application/') and
+                                      mimetype.endswith('+json'))
+
+
+def iter_events(stream, encoding, mimetype, max_size):
+    """Decode the events of a body one at a time while reading it."""
+    reader = BoundedReader(_open(stream, encoding.strip().lower()), max_size)
+    if is_json(mimetype):
+        return _iter_checked(_iter_json(reader))
+    if mimetype in MSGPACK_TYPES:
+        return _iter_checked(_iter_msgpack(reader))
+    raise exceptions.BadRequest(
+        'Unsupported content type, use one of: %s' %
+        ', '.join(JSON_TYPES + ('application/*+json',) + MSGPACK_TYPES))
+
+
+def get_events(request, max_size):
+    """Get an iterator over the events of a request."""
+    return iter_events(request.stream,
+                       request.headers.get('Content-Encoding', ''),
+                       request.mimetype, max_size)
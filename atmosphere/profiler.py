@@ -0,0 +1,188 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Profiler
+
+Opt-in request profiling using `cProfile`.  One in `PROFILE_SAMPLE_RATE`
+requests is profiled, as well as any request which has the
+`X-Atmosphere-Profile` header set to `PROFILE_SECRET`.  The stats are dumped
+into `PROFILE_DIR`, which keeps at most `PROFILE_MAX_FILES` of them, and can
+be aggregated into collapsed stacks for flame graphs using the
+`flask profile collapse` command.
+"""
+
+import cProfile
+import glob
+import hmac
+import itertools
+import os
+import pstats
+import re
+import tempfile
+import time
+
+import click
+from flask import current_app
+from flask import g
+from flask import request
+from flask.cli import AppGroup
+
+HEADER = 'X-Atmosphere-Profile'
+
+_COUNTER = itertools.count(1)
+
+
+def tag(value):
+    """Tag the profile of the current request (if any) with a value."""
+    tags = g.get('profile_tags')
+    if tags is not None and value not in tags:
+        tags.append(value)
+
+
+def _should_profile():
+    secret = current_app.config['PROFILE_SECRET']
+    header = request.headers.get(HEADER)
+    if secret and header and hmac.compare_digest(header, secret):
+        return True
+
+    rate = current_app.config['PROFILE_SAMPLE_RATE']
+    return bool(rate) and next(_COUNTER) % rate == 0
+
+
+def _start_profile():
+    if not _should_profile():
+        return
+
+    g.profile_tags = []
+    g.profile = cProfile.Profile()
+    g.profile.enable()
+
+
+def _get_filename():
+    parts = [str(request.endpoint)] + g.profile_tags
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', '-'.join(parts))[:200]
+    return '%d-%d-%s.prof' % (time.time() * 1000000, os.getpid(), name)
+
+
+def _rotate(directory, max_files):
+    files = sorted(glob.glob(os.path.join(directory, '*.prof')),
+                   key=os.path.getmtime)
+    for path in files[:max(len(files) - max_files, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _stop_profile(_):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+    profile.disable()
+
+    directory = current_app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    profile.dump_stats(os.path.join(directory, _get_filename()))
+    _rotate(directory, current_app.config['PROFILE_MAX_FILES'])
+
+
+def _get_label(func):
+    filename, line, name = func
+    return '%s:%d:%s' % (os.path.basename(filename), line, name)
+
+
+def collapse(stats, max_depth=100, min_time=0.00001):
+    """Convert profile stats into collapsed stacks.
+
+    `cProfile` only records caller and callee pairs, so the time spent in a
+    function is split across its stacks using the share of its cumulative
+    time coming from each caller.  Stacks accounting for less than
+    `min_time` seconds are pruned to keep the number of stacks bounded.
+    This returns a dictionary of stacks to the number of microseconds spent
+    in them.
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, []).append((func, cumulative))
+
+    stacks = {}
+
+    def visit(func, path, share):
+        _, _, total, cumulative, _ = stats.stats[func]
+        path = path + (func,)
+
+        microseconds = int(round(total * share * 1000000))
+        if microseconds > 0:
+            stack = ';'.join(_get_label(f) for f in path)
+            stacks[stack] = stacks.get(stack, 0) + microseconds
+
+        if len(path) >= max_depth:
+            return
+        for callee, edge_cumulative in callees.get(func, []):
+            callee_cumulative = stats.stats[callee][3]
+            if callee in path or callee_cumulative <= 0 or cumulative <= 0:
+                continue
+            if edge_cumulative * share < min_time:
+                continue
+            visit(callee, path, share * edge_cumulative / callee_cumulative)
+
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            visit(func, (), 1.0)
+
+    return stacks
+
+
+cli = AppGroup('profile', help='Manage request profiles.')
+
+
+@cli.command('collapse')
+@click.argument('directory', required=False)
+@click.option('--output', '-o', type=click.File('w'), default='-',
+              help='File to write the collapsed stacks to.')
+@click.option('--endpoint', help='Only include profiles of this endpoint.')
+def collapse_command(directory, output, endpoint):
+    """Aggregate profiles into a flame graph collapsed stack file."""
+    directory = directory or current_app.config['PROFILE_DIR']
+    pattern = '*-%s*.prof' % endpoint if endpoint else '*.prof'
+    files = sorted(glob.glob(os.path.join(directory, pattern)))
+    if not files:
+        raise click.ClickException('No profiles found in %s' % directory)
+
+    stacks = collapse(pstats.Stats(*files))
+    for stack, microseconds in sorted(stacks.items()):
+        output.write('%s %d\n' % (stack, microseconds))
+
+
+def init_app(app):
+    """init_app"""
+    defaults = {
+        'PROFILE_SAMPLE_RATE': 0,
+        'PROFILE_SECRET': None,
+        'PROFILE_DIR': os.path.join(tempfile.gettempdir(),
+                                    'atmosphere-profiles'),
+        'PROFILE_MAX_FILES': 100,
+    }
+    for key, default in defaults.items():
+        if app.config.get(key) is None:
+            app.config[key] = os.environ.get(key, default)
+    for key in ('PROFILE_SAMPLE_RATE', 'PROFILE_MAX_FILES'):
+        app.config[key] = int(app.config[key])
+
+    app.cli.add_command(cli)
+
+    if app.config['PROFILE_SAMPLE_RATE'] or app.config['PROFILE_SECRET']:
+        app.before_request(_start_profile)
+        app.teardown_request(_stop_profile)
@@ -0,0 +1,248 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rating
+
+Computes charges from the usage using versioned price tables.  A range is
+split at the dates where prices change, and the durations of the periods
+overlapping every part are clipped and summed by project and spec in SQL,
+so that charges are only multiplied out once per group.  Prices are loaded
+from CSV files using `flask rating load`, and the invoices of every project
+can be computed with `flask rating invoices`.
+"""
+
+import bisect
+import collections
+import csv
+import datetime
+import decimal
+import json
+
+import click
+from flask.cli import AppGroup
+
+from atmosphere import models
+from atmosphere.models import db
+from atmosphere import utils
+
+CENT = decimal.Decimal('0.01')
+MILLISECONDS_PER_HOUR = 3600 * 1000
+
+SPEC_NAMES = {
+    'OS::Nova::Server': 'instance_type',
+    'OS::Cinder::Volume': 'volume_type',
+}
+
+
+class PriceTable:
+    """PriceTable
+
+    At any time, the latest price in effect for the state of a spec takes
+    precedence over the latest one in effect for any state of the same spec
+    type and name.
+    """
+
+    def __init__(self, prices):
+        self.prices = collections.defaultdict(list)
+        for price in sorted(prices, key=lambda p: p.effective_at):
+            key = (price.type, price.name, price.state)
+            self.prices[key].append((price.effective_at, price.hourly_rate))
+        self.merged = {}
+
+    @staticmethod
+    def get_rate(prices, time):
+        """Get the rate in effect at a time (`None` before the first one)."""
+        index = bisect.bisect_right([date for date, _ in prices], time) - 1
+        return prices[index][1] if index >= 0 else None
+
+    def get_prices(self, spec):
+        """Get the `(effective_at, hourly_rate)` list applying to a spec."""
+        name = getattr(spec, SPEC_NAMES.get(spec.type, ''), None)
+        key = (spec.type, name, spec.state)
+        if key in self.merged:
+            return self.merged[key]
+
+        specific = self.prices.get(key, []) if spec.state is not None else []
+        generic = self.prices.get((spec.type, name, None), [])
+        prices = specific or generic
+        if specific and generic:
+            prices = []
+            for effective_at in sorted({date for date, _ in
+                                        specific + generic}):
+                rate = self.get_rate(specific, effective_at)
+                if rate is None:
+                    rate = self.get_rate(generic, effective_at)
+                prices.append((effective_at, rate))
+
+        self.merged[key] = prices
+        return prices
+
+
+def get_quantity(spec):
+    """Get the quantity that a rate is multiplied by for a spec."""
+    if spec.type == 'OS::Cinder::Volume':
+        return decimal.Decimal(spec.volume_size or 0)
+    return 1
+
+
+def get_windows(prices, start, end):
+    """Split a time range at every date where any price changes.
+
+    Every spec has the same rate for the whole of each `(start, end)`
+    window which is returned.
+    """
+    dates = sorted({price.effective_at for price in prices
+                    if start < price.effective_at < end})
+    boundaries = [start] + dates + [end]
+    return [(boundaries[i], boundaries[i + 1])
+            for i in range(len(boundaries) - 1)
+            if boundaries[i] < boundaries[i + 1]]
+
+
+def compute_charges(start, end, project=None, now=None):
+    """Compute the charges of the usage in a range for every project.
+
+    Open periods are charged until now.  The range is split where prices
+    change and the durations of every project and spec are summed in SQL
+    for each part.  This returns a dictionary of every project to its
+    `total` and `lines`, which have the seconds and charge of each spec
+    used, along with the seconds without any price.
+    """
+    # pylint: disable=too-many-locals
+    if now is None:
+        now = datetime.datetime.now()
+    end_of_usage = min(end, now)
+
+    prices = models.Price.query.all()
+    table = PriceTable(prices)
+
+    milliseconds = collections.Counter()
+    for window_start, window_end in get_windows(prices, start, end_of_usage):
+        for spec_id, resource_project, value in models.Period.get_durations(
+                window_start, window_end, project):
+            milliseconds[(resource_project, spec_id, window_start)] += \
+                int(value or 0)
+
+    specs = {}
+    spec_ids = list({spec_id for _, spec_id, _ in milliseconds})
+    for i in range(0, len(spec_ids), 1000):
+        specs.update((spec.id, spec) for spec in models.Spec.query.filter(
+            models.Spec.id.in_(spec_ids[i:i + 1000])))
+
+    charges = {}
+    for (resource_project, spec_id, window_start), value in \
+            sorted(milliseconds.items(), key=lambda i: i[0][:2]):
+        if not value:
+            continue
+        spec = specs[spec_id]
+        invoice = charges.setdefault(resource_project, {
+            'total': decimal.Decimal(0), 'lines': {}})
+        line = invoice['lines'].setdefault(spec_id, {
+            'type': spec.type,
+            'spec': spec.serialize,
+            'seconds': 0,
+            'unpriced_seconds': 0,
+            'charge': decimal.Decimal(0),
+        })
+
+        rate = table.get_rate(table.get_prices(spec), window_start)
+        line['seconds'] += value / 1000
+        if rate is None:
+            line['unpriced_seconds'] += value / 1000
+            continue
+        line['charge'] += decimal.Decimal(value) * rate * \
+            get_quantity(spec) / MILLISECONDS_PER_HOUR
+
+    for invoice in charges.values():
+        invoice['lines'] = list(invoice['lines'].values())
+        for line in invoice['lines']:
+            line['charge'] = line['charge'].quantize(CENT)
+        # NOTE: The total is the sum of the rounded lines, so that it always
+        #       adds up on the invoice.
+        invoice['total'] = sum((line['charge'] for line in invoice['lines']),
+                               decimal.Decimal(0)).quantize(CENT)
+
+    return charges
+
+
+def load_prices(rows):
+    """Add prices, skipping the ones which were already loaded.
+
+    Prices are never updated, since that would change the charges which
+    were already invoiced, so a different rate for the key of an existing
+    price raises `click.ClickException` without adding any of them.  This
+    returns the number of prices which were added.
+    """
+    count = 0
+    for row in rows:
+        state = row.get('state') or None
+        effective_at = row['effective_at']
+        if isinstance(effective_at, str):
+            effective_at = utils.parse_datetime(effective_at)
+        hourly_rate = decimal.Decimal(row['hourly_rate'])
+
+        price = models.Price.query.filter_by(
+            type=row['type'], name=row['name'], state=state,
+            effective_at=effective_at).one_or_none()
+        if price is not None:
+            if price.hourly_rate == hourly_rate:
+                continue
+            db.session.rollback()
+            raise click.ClickException(
+                'Price of %s %s (state: %s) effective at %s is already %s, '
+                'use a new effective date to change it' % (
+                    price.type, price.name, state or 'any',
+                    effective_at.isoformat(), price.hourly_rate))
+
+        db.session.add(models.Price(
+            type=row['type'], name=row['name'], state=state,
+            effective_at=effective_at, hourly_rate=hourly_rate))
+        count += 1
+
+    db.session.commit()
+    return count
+
+
+cli = AppGroup('rating', help='Manage prices and charges.')
+
+
+@cli.command('load')
+@click.argument('path', type=click.File('r'))
+def load_prices_command(path):
+    """Load prices from a CSV file.
+
+    The file needs `type`, `name`, `state` (empty for any state),
+    `hourly_rate` and `effective_at` columns.
+    """
+    count = load_prices(csv.DictReader(path))
+    click.echo('Loaded %d prices' % count)
+
+
+@cli.command('invoices')
+@click.option('--start', required=True, type=click.DateTime(),
+              help='Start of the invoiced range.')
+@click.option('--end', required=True, type=click.DateTime(),
+              help='End of the invoiced range.')
+@click.option('--output', '-o', type=click.File('w'), default='-',
+              help='File to write the invoices to.')
+def invoices_command(start, end, output):
+    """Compute the invoices of every project as JSON."""
+    charges = compute_charges(start, end)
+    json.dump(charges, output, indent=2, default=str, sort_keys=True)
+    output.write('\n')
+
+
+def init_app(app):
+    """init_app"""
+    app.cli.add_command(cli)
@@ -0,0 +1,93 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""SQL statement accounting
+
+Counts the statements (and the time spent running them) for every request,
+which are added as response headers in debug mode, and logs the statements
+slower than `SQLALCHEMY_SLOW_QUERY_THRESHOLD` seconds.
+"""
+
+import logging
+import os
+import sys
+import time
+
+from flask import current_app
+from flask import g
+from flask import has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LOG = logging.getLogger(__name__)
+
+STATEMENTS_HEADER = 'X-Atmosphere-SQL-Statements'
+TIME_HEADER = 'X-Atmosphere-SQL-Time'
+
+
+def _get_origin():
+    """Get the model method that a statement originated from."""
+    # pylint: disable=protected-access
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_globals.get('__name__') == 'atmosphere.models':
+            return '%s:%d (%s)' % (frame.f_code.co_filename, frame.f_lineno,
+                                   frame.f_code.co_name)
+        frame = frame.f_back
+    return '<unknown>'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, *_):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, _, statement, parameters, *__):
+    elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+    if not has_app_context():
+        return
+
+    g.sql_statements = g.get('sql_statements', 0) + 1
+    g.sql_time = g.get('sql_time', 0) + elapsed
+
+    threshold = current_app.config.get('SQLALCHEMY_SLOW_QUERY_THRESHOLD')
+    if threshold is not None and elapsed >= threshold:
+        LOG.warning('Slow query (%.3fs) from %s: %s, parameters: %r',
+                    elapsed, _get_origin(), statement, parameters)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    # NOTE: after_cursor_execute is not called for statements which failed.
+    connection = context.connection
+    if connection is not None and connection.info.get('query_start_time'):
+        connection.info['query_start_time'].pop()
+
+
+def _add_headers(response):
+    if current_app.debug:
+        response.headers[STATEMENTS_HEADER] = g.get('sql_statements', 0)
+        response.headers[TIME_HEADER] = '%.6f' % g.get('sql_time', 0)
+    return response
+
+
+def init_app(app):
+    """init_app"""
+    if app.config.get('SQLALCHEMY_SLOW_QUERY_THRESHOLD') is None:
+        threshold = os.environ.get('DATABASE_SLOW_QUERY_THRESHOLD')
+        if threshold is not None:
+            app.config['SQLALCHEMY_SLOW_QUERY_THRESHOLD'] = float(threshold)
+
+    app.after_request(_add_headers)
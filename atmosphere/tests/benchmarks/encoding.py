@@ -0,0 +1,118 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Ingest encoding benchmark
+
+Encodes batches of events (from a JSONL file or a generated workload) with
+every content type and encoding supported by `POST /v1/event`, and reports
+the size of the bodies and the time taken to decode 1000 events from them
+using the same code as the ingest API:
+
+    python -m atmosphere.tests.benchmarks.encoding --batch-size 1000
+"""
+
+import argparse
+import gzip
+import io
+import json
+import sys
+import time
+
+import msgpack
+
+from atmosphere import payload
+from atmosphere.tests.benchmarks import workload
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CONTENT_TYPES = {
+    'application/json': lambda events: json.dumps(events).encode(),
+    'application/msgpack': msgpack.packb,
+}
+
+
+def get_encoders():
+    """Get the function compressing a body for every content encoding."""
+    encoders = {
+        'identity': lambda body: body,
+        'gzip': gzip.compress,
+    }
+    if zstandard is not None:
+        encoders['zstd'] = zstandard.ZstdCompressor().compress
+    return encoders
+
+
+def run(events, batch_size=1000, repeat=5):
+    """Time the decoding of batches of events for every encoding."""
+    batches = [events[i:i + batch_size]
+               for i in range(0, len(events), batch_size)]
+
+    results = []
+    for mimetype, encode in CONTENT_TYPES.items():
+        for encoding, compress in get_encoders().items():
+            bodies = [compress(encode(batch)) for batch in batches]
+
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for body in bodies:
+                    for _ in payload.iter_events(io.BytesIO(body), encoding,
+                                                 mimetype, sys.maxsize):
+                        pass
+                timings.append(time.perf_counter() - start)
+
+            results.append({
+                'content_type': mimetype,
+                'content_encoding': encoding,
+                'bytes': sum(len(body) for body in bodies),
+                'bytes_per_event': sum(len(b) for b in bodies) / len(events),
+                'seconds_per_1000_events': min(timings) * 1000 / len(events),
+            })
+
+    return results
+
+
+def main(argv=None):
+    """main"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('events', nargs='?',
+                        help='JSONL file of events (generated if missing)')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--instances', type=int, default=20)
+    parser.add_argument('--volumes', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.events:
+        events = workload.read_events(args.events)
+    else:
+        events = workload.Workload(instances=args.instances,
+                                   volumes=args.volumes,
+                                   seed=args.seed).events()
+
+    json.dump({
+        'events': len(events),
+        'batch_size': args.batch_size,
+        'results': run(events, batch_size=args.batch_size,
+                       repeat=args.repeat),
+    }, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
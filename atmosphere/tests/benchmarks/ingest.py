@@ -0,0 +1,149 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Ingest throughput benchmark
+
+Replays events (from a JSONL file or a generated workload) through
+`POST /v1/event` at a given concurrency and reports the throughput, the
+latency percentiles and the number of SQL statements that were needed.
+The run fails if any request got an error, since the throughput would not
+mean anything.  SQLite has no row locks, so it only supports a concurrency
+of 1:
+
+    python -m atmosphere.tests.benchmarks.ingest \\
+        --database-uri mysql+pymysql://root@localhost/atmosphere \\
+        --concurrency 8 events.jsonl
+"""
+
+import argparse
+import collections
+from concurrent import futures
+import json
+import os
+import sys
+import tempfile
+import time
+
+from atmosphere.api import ingress
+from atmosphere.models import db
+from atmosphere import statements
+from atmosphere.tests.benchmarks import workload
+
+
+def percentile(values, percent):
+    """Get a percentile of a list of values (nearest rank)."""
+    if not values:
+        return 0
+    values = sorted(values)
+    index = max(int(round(percent / 100 * len(values))) - 1, 0)
+    return values[index]
+
+
+def create_app(database_uri):
+    """Create an ingress application with an empty database."""
+    class Config:
+        SQLALCHEMY_DATABASE_URI = database_uri
+
+    app = ingress.init_application(Config)
+    app.debug = True
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+
+def run(app, events, concurrency=1, batch_size=1):
+    """Replay events through the ingress API and return the results."""
+    batches = [events[i:i + batch_size]
+               for i in range(0, len(events), batch_size)]
+
+    def post(batch):
+        with app.test_client() as client:
+            start = time.perf_counter()
+            response = client.post('/v1/event', json=batch)
+            latency = time.perf_counter() - start
+        return (response.status_code, latency,
+                int(response.headers[statements.STATEMENTS_HEADER]))
+
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(post, batches))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for _, latency, _ in results]
+    total_statements = sum(count for _, _, count in results)
+    errors = sum(1 for status, _, _ in results if not 200 <= status < 300)
+    return {
+        'events': len(events),
+        'requests': len(batches),
+        'concurrency': concurrency,
+        'batch_size': batch_size,
+        'seconds': elapsed,
+        'events_per_second': len(events) / elapsed if elapsed else 0,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+        'statements': total_statements,
+        'statements_per_event': total_statements / max(len(events), 1),
+        'status_codes': dict(collections.Counter(
+            str(status) for status, _, _ in results)),
+        'errors': errors,
+    }
+
+
+def main(argv=None):
+    """main"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('events', nargs='?',
+                        help='JSONL file of events (generated if missing)')
+    parser.add_argument('--database-uri',
+                        help='Database to use (temporary SQLite if missing)')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--instances', type=int, default=100)
+    parser.add_argument('--volumes', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    sqlite = args.database_uri is None or \
+        args.database_uri.startswith('sqlite')
+    if sqlite and args.concurrency > 1:
+        parser.error('SQLite has no row locks, so concurrent requests '
+                     'conflict: use --concurrency 1 or --database-uri')
+
+    if args.events:
+        events = workload.read_events(args.events)
+    else:
+        events = workload.Workload(instances=args.instances,
+                                   volumes=args.volumes,
+                                   seed=args.seed).events()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_uri = args.database_uri or \
+            'sqlite:///%s' % os.path.join(tmpdir, 'atmosphere.db')
+        app = create_app(database_uri)
+        results = run(app, events, concurrency=args.concurrency,
+                      batch_size=args.batch_size)
+
+    results['database'] = app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0]
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+    if results['errors']:
+        sys.exit('ERROR: %d of %d requests failed (see status_codes), the '
+                 'throughput is not valid' % (results['errors'],
+                                              results['requests']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Usage query benchmark
+
+Bulk-loads synthetic periods spread over many projects (with a long tail of
+project sizes) and times both `GET /v1/resources` and the underlying model
+call across range widths and project sizes.  The memory high-water mark of
+each query is recorded by an extra run, since tracing allocations would
+skew the timings.  Results are saved as JSON so that runs can be compared:
+
+    python -m atmosphere.tests.benchmarks.usage \\
+        --database-uri mysql+pymysql://root@localhost/atmosphere \\
+        --periods 1000000 --projects 2000 --output results.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import func
+
+from atmosphere.app import create_app
+from atmosphere.api import usage
+from atmosphere import models
+from atmosphere.models import db
+
+WIDTHS = {
+    'hour': relativedelta(hours=1),
+    'day': relativedelta(days=1),
+    'month': relativedelta(months=1),
+    'year': relativedelta(years=1),
+}
+
+INSTANCE_TYPES = ('v2-standard-1', 'v2-standard-2', 'v2-standard-4',
+                  'v2-highcpu-8', 'v2-highmem-16')
+STATES = ('active', 'stopped')
+
+
+def create_benchmark_app(database_uri):
+    """Create an application serving the usage API without authentication."""
+    class Config:
+        SQLALCHEMY_DATABASE_URI = database_uri
+
+    app = create_app(Config)
+    app.register_blueprint(usage.blueprint)
+    return app
+
+
+def load(periods=1000000, projects=1000, periods_per_resource=20,
+         end=datetime.datetime(2021, 1, 1), years=2, batch_size=10000,
+         seed=0):
+    """Bulk-load synthetic resources and periods.
+
+    Project sizes follow a Pareto distribution, so there are a few very
+    large projects and a long tail of small ones.  Every resource gets a
+    chain of consecutive periods covering part of the time span, with the
+    buckets of the closed ones.  This returns the number of resources of
+    every project.
+    """
+    # pylint: disable=too-many-locals
+    rand = random.Random(seed)
+    start = end - relativedelta(years=years)
+    span = (end - start).total_seconds()
+
+    specs = [models.InstanceSpec(instance_type=t, state=s)
+             for t in INSTANCE_TYPES for s in STATES]
+    db.session.add_all(specs)
+    db.session.commit()
+    spec_ids = [spec.id for spec in specs]
+
+    weights = [rand.paretovariate(1.2) for _ in range(projects)]
+    total = sum(weights)
+    resources = max(periods // periods_per_resource, 1)
+    sizes = {'%032x' % i: max(int(resources * w / total), 1)
+             for i, w in enumerate(weights)}
+
+    resource_rows, period_rows, bucket_rows = [], [], []
+    period_id = models.Period.get_last_id()
+
+    def flush():
+        for model, rows in ((models.Resource, resource_rows),
+                            (models.Period, period_rows),
+                            (models.PeriodBucket, bucket_rows)):
+            if rows:
+                db.session.execute(model.__table__.insert(), rows)
+            del rows[:]
+        db.session.commit()
+
+    for project, size in sizes.items():
+        for _ in range(size):
+            resource_uuid = str(uuid.UUID(int=rand.getrandbits(128)))
+            resource_rows.append({
+                'uuid': resource_uuid,
+                'type': 'OS::Nova::Server',
+                'project': project,
+                'updated_at': end,
+            })
+
+            started_at = start + datetime.timedelta(
+                seconds=rand.uniform(0, span * 0.9))
+            length = (end - started_at).total_seconds() / periods_per_resource
+            for i in range(periods_per_resource):
+                ended_at = started_at + datetime.timedelta(
+                    seconds=rand.uniform(0.5, 1.5) * length)
+                if ended_at >= end or i == periods_per_resource - 1:
+                    ended_at = None
+                period_id += 1
+                period_rows.append({
+                    'id': period_id,
+                    'resource_uuid': resource_uuid,
+                    'started_at': started_at,
+                    'ended_at': ended_at,
+                    'duration_ms': models.Period.get_duration_ms(
+                        started_at, ended_at),
+                    'spec_id': rand.choice(spec_ids),
+                })
+                if ended_at is None:
+                    break
+                bucket_rows.extend(models.PeriodBucket.get_rows(
+                    period_id, started_at, ended_at))
+                started_at = ended_at
+
+            if len(period_rows) >= batch_size:
+                flush()
+    flush()
+
+    return sizes
+
+
+def get_sizes():
+    """Get the number of resources of every project already loaded."""
+    query = db.session.query(models.Resource.project,
+                             func.count(models.Resource.uuid))
+    return dict(query.group_by(models.Resource.project).all())
+
+
+def measure_time(func):
+    """Run a function and return its result and duration."""
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def measure_memory(func):
+    """Run a function and return its memory high-water mark.
+
+    Tracing every allocation slows the function down a lot, so it is run
+    separately from the timed runs.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def run(app, sizes, end=datetime.datetime(2021, 1, 1), repeat=3):
+    """Time usage queries across range widths and project sizes."""
+    ordered = sorted(sizes, key=sizes.get)
+    projects = {
+        'small': ordered[0],
+        'median': ordered[len(ordered) // 2],
+        'large': ordered[-1],
+    }
+
+    results = []
+    client = app.test_client()
+    for width_name, width in WIDTHS.items():
+        start = end - width
+        for size_name, project in projects.items():
+            def model_call(project=project, start=start):
+                with app.app_context():
+                    data = models.Resource.get_all_by_time_range(
+                        start, end, project)
+                    return sum(len(r.periods) for r in data)
+
+            def api_call(project=project, start=start):
+                response = client.get('/v1/resources', query_string={
+                    'start': start.isoformat(),
+                    'end': end.isoformat(),
+                }, headers={'X-Project-Id': project, 'X-Roles': 'member'})
+                assert response.status_code == 200
+                return len(response.data)
+
+            for target, call in (('model', model_call), ('api', api_call)):
+                timings = []
+                for _ in range(repeat):
+                    output, elapsed = measure_time(call)
+                    timings.append(elapsed)
+                results.append({
+                    'target': target,
+                    'width': width_name,
+                    'project_size': size_name,
+                    'project_resources': sizes[project],
+                    'output': output,
+                    'seconds_min': min(timings),
+                    'seconds_max': max(timings),
+                    'peak_memory_bytes': measure_memory(call),
+                })
+
+    return results
+
+
+def main(argv=None):
+    """main"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-uri',
+                        help='Database to use (temporary SQLite if missing)')
+    parser.add_argument('--periods', type=int, default=1000000)
+    parser.add_argument('--projects', type=int, default=1000)
+    parser.add_argument('--periods-per-resource', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-load', action='store_true',
+                        help='Reuse data loaded by a previous run')
+    parser.add_argument('--output', '-o', type=argparse.FileType('w'),
+                        default=sys.stdout)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_uri = args.database_uri or \
+            'sqlite:///%s' % os.path.join(tmpdir, 'atmosphere.db')
+        app = create_benchmark_app(database_uri)
+
+        with app.app_context():
+            start = time.perf_counter()
+            if args.skip_load:
+                sizes = get_sizes()
+            else:
+                db.drop_all()
+                db.create_all()
+                sizes = load(periods=args.periods, projects=args.projects,
+                             periods_per_resource=args.periods_per_resource,
+                             seed=args.seed)
+            load_seconds = time.perf_counter() - start
+
+        results = run(app, sizes, repeat=args.repeat)
+
+    json.dump({
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'database': database_uri.split(':')[0],
+        'periods': args.periods,
+        'projects': args.projects,
+        'load_seconds': load_seconds,
+        'max_rss_kilobytes':
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'results': results,
+    }, args.output, indent=2)
+    args.output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Synthetic workload generator
+
+Simulates a fleet of instances and volumes going through realistic
+lifecycles (creation, hourly `exists` heartbeats, resizes, state changes and
+deletion) and emits the matching Ceilometer events, with a share of them
+delivered out of order.  It can be used as a library or to write the events
+as JSONL:
+
+    python -m atmosphere.tests.benchmarks.workload \\
+        --instances 1000 --volumes 500 --output events.jsonl
+"""
+
+import argparse
+import datetime
+import json
+import random
+import sys
+import uuid
+
+TEXT = 1
+INT = 2
+DATETIME = 4
+
+INSTANCE_TYPES = ('v2-standard-1', 'v2-standard-2', 'v2-standard-4',
+                  'v2-highcpu-8', 'v2-highmem-16')
+VOLUME_TYPES = ('ssd', 'nvme')
+
+
+class Workload:
+    """Workload"""
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, instances=100, volumes=100, projects=10,
+                 start=datetime.datetime(2021, 1, 1), days=30,
+                 out_of_order=0.01, seed=None):
+        self.instances = instances
+        self.volumes = volumes
+        self.projects = ['%032x' % random.Random(i).getrandbits(128)
+                         for i in range(projects)]
+        self.start = start
+        self.end = start + datetime.timedelta(days=days)
+        self.out_of_order = out_of_order
+        self.random = random.Random(seed)
+
+    def _uuid(self):
+        return str(uuid.UUID(int=self.random.getrandbits(128)))
+
+    def _time_between(self, start, end):
+        seconds = (end - start).total_seconds()
+        return start + datetime.timedelta(
+            seconds=self.random.uniform(0, seconds))
+
+    def _lifetime(self):
+        created_at = self._time_between(self.start, self.end)
+        deleted_at = None
+        if self.random.random() < 0.6:
+            deleted_at = self._time_between(created_at, self.end)
+        return created_at, deleted_at
+
+    def _heartbeats(self, created_at, deleted_at):
+        time = created_at.replace(minute=0, second=0, microsecond=0)
+        end = deleted_at or self.end
+        while True:
+            time += datetime.timedelta(hours=1)
+            if time >= end:
+                return
+            yield time
+
+    def _event(self, event_type, generated, traits):
+        return {
+            'message_id': self._uuid(),
+            'event_type': event_type,
+            'generated': generated.isoformat(),
+            'traits': traits,
+        }
+
+    def _instance_events(self):
+        resource_id = self._uuid()
+        project_id = self.random.choice(self.projects)
+        created_at, deleted_at = self._lifetime()
+        state = {
+            'instance_type': self.random.choice(INSTANCE_TYPES),
+            'state': 'building',
+        }
+
+        def event(event_type, generated, deleted=False):
+            traits = [
+                ['service', TEXT, 'compute'],
+                ['resource_id', TEXT, resource_id],
+                ['project_id', TEXT, project_id],
+                ['instance_type', TEXT, state['instance_type']],
+                ['state', TEXT, state['state']],
+                ['created_at', DATETIME, created_at.isoformat()],
+            ]
+            if deleted:
+                traits.append(['deleted_at', DATETIME,
+                               deleted_at.isoformat()])
+            return self._event(event_type, generated, traits)
+
+        yield event('compute.instance.create.start', created_at)
+        state['state'] = 'active'
+        yield event('compute.instance.create.end',
+                    created_at + datetime.timedelta(seconds=30))
+
+        for time in self._heartbeats(created_at, deleted_at):
+            choice = self.random.random()
+            if choice < 0.01:
+                state['instance_type'] = self.random.choice(INSTANCE_TYPES)
+                yield event('compute.instance.resize.confirm.end', time)
+            elif choice < 0.03:
+                stopped = state['state'] == 'stopped'
+                state['state'] = 'active' if stopped else 'stopped'
+                yield event('compute.instance.power_%s.end' %
+                            ('on' if stopped else 'off'), time)
+            else:
+                yield event('compute.instance.exists', time)
+
+        if deleted_at is not None:
+            state['state'] = 'deleted'
+            yield event('compute.instance.delete.end', deleted_at,
+                        deleted=True)
+
+    def _volume_events(self):
+        resource_id = self._uuid()
+        project_id = self.random.choice(self.projects)
+        created_at, deleted_at = self._lifetime()
+        state = {
+            'volume_type': self.random.choice(VOLUME_TYPES),
+            'volume_size': self.random.choice((10, 20, 50, 100, 500)),
+            'state': 'creating',
+        }
+
+        def event(event_type, generated):
+            return self._event(event_type, generated, [
+                ['service', TEXT, 'volume'],
+                ['resource_id', TEXT, resource_id],
+                ['project_id', TEXT, project_id],
+                ['volume_type', TEXT, state['volume_type']],
+                ['volume_size', INT, state['volume_size']],
+                ['state', TEXT, state['state']],
+                ['created_at', DATETIME, created_at.isoformat()],
+            ])
+
+        yield event('volume.create.start', created_at)
+        state['state'] = 'available'
+        yield event('volume.create.end',
+                    created_at + datetime.timedelta(seconds=5))
+
+        for time in self._heartbeats(created_at, deleted_at):
+            if self.random.random() < 0.01:
+                state['volume_size'] *= 2
+                yield event('volume.resize.end', time)
+            else:
+                yield event('volume.exists', time)
+
+        if deleted_at is not None:
+            state['state'] = 'deleting'
+            yield event('volume.delete.start', deleted_at)
+            state['state'] = 'deleted'
+            yield event('volume.delete.end',
+                        deleted_at + datetime.timedelta(seconds=5))
+
+    def events(self):
+        """Get all the events of the workload, in delivery order."""
+        events = []
+        for _ in range(self.instances):
+            events.extend(self._instance_events())
+        for _ in range(self.volumes):
+            events.extend(self._volume_events())
+        events.sort(key=lambda e: e['generated'])
+
+        # NOTE: Swap some events with the one delivered right after them to
+        #       simulate events being delivered out of order.
+        for i in range(len(events) - 1):
+            if self.random.random() < self.out_of_order:
+                events[i], events[i + 1] = events[i + 1], events[i]
+
+        return events
+
+
+def write_events(events, output):
+    """Write events as JSONL."""
+    for event in events:
+        output.write(json.dumps(event))
+        output.write('\n')
+
+
+def read_events(path):
+    """Read events from a JSONL file."""
+    with open(path) as events_file:
+        return [json.loads(line) for line in events_file if line.strip()]
+
+
+def main(argv=None):
+    """main"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--instances', type=int, default=100)
+    parser.add_argument('--volumes', type=int, default=100)
+    parser.add_argument('--projects', type=int, default=10)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--out-of-order', type=float, default=0.01)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', '-o', type=argparse.FileType('w'),
+                        default=sys.stdout)
+    args = parser.parse_args(argv)
+
+    workload = Workload(instances=args.instances, volumes=args.volumes,
+                        projects=args.projects, days=args.days,
+                        out_of_order=args.out_of_order, seed=args.seed)
+    write_events(workload.events(), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,13 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gzip
+import json
+
 from dateutil.relativedelta import relativedelta
+import msgpack
 import pytest
 
 from atmosphere.api import ingress
+from atmosphere.app import create_app
 from atmosphere.tests.unit import fake
 from atmosphere import models
-from atmosphere.models import db
 
 
 @pytest.fixture
@@ -29,13 +33,6 @@ def app():
     return app
 
 
-@pytest.fixture
-def _db(app):
-    db.init_app(app)
-    db.create_all()
-    return db
-
-
 @pytest.mark.usefixtures("client", "db_session")
 class TestEvent:
     def test_with_no_json_provided(self, client):
@@ -43,6 +40,39 @@ class TestEvent:
 
         assert response.status_code == 400
 
+    def test_with_gzip_msgpack_events(self, client):
+        event = fake.get_instance_event()
+        response = client.post(
+            '/v1/event', data=gzip.compress(msgpack.packb([event])),
+            content_type='application/msgpack',
+            headers={'Content-Encoding': 'gzip'})
+
+        assert response.status_code == 204
+        assert models.Resource.query.count() == 1
+
+    def test_with_body_over_limit(self, app, client):
+        app.config['INGEST_MAX_BODY_SIZE'] = 16
+        response = client.post('/v1/event',
+                               json=[fake.get_instance_event()])
+
+        assert response.status_code == 413
+        assert models.Resource.query.count() == 0
+
+    def test_with_unsupported_encoding(self, client):
+        response = client.post('/v1/event', json=[],
+                               headers={'Content-Encoding': 'br'})
+
+        assert response.status_code == 415
+
+    def test_with_invalid_event_in_batch(self, client):
+        event = fake.get_instance_event()
+        body = '[%s, {' % json.dumps(event)
+        response = client.post('/v1/event', data=body,
+                               content_type='application/json')
+
+        assert response.status_code == 400
+        assert models.Resource.query.count() == 1
+
     def test_with_one_event_provided(self, client):
         event = fake.get_instance_event()
         response = client.post('/v1/event', json=[event])
@@ -82,6 +112,53 @@ class TestEvent:
         assert models.Period.query.count() == 1
         assert models.Spec.query.count() == 1
 
+    def test_with_late_event_spliced(self, app, client):
+        app.config['INGEST_SPLICE_LATE_EVENTS'] = True
+
+        event_new = fake.get_instance_event()
+        event_new['generated'] = '2020-06-07T03:42:54.736337'
+        response = client.post('/v1/event', json=[event_new])
+        assert response.status_code == 204
+
+        event_old = fake.get_instance_event()
+        event_old['generated'] = '2020-06-07T02:42:54.736337'
+        event_old['traits'][5][2] = 'v1-standard-2'
+        response = client.post('/v1/event', json=[event_old])
+
+        assert response.status_code == 204
+        assert models.Resource.query.count() == 1
+        assert models.Period.query.count() == 3
+        assert models.Spec.query.count() == 2
+
+    def test_splice_late_events_from_env(self, monkeypatch):
+        monkeypatch.setenv('INGEST_SPLICE_LATE_EVENTS', 'true')
+        assert ingress.init_application().config['INGEST_SPLICE_LATE_EVENTS']
+
+        monkeypatch.delenv('INGEST_SPLICE_LATE_EVENTS')
+        assert not ingress.init_application().config[
+            'INGEST_SPLICE_LATE_EVENTS']
+
+    def test_process_without_splice_config(self, app):
+        del app.config['INGEST_SPLICE_LATE_EVENTS']
+        event = fake.get_instance_event()
+        assert ingress._process(event) is None
+
+        event['generated'] = '2020-06-07T00:42:54.736337'
+        assert ingress._process(event) == ('Event Too Old', 202)
+
+    def test_with_project_deleted_event(self, client):
+        response = client.post('/v1/event', json=[fake.get_instance_event()])
+        assert response.status_code == 204
+
+        response = client.post('/v1/event', json=[{
+            'generated': '2020-06-08T01:42:54.736337',
+            'event_type': 'identity.project.deleted',
+            'traits': [["project_id", 1, "fake-project"]],
+        }])
+
+        assert response.status_code == 204
+        assert models.Period.query.filter_by(ended_at=None).count() == 0
+
     def test_with_invalid_event_provided(self, client):
         event = fake.get_instance_event(event_type='foo.bar.exists')
         response = client.post('/v1/event', json=[event])
@@ -99,3 +176,19 @@ class TestEvent:
         assert models.Resource.query.count() == 0
         assert models.Period.query.count() == 0
         assert models.Spec.query.count() == 0
+
+
+@pytest.mark.usefixtures("client", "db_session")
+class TestEventWithoutIngressConfig:
+    @pytest.fixture
+    def app(self):
+        app = create_app()
+        app.register_blueprint(ingress.blueprint)
+        app.config['TESTING'] = True
+        return app
+
+    def test_with_one_event_provided(self, client):
+        response = client.post('/v1/event', json=[fake.get_instance_event()])
+
+        assert response.status_code == 204
+        assert models.Resource.query.count() == 1
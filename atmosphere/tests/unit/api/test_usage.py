@@ -12,9 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+
 import pytest
+from dateutil.relativedelta import relativedelta
 
+from atmosphere.app import create_app
 from atmosphere.api import usage
+from atmosphere import models
+from atmosphere import rating
+from atmosphere.tests.unit import fake
 
 
 @pytest.fixture
@@ -32,3 +39,306 @@ class TestResourceNoAuth:
         response = client.get('/v1/resources')
 
         assert response.status_code == 401
+
+
+@pytest.mark.usefixtures("client", "db_session")
+class TestResource:
+    QUERY = {
+        'start': '2020-06-07T00:00:00',
+        'end': '2020-06-08T00:00:00',
+    }
+
+    @pytest.fixture
+    def app(self):
+        app = create_app()
+        app.register_blueprint(usage.blueprint)
+        app.config['TESTING'] = True
+        app.config['USAGE_MAX_RESOURCES'] = 2
+        return app
+
+    def _create_resources(self, *projects):
+        for project in projects:
+            event = fake.get_normalized_instance_event()
+            event['traits']['resource_id'] = 'uuid-%s' % project
+            event['traits']['project_id'] = project
+            models.Resource.get_or_create(event)
+
+    def _get(self, client, roles, project_id=None):
+        query = dict(self.QUERY)
+        if project_id is not None:
+            query['project_id'] = project_id
+        return client.get('/v1/resources', query_string=query, headers={
+            'X-Project-Id': 'project-1',
+            'X-Roles': roles,
+        })
+
+    def test_get_resources(self, client):
+        self._create_resources('project-1', 'project-2')
+        response = self._get(client, 'member')
+
+        assert response.status_code == 200
+        assert [r['project'] for r in response.json] == ['project-1']
+
+    def test_get_resources_ignores_override_for_non_admin(self, client):
+        self._create_resources('project-1', 'project-2')
+        response = self._get(client, 'member', ['project-2'])
+
+        assert response.status_code == 200
+        assert [r['project'] for r in response.json] == ['project-1']
+
+    def test_get_resources_for_multiple_projects(self, client):
+        self._create_resources('project-1', 'project-2', 'project-3')
+        response = self._get(client, 'admin', ['project-2', 'project-3'])
+
+        assert response.status_code == 200
+        assert sorted(response.json) == ['project-2', 'project-3']
+        assert response.json['project-2'][0]['uuid'] == 'uuid-project-2'
+
+    def test_get_resources_for_all_projects(self, client):
+        self._create_resources('project-1', 'project-2')
+        response = self._get(client, 'admin', 'all')
+
+        assert response.status_code == 200
+        assert sorted(response.json) == ['project-1', 'project-2']
+
+    def test_get_resources_over_limit(self, client):
+        self._create_resources('project-1', 'project-2', 'project-3')
+        response = self._get(client, 'admin', 'all')
+
+        assert response.status_code == 400
+
+
+@pytest.mark.usefixtures("client", "db_session")
+class TestUsageTimeseries:
+    @pytest.fixture
+    def app(self):
+        app = create_app()
+        app.register_blueprint(usage.blueprint)
+        app.config['TESTING'] = True
+        app.config['USAGE_MAX_BUCKETS'] = 48
+        return app
+
+    def _get(self, client, **query):
+        return client.get('/v1/usage/timeseries', query_string=query,
+                          headers={
+                              'X-Project-Id': 'fake-project',
+                              'X-Roles': 'member',
+                          })
+
+    def test_get_usage_timeseries(self, client):
+        event = fake.get_normalized_instance_event()
+        event['traits']['created_at'] = datetime.datetime(2020, 6, 7, 1, 30)
+        models.Resource.get_or_create(event)
+
+        event['generated'] = datetime.datetime(2020, 6, 7, 3)
+        event['traits']['instance_type'] = 'v1-standard-2'
+        models.Resource.get_or_create(event)
+
+        event['generated'] = datetime.datetime(2020, 6, 7, 3, 30)
+        event['traits']['deleted_at'] = event['generated']
+        models.Resource.get_or_create(event)
+
+        response = self._get(client, start='2020-06-07T00:00:00',
+                             end='2020-06-07T04:00:00', granularity='hour')
+
+        assert response.status_code == 200
+        assert response.json['buckets'] == [
+            '2020-06-07T00:00:00', '2020-06-07T01:00:00',
+            '2020-06-07T02:00:00', '2020-06-07T03:00:00',
+        ]
+        assert [(s['spec']['instance_type'], s['seconds'])
+                for s in response.json['series']] == [
+            ('v1-standard-1', [0, 1800, 3600, 0]),
+            ('v1-standard-2', [0, 0, 0, 1800]),
+        ]
+
+    def test_get_usage_timeseries_with_too_many_buckets(self, client):
+        response = self._get(client, start='2020-06-07T00:00:00',
+                             end='2020-06-10T00:00:00', granularity='hour')
+
+        assert response.status_code == 400
+
+    def test_get_usage_timeseries_with_invalid_granularity(self, client):
+        response = self._get(client, start='2020-06-07T00:00:00',
+                             end='2020-06-08T00:00:00', granularity='week')
+
+        assert response.status_code == 400
+
+
+@pytest.mark.usefixtures("client", "db_session")
+class TestCharges:
+    @pytest.fixture
+    def app(self):
+        app = create_app()
+        app.register_blueprint(usage.blueprint)
+        app.config['TESTING'] = True
+        return app
+
+    def _get(self, client, roles='member', **query):
+        query.update(start='2020-06-07T00:00:00', end='2020-06-08T00:00:00')
+        return client.get('/v1/charges', query_string=query, headers={
+            'X-Project-Id': 'fake-project',
+            'X-Roles': roles,
+        })
+
+    def _create_resource(self, project):
+        event = fake.get_normalized_instance_event()
+        event['traits']['resource_id'] = 'uuid-%s' % project
+        event['traits']['project_id'] = project
+        event['traits']['created_at'] = datetime.datetime(2020, 6, 7, 1)
+        models.Resource.get_or_create(event)
+
+        event['generated'] = datetime.datetime(2020, 6, 7, 3)
+        event['traits']['deleted_at'] = event['generated']
+        models.Resource.get_or_create(event)
+
+    def test_get_charges(self, client):
+        rating.load_prices([{
+            'type': 'OS::Nova::Server', 'name': 'v1-standard-1',
+            'hourly_rate': '0.5',
+            'effective_at': datetime.datetime(2020, 1, 1),
+        }])
+        self._create_resource('fake-project')
+        response = self._get(client)
+
+        assert response.status_code == 200
+        assert response.json['total'] == '1.00'
+        assert response.json['lines'][0]['seconds'] == 7200
+
+    def test_get_charges_for_all_projects(self, client):
+        self._create_resource('fake-project')
+        self._create_resource('other-project')
+        response = self._get(client, 'admin', project_id='all')
+
+        assert response.status_code == 200
+        assert sorted(response.json) == ['fake-project', 'other-project']
+        assert response.json['other-project']['total'] == '0.00'
+
+    def test_get_charges_without_usage(self, client):
+        response = self._get(client)
+
+        assert response.status_code == 200
+        assert response.json == {'total': '0.00', 'lines': []}
+
+
+@pytest.mark.usefixtures("client", "db_session")
+class TestActive:
+    @pytest.fixture
+    def app(self):
+        app = create_app()
+        app.register_blueprint(usage.blueprint)
+        app.config['TESTING'] = True
+        app.config['USAGE_MAX_RESOURCES'] = 2
+        return app
+
+    def _create_resources(self, *projects):
+        for project in projects:
+            event = fake.get_normalized_instance_event()
+            event['traits']['resource_id'] = 'uuid-%s' % project
+            event['traits']['project_id'] = project
+            models.Resource.get_or_create(event)
+        return event['generated']
+
+    def _get(self, client, roles='member', **query):
+        return client.get('/v1/active', query_string=query, headers={
+            'X-Project-Id': 'project-1',
+            'X-Roles': roles,
+        })
+
+    def test_get_active(self, client):
+        self._create_resources('project-1', 'project-2')
+        response = self._get(client)
+
+        assert response.status_code == 200
+        assert len(response.json) == 1
+        assert response.json[0]['uuid'] == 'uuid-project-1'
+        assert response.json[0]['spec'] == {
+            'instance_type': 'v1-standard-1',
+            'state': 'ACTIVE',
+        }
+
+    def test_get_active_at(self, client):
+        generated = self._create_resources('project-1')
+        before = (generated - relativedelta(hours=1)).isoformat()
+        after = (generated + relativedelta(hours=1)).isoformat()
+
+        assert self._get(client, at=before).json == []
+        assert len(self._get(client, at=after).json) == 1
+
+    def test_get_active_for_all_projects(self, client):
+        self._create_resources('project-1', 'project-2')
+        response = self._get(client, 'admin', project_id='all')
+
+        assert response.status_code == 200
+        assert sorted(response.json) == ['project-1', 'project-2']
+
+    def test_get_active_over_limit(self, client):
+        self._create_resources('project-1', 'project-2', 'project-3')
+        response = self._get(client, 'admin', project_id='all')
+
+        assert response.status_code == 400
+
+    def test_get_active_with_invalid_time(self, client):
+        response = self._get(client, at='foo')
+
+        assert response.status_code == 400
+
+
+@pytest.mark.usefixtures("client", "db_session")
+class TestChanges:
+    @pytest.fixture
+    def app(self):
+        app = create_app()
+        app.register_blueprint(usage.blueprint)
+        app.config['TESTING'] = True
+        app.config['CHANGES_PAGE_SIZE'] = 2
+        app.config['CHANGES_SETTLE_SECONDS'] = -60
+        return app
+
+    def _create_resources(self, *projects):
+        for project in projects:
+            event = fake.get_normalized_instance_event()
+            event['traits']['resource_id'] = 'uuid-%s' % project
+            event['traits']['project_id'] = project
+            models.Resource.get_or_create(event)
+
+    def _get(self, client, roles='member', **query):
+        return client.get('/v1/changes', query_string=query, headers={
+            'X-Project-Id': 'project-1',
+            'X-Roles': roles,
+        })
+
+    def test_get_changes(self, client):
+        self._create_resources('project-1', 'project-2')
+        response = self._get(client)
+
+        assert response.status_code == 200
+        assert [r['uuid'] for r in response.json['resources']] == \
+            ['uuid-project-1']
+        assert response.json['deleted'] == []
+        assert not response.json['more']
+
+        response = self._get(client, since=response.json['cursor'])
+
+        assert response.status_code == 200
+        assert response.json['resources'] == []
+
+    def test_get_changes_in_pages(self, client):
+        self._create_resources('project-1', 'project-2', 'project-3')
+        response = self._get(client, 'admin', project_id='all')
+
+        assert [r['project'] for r in response.json['resources']] == \
+            ['project-1', 'project-2']
+        assert response.json['more']
+
+        response = self._get(client, 'admin', project_id='all', limit=5,
+                             since=response.json['cursor'])
+
+        assert [r['project'] for r in response.json['resources']] == \
+            ['project-3']
+        assert not response.json['more']
+
+    def test_get_changes_with_invalid_cursor(self, client):
+        response = self._get(client, since='foo')
+
+        assert response.status_code == 400
@@ -14,10 +14,22 @@
 
 import pytest
 
-from flask_sqlalchemy import SQLAlchemy
-
-from atmosphere.app import create_app
 from atmosphere.api import ingress
+from atmosphere.models import db
+
+
+@pytest.fixture
+def app():
+    app = ingress.init_application()
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def _db(app):
+    db.init_app(app)
+    db.create_all()
+    return db
 
 
 @pytest.fixture(params=[
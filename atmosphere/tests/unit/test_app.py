@@ -12,8 +12,39 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import subprocess
+import sys
+
+import pytest
+
 from atmosphere import app
 
+# NOTE: Generous enough to not be flaky on slow CI nodes, while still
+#       catching a heavy dependency being imported again at import time.
+IMPORT_TIME_BUDGET = 2.0
+
+LAZY_MODULES = ('pkg_resources', 'sentry_sdk', 'ceilometer',
+                'keystonemiddleware', 'oslo_config')
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'modules': sorted(sys.modules)}))
+"""
+
+COMMAND_MODULES = [module for modules in app.COMMANDS.values()
+                   for module in modules]
+
+CREATE_APP_SCRIPT = """
+import json, sys
+from atmosphere.app import create_app
+create_app()
+print(json.dumps(sorted(sys.modules)))
+"""
+
 
 class TestApp:
     def test_sqlalchemy_database_uri_from_env(self, monkeypatch):
@@ -28,3 +59,64 @@ class TestApp:
 
         test_app = app.create_app(FakeConfig)
         assert test_app.config['SQLALCHEMY_ECHO'] == True
+
+    def test_read_database_uri_from_env(self, monkeypatch):
+        monkeypatch.setenv("DATABASE_READ_URI", "foobar")
+
+        test_app = app.create_app()
+        assert test_app.config['SQLALCHEMY_READ_DATABASE_URI'] == 'foobar'
+
+    def test_read_database_uri_defaults_to_none(self, monkeypatch):
+        monkeypatch.delenv("DATABASE_READ_URI", raising=False)
+
+        test_app = app.create_app()
+        assert test_app.config['SQLALCHEMY_READ_DATABASE_URI'] is None
+
+    def test_version(self):
+        assert app.get_version()
+
+    def test_sentry_not_initialized_without_dsn(self, monkeypatch):
+        monkeypatch.delenv("SENTRY_DSN", raising=False)
+        # NOTE: Any attempt to import sentry_sdk will now fail.
+        monkeypatch.setitem(sys.modules, 'sentry_sdk', None)
+        app.init_sentry.cache_clear()
+
+        app.create_app()
+
+    def test_commands_loaded_when_listed(self):
+        test_app = app.create_app()
+        runner = test_app.test_cli_runner()
+
+        result = runner.invoke(args=['--help'])
+        assert result.exit_code == 0
+        for name in app.COMMANDS:
+            assert name in result.output
+
+    def test_commands_loaded_when_invoked(self):
+        test_app = app.create_app()
+        runner = test_app.test_cli_runner()
+
+        result = runner.invoke(args=['events', '--help'])
+        assert result.exit_code == 0
+        assert 'import' in result.output
+        assert 'rebuild' in result.output
+
+
+def test_create_app_does_not_import_commands():
+    output = subprocess.check_output(
+        [sys.executable, '-c', CREATE_APP_SCRIPT])
+
+    assert not set(COMMAND_MODULES) & set(json.loads(output))
+
+
+@pytest.mark.parametrize('module', [
+    'atmosphere.api.ingress',
+    'atmosphere.api.usage',
+])
+def test_wsgi_import_time(module):
+    output = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_SCRIPT % module])
+    result = json.loads(output)
+
+    assert not set(LAZY_MODULES) & set(result['modules'])
+    assert result['seconds'] < IMPORT_TIME_BUDGET
@@ -0,0 +1,140 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+import pytest
+from dateutil.relativedelta import relativedelta
+
+from atmosphere import archive
+from atmosphere import exceptions
+from atmosphere import models
+from atmosphere.models import db
+from atmosphere.tests.unit import fake
+
+
+def _add_resource(uuid, *ranges):
+    resource = fake.get_resource()
+    resource.uuid = uuid
+    spec = models.InstanceSpec.query.first() or fake.get_instance_spec()
+    for started_at, ended_at in ranges:
+        resource.periods.append(models.Period(
+            started_at=started_at, ended_at=ended_at, spec=spec))
+    db.session.add(resource)
+    db.session.commit()
+    return resource
+
+
+@pytest.mark.usefixtures("db_session")
+class TestArchive:
+    def test_archive_periods(self):
+        _add_resource('old',
+                      (datetime.datetime(2019, 1, 1),
+                       datetime.datetime(2019, 2, 1)))
+        _add_resource('mixed',
+                      (datetime.datetime(2019, 1, 1),
+                       datetime.datetime(2019, 6, 1)),
+                      (datetime.datetime(2019, 6, 1),
+                       datetime.datetime(2020, 6, 1)),
+                      (datetime.datetime(2020, 6, 1), None))
+
+        total = archive.archive_periods(datetime.datetime(2020, 1, 1),
+                                        batch_size=1)
+
+        assert total == 2
+        assert models.Period.query.count() == 2
+        assert models.ArchivedPeriod.query.count() == 2
+        assert models.PeriodBucket.query.filter(
+            models.PeriodBucket.period_id.in_(
+                [p.id for p in models.ArchivedPeriod.query])).count() == 0
+
+    def test_get_all_by_time_range_merges_archive(self):
+        _add_resource('old',
+                      (datetime.datetime(2019, 1, 1),
+                       datetime.datetime(2019, 2, 1)))
+        _add_resource('mixed',
+                      (datetime.datetime(2019, 1, 1),
+                       datetime.datetime(2019, 6, 1)),
+                      (datetime.datetime(2019, 6, 1), None))
+        archive.archive_periods(datetime.datetime(2019, 3, 1))
+
+        start = datetime.datetime(2019, 1, 15)
+        end = datetime.datetime(2019, 7, 1)
+        data = models.Resource.get_all_by_time_range(start, end)
+        data = {resource.uuid: resource for resource in data}
+
+        assert [(p.started_at, p.ended_at) for p in data['old'].periods] == [
+            (start, datetime.datetime(2019, 2, 1)),
+        ]
+        assert [(p.started_at, p.ended_at) for p in data['mixed'].periods] == [
+            (start, datetime.datetime(2019, 6, 1)),
+            (datetime.datetime(2019, 6, 1), end),
+        ]
+        assert data['mixed'].periods[0].serialize['spec'] == {
+            'instance_type': 'v2-standard-1',
+            'state': 'ACTIVE',
+        }
+
+    def test_get_all_by_time_range_limit_counts_archive(self):
+        _add_resource('old',
+                      (datetime.datetime(2019, 1, 1),
+                       datetime.datetime(2019, 2, 1)))
+        _add_resource('new', (datetime.datetime(2019, 1, 1), None))
+        archive.archive_periods(datetime.datetime(2019, 3, 1))
+
+        start = datetime.datetime(2019, 1, 15)
+        end = datetime.datetime(2019, 7, 1)
+        with pytest.raises(exceptions.TooManyResources):
+            models.Resource.get_all_by_time_range(start, end, limit=1)
+
+    def test_get_active_merges_archive(self):
+        _add_resource('old',
+                      (datetime.datetime(2019, 1, 1),
+                       datetime.datetime(2019, 2, 1)))
+        _add_resource('new', (datetime.datetime(2019, 1, 1), None))
+        archive.archive_periods(datetime.datetime(2019, 3, 1))
+
+        data = models.Resource.get_active(at=datetime.datetime(2019, 1, 15))
+
+        assert sorted(r.uuid for r in data) == ['new', 'old']
+        assert [len(r.periods) for r in data] == [1, 1]
+        assert [r.uuid for r in models.Resource.get_active()] == ['new']
+
+    def test_archived_resource_does_not_restart(self):
+        event = fake.get_normalized_instance_event()
+        event['traits']['deleted_at'] = event['traits']['created_at'] + \
+            relativedelta(hours=+1)
+        models.Resource.get_or_create(event)
+        archive.archive_periods(datetime.datetime.now() +
+                                relativedelta(days=+1))
+
+        event = fake.get_normalized_instance_event()
+        event['generated'] = event['generated'] + relativedelta(hours=+2)
+        with pytest.raises(exceptions.EventTooOld):
+            models.Resource.get_or_create(event)
+
+        assert models.Period.query.count() == 0
+
+    def test_archive_command(self, app):
+        _add_resource('old',
+                      (datetime.datetime(2019, 1, 1),
+                       datetime.datetime(2019, 2, 1)))
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['archive', 'periods',
+                                     '--retention-days', '30'])
+
+        assert result.exit_code == 0
+        assert 'Archived 1 periods' in result.output
+        assert models.ArchivedPeriod.query.count() == 1
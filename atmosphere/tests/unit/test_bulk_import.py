@@ -0,0 +1,126 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import gzip
+
+import pytest
+
+from atmosphere import bulk_import
+from atmosphere import event_archive
+from atmosphere import models
+from atmosphere.models import db
+from atmosphere.tests.benchmarks import workload
+from atmosphere.tests.unit import fake
+
+
+@pytest.fixture
+def events():
+    return workload.Workload(instances=6, volumes=3, projects=2, days=1,
+                             out_of_order=0, seed=2).events()
+
+
+def _get_state():
+    resources = sorted((r.uuid, r.type, r.project, r.updated_at)
+                       for r in models.Resource.query)
+    periods = sorted((p.resource_uuid, p.started_at, p.ended_at,
+                      p.duration_ms, p.spec.digest)
+                     for p in models.Period.query)
+    buckets = sorted(
+        (b.bucket, models.Period.query.get(b.period_id).started_at)
+        for b in models.PeriodBucket.query)
+    return resources, periods, buckets
+
+
+@pytest.mark.usefixtures("client", "db_session")
+class TestBulkImport:
+    def test_matches_online_path(self, client, events):
+        for event in events:
+            client.post('/v1/event', json=[event])
+        expected = _get_state()
+
+        for table in ('period_bucket', 'period', 'resource'):
+            db.session.execute('DELETE FROM %s' % table)
+        db.session.commit()
+
+        counts = bulk_import.import_events(events, batch_size=10)
+        assert counts['resources'] == 9
+        assert _get_state() == expected
+
+    def test_project_deleted_matches_online_path(self, client, events):
+        project = event_archive.get_trait(events[0], 'project_id')
+        events = sorted(events + [{
+            'generated': '2021-01-01T12:30:00',
+            'event_type': 'identity.project.deleted',
+            'traits': [['project_id', 1, project]],
+        }], key=lambda e: datetime.datetime.fromisoformat(e['generated']))
+        for event in events:
+            client.post('/v1/event', json=[event])
+        expected = _get_state()
+        assert datetime.datetime(2021, 1, 1, 12, 30) in [
+            p[2] for p in expected[1]]
+
+        for table in ('period_bucket', 'period', 'resource'):
+            db.session.execute('DELETE FROM %s' % table)
+        db.session.commit()
+
+        bulk_import.import_events(events, batch_size=10)
+        assert _get_state() == expected
+
+    def test_sorts_events_per_resource(self, events):
+        bulk_import.import_events(events)
+        expected = _get_state()
+
+        for table in ('period_bucket', 'period', 'resource'):
+            db.session.execute('DELETE FROM %s' % table)
+        db.session.commit()
+
+        bulk_import.import_events(reversed(events))
+        assert _get_state() == expected
+
+    def test_skips_existing_resources(self):
+        models.Resource.get_or_create(fake.get_normalized_instance_event())
+
+        counts = bulk_import.import_events([fake.get_instance_event()])
+        assert counts['existing'] == 1
+        assert counts['resources'] == 0
+
+    def test_period_ids_after_archived_periods(self):
+        resource = fake.get_resource()
+        spec = fake.get_instance_spec()
+        db.session.add_all([resource, spec])
+        db.session.commit()
+        db.session.execute(models.ArchivedPeriod.__table__.insert(), {
+            'id': 100,
+            'resource_uuid': resource.uuid,
+            'started_at': datetime.datetime(2020, 1, 1),
+            'ended_at': datetime.datetime(2020, 1, 2),
+            'spec_id': spec.id,
+        })
+        db.session.commit()
+
+        bulk_import.import_events([fake.get_instance_event('uuid-2')])
+        assert [p.id for p in models.Period.query] == [101]
+
+    def test_import_command(self, app, tmp_path, events):
+        path = str(tmp_path / 'events.jsonl.gz')
+        with gzip.open(path, 'wt') as dump:
+            workload.write_events(events, dump)
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['events', 'import', path])
+
+        assert result.exit_code == 0, result.output
+        assert result.output.startswith('resources: 9, periods: ')
+        assert models.Resource.query.count() == 9
@@ -0,0 +1,218 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+
+import pytest
+import webob
+from freezegun import freeze_time
+from keystonemiddleware import auth_token
+
+from atmosphere import cache
+
+
+def get_token(expires_in=3600):
+    expires_at = datetime.datetime.utcnow() + \
+        datetime.timedelta(seconds=expires_in)
+    return {
+        'token': {
+            'expires_at': expires_at.strftime('%Y-%m-%dT%H:%M:%S.000000Z'),
+            'issued_at': datetime.datetime.utcnow().isoformat() + 'Z',
+            'methods': ['password'],
+            'user': {'id': 'fake-user', 'name': 'fake-user',
+                     'domain': {'id': 'default', 'name': 'Default'}},
+            'project': {'id': 'fake-project', 'name': 'fake-project',
+                        'domain': {'id': 'default', 'name': 'Default'}},
+            'roles': [{'id': 'fake-role', 'name': 'member'}],
+        }
+    }
+
+
+class FakeIdentityHandler(BaseHTTPRequestHandler):
+    """Minimal Keystone v3 API which records the requests it serves."""
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, code=200, subject_token=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if subject_token is not None:
+            self.send_header('X-Subject-Token', subject_token)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _get_token(self):
+        token = get_token()
+        token['token']['catalog'] = [{
+            'id': 'keystone',
+            'type': 'identity',
+            'name': 'keystone',
+            'endpoints': [{
+                'id': interface,
+                'interface': interface,
+                'region': 'RegionOne',
+                'region_id': 'RegionOne',
+                'url': self.server.url + '/v3',
+            } for interface in ('public', 'internal', 'admin')],
+        }]
+        return token
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path))
+        if self.path.startswith('/v3/auth/tokens'):
+            return self._send(self._get_token(),
+                              subject_token=self.headers['X-Subject-Token'])
+        return self._send({'version': {
+            'id': 'v3.0',
+            'status': 'stable',
+            'links': [{'rel': 'self', 'href': self.server.url + '/v3/'}],
+        }})
+
+    def do_POST(self):
+        self.server.requests.append(('POST', self.path))
+        self.rfile.read(int(self.headers['Content-Length']))
+        return self._send(self._get_token(), code=201,
+                          subject_token='fake-service-token')
+
+
+@pytest.fixture
+def identity():
+    server = HTTPServer(('127.0.0.1', 0), FakeIdentityHandler)
+    server.url = 'http://127.0.0.1:%d' % server.server_port
+    server.requests = []
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestTokenCache:
+    def test_get_missing(self):
+        token_cache = cache.TokenCache()
+        assert token_cache.get('foo') is None
+
+    def test_set_and_get(self):
+        token_cache = cache.TokenCache()
+        token_cache.set('foo', b'bar')
+        assert token_cache.get('foo') == b'bar'
+
+    def test_delete(self):
+        token_cache = cache.TokenCache()
+        token_cache.set('foo', b'bar')
+        token_cache.delete('foo')
+        assert token_cache.get('foo') is None
+
+    def test_evicts_least_recently_used(self):
+        token_cache = cache.TokenCache(maxsize=2)
+        token_cache.set('foo', b'1')
+        token_cache.set('bar', b'2')
+        token_cache.get('foo')
+        token_cache.set('baz', b'3')
+
+        assert token_cache.get('foo') == b'1'
+        assert token_cache.get('bar') is None
+        assert token_cache.get('baz') == b'3'
+
+    def test_expires_after_ttl(self):
+        token_cache = cache.TokenCache(ttl=60)
+        with freeze_time() as frozen_time:
+            token_cache.set('foo', b'bar')
+            frozen_time.tick(59)
+            assert token_cache.get('foo') == b'bar'
+            frozen_time.tick(1)
+            assert token_cache.get('foo') is None
+
+    def test_expires_after_requested_time(self):
+        token_cache = cache.TokenCache(ttl=60)
+        with freeze_time() as frozen_time:
+            token_cache.set('foo', b'bar', time=10)
+            frozen_time.tick(10)
+            assert token_cache.get('foo') is None
+
+    def test_expires_with_token(self):
+        token_cache = cache.TokenCache(ttl=60)
+        with freeze_time() as frozen_time:
+            token_cache.set('foo', json.dumps(get_token(expires_in=30)))
+            frozen_time.tick(29)
+            assert token_cache.get('foo') is not None
+            frozen_time.tick(1)
+            assert token_cache.get('foo') is None
+
+    def test_does_not_store_expired_token(self):
+        token_cache = cache.TokenCache()
+        token_cache.set('foo', json.dumps(get_token(expires_in=-30)))
+        assert token_cache.get('foo') is None
+
+
+class TestGetTokenCache:
+    def test_without_backend(self):
+        assert cache.get_token_cache({}) is None
+
+    def test_memory(self):
+        token_cache = cache.get_token_cache({
+            'TOKEN_CACHE': 'memory',
+            'TOKEN_CACHE_SIZE': 10,
+            'TOKEN_CACHE_TTL': 20,
+        })
+
+        assert isinstance(token_cache, cache.TokenCache)
+        assert token_cache.maxsize == 10
+        assert token_cache.ttl == 20
+
+    def test_uwsgi_outside_uwsgi(self):
+        with pytest.raises(RuntimeError):
+            cache.get_token_cache({'TOKEN_CACHE': 'uwsgi'})
+
+
+class TestTokenCacheMiddleware:
+    @staticmethod
+    def _app(environ, start_response):
+        start_response('200 OK', [])
+        return [environ['HTTP_X_PROJECT_ID'].encode('utf-8')]
+
+    def test_validates_token_once(self, identity):
+        token_cache = cache.TokenCache()
+        app = cache.TokenCacheMiddleware(auth_token.AuthProtocol(self._app, {
+            'auth_type': 'password',
+            'auth_url': identity.url + '/v3',
+            'username': 'atmosphere',
+            'password': 'secrete',
+            'user_domain_id': 'default',
+            'project_name': 'service',
+            'project_domain_id': 'default',
+            'www_authenticate_uri': identity.url,
+            'cache': cache.ENVIRON_KEY,
+        }), token_cache)
+
+        for _ in range(3):
+            request = webob.Request.blank('/', headers={
+                'X-Auth-Token': 'fake-token',
+            })
+            response = request.get_response(app)
+
+            assert response.status_code == 200
+            assert response.body == b'fake-project'
+
+        validations = [r for r in identity.requests
+                       if r == ('GET', '/v3/auth/tokens')]
+        assert len(validations) == 1
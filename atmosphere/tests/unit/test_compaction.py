@@ -0,0 +1,112 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+import pytest
+
+from atmosphere import compaction
+from atmosphere import models
+from atmosphere.models import db
+from atmosphere.tests.unit import fake
+
+
+@pytest.fixture
+def specs():
+    specs = [fake.get_instance_spec(instance_type='v1', state='ACTIVE'),
+             fake.get_instance_spec(instance_type='v1', state='SHUTOFF')]
+    db.session.add_all(specs)
+    db.session.commit()
+    return specs
+
+
+def _add_resource(uuid, specs, *hours):
+    resource = fake.get_resource()
+    resource.uuid = uuid
+    start = datetime.datetime(2020, 11, 1)
+    for i, spec in enumerate(specs):
+        ended_at = None
+        if hours[i + 1] is not None:
+            ended_at = start + datetime.timedelta(hours=hours[i + 1])
+        resource.periods.append(models.Period(
+            started_at=start + datetime.timedelta(hours=hours[i]),
+            ended_at=ended_at, spec=spec))
+    db.session.add(resource)
+    db.session.commit()
+    return resource
+
+
+def _get_periods(uuid):
+    query = models.Period.query.filter_by(resource_uuid=uuid)
+    return [(p.started_at.hour, p.ended_at and p.ended_at.hour, p.spec_id)
+            for p in query.order_by(models.Period.started_at)]
+
+
+@pytest.mark.usefixtures("db_session")
+class TestCompaction:
+    def test_compact_periods(self, specs):
+        active, shutoff = specs
+        _add_resource('uuid-1', [active, active, shutoff, shutoff, shutoff],
+                      0, 1, 2, 3, 4, None)
+        _add_resource('uuid-2', [active, active], 0, 1, 3)
+        _add_resource('uuid-3', [active, shutoff, active], 0, 1, 2, 3)
+
+        total = sum(p.seconds for p in models.Period.query
+                    if p.ended_at is not None)
+        assert compaction.compact_periods(batch_size=2) == 3
+
+        assert _get_periods('uuid-1') == [
+            (0, 2, active.id),
+            (2, 4, shutoff.id),
+            (4, None, shutoff.id),
+        ]
+        assert _get_periods('uuid-2') == [(0, 3, active.id)]
+        assert _get_periods('uuid-3') == [
+            (0, 1, active.id),
+            (1, 2, shutoff.id),
+            (2, 3, active.id),
+        ]
+        assert total == sum(p.seconds for p in models.Period.query
+                            if p.ended_at is not None)
+
+    def test_compact_periods_with_gap(self, specs):
+        active, _ = specs
+        resource = _add_resource('uuid-1', [active], 0, 1)
+        resource.periods.append(models.Period(
+            started_at=datetime.datetime(2020, 11, 1, 2),
+            ended_at=datetime.datetime(2020, 11, 1, 3), spec=active))
+        db.session.commit()
+
+        assert compaction.compact_periods() == 0
+
+    def test_compacted_period_keeps_duration_and_buckets(self, specs):
+        active, _ = specs
+        _add_resource('uuid-1', [active, active], 0, 1, 2)
+
+        compaction.compact_periods()
+
+        period = models.Period.query.one()
+        assert period.duration_ms == 2 * 3600000
+        assert [b.period_id for b in models.PeriodBucket.query] == \
+            [period.id]
+
+    def test_compact_command(self, app, specs):
+        active, _ = specs
+        _add_resource('uuid-1', [active, active], 0, 1, 2)
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['compact', 'periods'])
+
+        assert result.exit_code == 0
+        assert result.output == 'Reclaimed 1 periods\n'
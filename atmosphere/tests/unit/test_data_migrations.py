@@ -0,0 +1,213 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+import pytest
+
+from atmosphere import data_migrations
+from atmosphere import models
+from atmosphere.models import db
+from atmosphere.tests.unit import fake
+
+
+class SuffixProject(data_migrations.DataMigration):
+    name = 'suffix-project'
+    table = models.Resource.__table__
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.ranges = []
+
+    def migrate_range(self, lower, upper):
+        if self.fail_after is not None and \
+                len(self.ranges) == self.fail_after:
+            raise RuntimeError('interrupted')
+        self.ranges.append((lower, upper))
+
+        table = self.table
+        db.session.execute(table.update().where(
+            self.get_range_clause(lower, upper)
+        ).values(project=table.c.project + '-x'))
+
+
+@pytest.fixture
+def resources():
+    for i in range(5):
+        resource = fake.get_resource()
+        resource.uuid = 'uuid-%d' % i
+        db.session.add(resource)
+    db.session.commit()
+
+
+def _get_projects():
+    return [r.project for r in models.Resource.query.order_by('uuid')]
+
+
+@pytest.mark.usefixtures("db_session", "resources")
+class TestDataMigration:
+    def test_run(self):
+        migration = SuffixProject()
+        assert migration.run(batch_size=2) == 3
+
+        assert migration.ranges == [
+            (None, 'uuid-1'),
+            ('uuid-1', 'uuid-3'),
+            ('uuid-3', None),
+        ]
+        assert _get_projects() == ['fake-project-x'] * 5
+        assert migration.get_state().completed_at is not None
+
+    def test_run_completed(self):
+        SuffixProject().run(batch_size=2)
+
+        assert SuffixProject().run(batch_size=2) == 0
+        assert _get_projects() == ['fake-project-x'] * 5
+
+    def test_resume(self):
+        with pytest.raises(RuntimeError):
+            SuffixProject(fail_after=1).run(batch_size=2)
+        db.session.rollback()
+
+        state = models.DataMigrationState.query.get('suffix-project')
+        assert state.last_key == 'uuid-1'
+        assert state.completed_at is None
+
+        migration = SuffixProject()
+        assert migration.run(batch_size=2) == 2
+        assert migration.ranges[0] == ('uuid-1', 'uuid-3')
+        assert _get_projects() == ['fake-project-x'] * 5
+
+    def test_commands(self, app, monkeypatch):
+        monkeypatch.setattr(data_migrations, 'MIGRATIONS', {})
+        data_migrations.register(SuffixProject)
+        runner = app.test_cli_runner()
+
+        result = runner.invoke(args=['data', 'status'])
+        assert result.output == 'suffix-project: pending\n'
+
+        result = runner.invoke(args=['data', 'migrate', '--batch-size', '2'])
+        assert result.exit_code == 0
+        assert result.output == 'suffix-project: migrated 3 batches\n'
+
+        result = runner.invoke(args=['data', 'status'])
+        assert 'suffix-project: completed at' in result.output
+
+        result = runner.invoke(args=['data', 'migrate', 'foobar'])
+        assert result.exit_code != 0
+        assert 'Unknown data migration: foobar' in result.output
+
+
+@pytest.mark.usefixtures("db_session")
+class TestPeriodDuration:
+    def test_backfill(self):
+        resource = fake.get_resource()
+        db.session.add(resource)
+        spec = fake.get_instance_spec()
+        db.session.add(spec)
+        db.session.commit()
+
+        db.session.execute(models.Period.__table__.insert(), [{
+            'resource_uuid': resource.uuid,
+            'started_at': datetime.datetime(2020, 11, 1),
+            'ended_at': ended_at,
+            'spec_id': spec.id,
+        } for ended_at in (datetime.datetime(2020, 11, 1, 1),
+                           datetime.datetime(2020, 11, 1, 0, 0, 30),
+                           None)])
+        db.session.commit()
+
+        data_migrations.PeriodDuration().run(batch_size=2)
+
+        query = models.Period.query.order_by(models.Period.id)
+        assert [p.duration_ms for p in query] == [3600000, 30000, None]
+
+    def test_backfill_matches_get_duration_ms(self):
+        resource = fake.get_resource()
+        db.session.add(resource)
+        spec = fake.get_instance_spec()
+        db.session.add(spec)
+        db.session.commit()
+
+        started_at = datetime.datetime(2020, 11, 1, 0, 0, 0, 736337)
+        db.session.execute(models.Period.__table__.insert(), [{
+            'resource_uuid': resource.uuid,
+            'started_at': started_at,
+            'ended_at': datetime.datetime(2020, 11, 1, 1, 0, 0, microsecond),
+            'spec_id': spec.id,
+        } for microsecond in (0, 1, 236337, 236836, 999999)])
+        db.session.commit()
+
+        data_migrations.PeriodDuration().run(batch_size=2)
+
+        for period in models.Period.query:
+            assert period.duration_ms == models.Period.get_duration_ms(
+                period.started_at, period.ended_at)
+
+
+@pytest.mark.usefixtures("db_session")
+class TestArchivedPeriodDuration:
+    def test_backfill(self):
+        resource = fake.get_resource()
+        db.session.add(resource)
+        spec = fake.get_instance_spec()
+        db.session.add(spec)
+        db.session.commit()
+
+        db.session.execute(models.ArchivedPeriod.__table__.insert(), [{
+            'id': i,
+            'resource_uuid': resource.uuid,
+            'started_at': datetime.datetime(2020, 11, 1),
+            'ended_at': ended_at,
+            'duration_ms': duration_ms,
+            'spec_id': spec.id,
+        } for i, (ended_at, duration_ms) in enumerate((
+            (datetime.datetime(2020, 11, 1, 1), None),
+            (datetime.datetime(2020, 11, 1, 0, 0, 30), None),
+            (datetime.datetime(2020, 11, 2), 1234),
+        ), start=1)])
+        db.session.commit()
+
+        migration = data_migrations.ArchivedPeriodDuration()
+        assert migration.run(batch_size=2) == 2
+
+        query = models.ArchivedPeriod.query.order_by(models.ArchivedPeriod.id)
+        assert [p.duration_ms for p in query] == [3600000, 30000, 1234]
+
+    def test_registered(self):
+        assert data_migrations.MIGRATIONS['archived-period-duration'] is \
+            data_migrations.ArchivedPeriodDuration
+
+
+@pytest.mark.usefixtures("db_session")
+class TestResourceChangeProject:
+    def test_backfill(self):
+        resource = fake.get_resource()
+        db.session.add(resource)
+        db.session.commit()
+
+        db.session.execute(models.ResourceChange.__table__.insert(), [{
+            'resource_uuid': uuid,
+            'project': project,
+            'changed_at': datetime.datetime(2020, 11, 1),
+        } for uuid, project in ((resource.uuid, None),
+                                ('deleted-uuid', None),
+                                (resource.uuid, 'other-project'))])
+        db.session.commit()
+
+        data_migrations.ResourceChangeProject().run(batch_size=2)
+
+        query = models.ResourceChange.query.order_by(models.ResourceChange.id)
+        assert [c.project for c in query] == \
+            ['fake-project', None, 'other-project']
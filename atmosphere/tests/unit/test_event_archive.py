@@ -0,0 +1,336 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import gzip
+import json
+
+import pytest
+
+from atmosphere.api import ingress
+from atmosphere import event_archive
+from atmosphere import models
+from atmosphere.models import db
+from atmosphere.tests.benchmarks import workload
+from atmosphere.tests.unit import fake
+
+
+@pytest.fixture
+def archive_dir(tmp_path):
+    return tmp_path / 'events'
+
+
+@pytest.fixture
+def app(archive_dir):
+    class FakeConfig:
+        EVENT_ARCHIVE_DIR = str(archive_dir)
+        EVENT_ARCHIVE_SEGMENT_EVENTS = 50
+
+    app = ingress.init_application(FakeConfig)
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def events():
+    return workload.Workload(instances=4, volumes=2, projects=2, days=1,
+                             out_of_order=0, seed=1).events()
+
+
+def _with_project_deleted(events, project, generated):
+    deleted = {
+        'generated': generated,
+        'event_type': 'identity.project.deleted',
+        'traits': [['project_id', 1, project]],
+    }
+    return sorted(events + [deleted],
+                  key=lambda e: datetime.datetime.fromisoformat(
+                      e['generated']))
+
+
+def _get_state():
+    return sorted(
+        (p.resource_uuid, p.started_at, p.ended_at, p.spec.digest)
+        for p in models.Period.query)
+
+
+class TestSegmentWriter:
+    def test_write(self, tmp_path):
+        writer = event_archive.SegmentWriter(str(tmp_path), 2)
+        writer.write([fake.get_instance_event('uuid-1'),
+                      fake.get_instance_event('uuid-2'),
+                      fake.get_volume_event()])
+
+        segments = event_archive.get_segments(str(tmp_path))
+        assert len(segments) == 2
+
+        index = event_archive.read_index(segments[0])
+        assert index == {
+            'events': 2,
+            'start': '2020-06-07T01:42:54.736337',
+            'end': '2020-06-07T01:42:54.736337',
+            'resources': ['uuid-1', 'uuid-2'],
+            'projects': ['fake-project'],
+        }
+
+        # NOTE: The second segment is still open but can already be read.
+        assert event_archive.read_index(segments[1]) is None
+        assert list(event_archive.read_segment(segments[1])) == \
+            [fake.get_volume_event()]
+
+        writer.close()
+        assert event_archive.read_index(segments[1])['events'] == 1
+
+    def test_read_truncated_segment(self, tmp_path):
+        path = str(tmp_path / ('segment' + event_archive.SEGMENT_SUFFIX))
+        with gzip.open(path, 'wt') as segment:
+            segment.write('{"foo": "bar"}\n{"foo": ')
+        with open(path, 'rb') as segment:
+            data = segment.read()
+        with open(path, 'wb') as segment:
+            segment.write(data[:-10])
+
+        assert list(event_archive.read_segment(path)) == [{'foo': 'bar'}]
+
+
+@pytest.mark.usefixtures("client", "db_session")
+class TestEventArchive:
+    def test_ingress_records_events(self, app, client, archive_dir):
+        response = client.post('/v1/event', json=[fake.get_instance_event()])
+        assert response.status_code == 204
+        app.extensions['event_archive'].close()
+
+        segments = event_archive.get_segments(str(archive_dir))
+        assert len(segments) == 1
+        assert list(event_archive.read_segment(segments[0])) == \
+            [fake.get_instance_event()]
+
+    def test_ingress_records_unprocessed_events(self, app, client,
+                                                archive_dir, monkeypatch):
+        monkeypatch.setattr(ingress, 'ARCHIVE_BATCH_SIZE', 2)
+        events = [fake.get_instance_event(resource_id='uuid-%d' % i)
+                  for i in range(5)]
+        client.post('/v1/event', json=[events[1]])
+
+        events[1]['generated'] = '2020-06-07T00:00:00'
+        response = client.post('/v1/event', json=events)
+        assert response.status_code == 202
+        assert models.Resource.query.count() == 2
+        app.extensions['event_archive'].close()
+
+        segments = event_archive.get_segments(str(archive_dir))
+        assert len(list(event_archive.read_segment(segments[0]))) == 6
+        assert list(event_archive.read_segment(segments[0]))[1:] == events
+
+    def test_ingress_records_events_before_processing(self, app, client,
+                                                      monkeypatch):
+        archived = []
+        process = ingress._process
+
+        def _process(event_data):
+            archived.append(app.extensions['event_archive'].index['events'])
+            return process(event_data)
+
+        monkeypatch.setattr(ingress, '_process', _process)
+        events = [fake.get_instance_event(resource_id='uuid-%d' % i)
+                  for i in range(3)]
+        response = client.post('/v1/event', json=events)
+
+        assert response.status_code == 204
+        assert archived == [1, 2, 3]
+
+    def test_ingress_records_events_after_error(self, app, client,
+                                                archive_dir):
+        events = [fake.get_instance_event(resource_id='uuid-%d' % i)
+                  for i in range(4)]
+        events[1]['event_type'] = 'foo.bar.exists'
+        response = client.post('/v1/event', json=events)
+
+        assert response.status_code == 400
+        assert models.Resource.query.count() == 1
+        app.extensions['event_archive'].close()
+
+        segments = event_archive.get_segments(str(archive_dir))
+        assert list(event_archive.read_segment(segments[0])) == events
+
+    def test_ingress_records_events_before_invalid_body(self, app, client,
+                                                        archive_dir):
+        event = fake.get_instance_event()
+        body = json.dumps([event, event])[:-10]
+        response = client.post('/v1/event', data=body,
+                               content_type='application/json')
+
+        assert response.status_code == 400
+        app.extensions['event_archive'].close()
+
+        segments = event_archive.get_segments(str(archive_dir))
+        assert list(event_archive.read_segment(segments[0])) == [event]
+
+    def test_ingress_without_archive(self, app, client, archive_dir):
+        app.config['EVENT_ARCHIVE_DIR'] = None
+        client.post('/v1/event', json=[fake.get_instance_event()])
+
+        assert not archive_dir.exists()
+
+    @pytest.mark.parametrize('batch_size', [1000, 4])
+    def test_rebuild(self, client, archive_dir, events, batch_size):
+        for event in events:
+            client.post('/v1/event', json=[event])
+        expected = _get_state()
+
+        db.session.execute(models.Period.__table__.delete())
+        db.session.commit()
+
+        counts = event_archive.rebuild(str(archive_dir),
+                                       batch_size=batch_size)
+        assert counts['resources'] == 6
+        assert counts['applied'] > 0
+        assert _get_state() == expected
+
+    def test_rebuild_project(self, client, archive_dir, events):
+        for event in events:
+            client.post('/v1/event', json=[event])
+        expected = _get_state()
+
+        project = event_archive.get_trait(events[0], 'project_id')
+        resources = {r.uuid for r in models.Resource.query.filter_by(
+            project=project)}
+        db.session.execute(models.Period.__table__.delete())
+        db.session.commit()
+
+        counts = event_archive.rebuild(str(archive_dir), projects=[project])
+        assert counts['resources'] == len(resources)
+        assert _get_state() == [p for p in expected if p[0] in resources]
+
+    def test_rebuild_project_deleted(self, client, archive_dir, events):
+        project = event_archive.get_trait(events[0], 'project_id')
+        events = _with_project_deleted(events, project, '2021-01-01T12:30:00')
+        for event in events:
+            client.post('/v1/event', json=[event])
+        expected = _get_state()
+        deleted_at = datetime.datetime(2021, 1, 1, 12, 30)
+        assert deleted_at in [p[2] for p in expected]
+
+        db.session.execute(models.PeriodBucket.__table__.delete())
+        db.session.execute(models.Period.__table__.delete())
+        db.session.commit()
+
+        event_archive.rebuild(str(archive_dir))
+        assert _get_state() == expected
+
+    def test_find_resources_of_deleted_project(self, client, archive_dir,
+                                               events):
+        project = event_archive.get_trait(events[0], 'project_id')
+        events = _with_project_deleted(events, project, '2021-01-01T12:30:00')
+        for event in events:
+            client.post('/v1/event', json=[event])
+
+        resources = event_archive.find_resources(
+            str(archive_dir), start=datetime.datetime(2021, 1, 1, 12, 15),
+            end=datetime.datetime(2021, 1, 1, 12, 45))
+        assert resources == {r.uuid for r in models.Resource.query.filter_by(
+            project=project)}
+
+    def test_rebuild_failure_keeps_resource(self, client, archive_dir,
+                                            events, monkeypatch):
+        for event in events:
+            client.post('/v1/event', json=[event])
+        expected = _get_state()
+        resources = models.Resource.query.count()
+
+        def replay(*_):
+            raise RuntimeError('replay failed')
+
+        monkeypatch.setattr(event_archive, 'replay', replay)
+        with pytest.raises(RuntimeError):
+            event_archive.rebuild(str(archive_dir))
+
+        assert models.Resource.query.count() == resources
+        assert _get_state() == expected
+
+    def test_rebuild_incomplete_history(self, app, client, archive_dir):
+        app.config['EVENT_ARCHIVE_DIR'] = None
+        event = fake.get_instance_event()
+        client.post('/v1/event', json=[event])
+        event['generated'] = '2020-06-07T02:00:00'
+        event['traits'][5] = ['instance_type', 1, 'v1-standard-2']
+        client.post('/v1/event', json=[event])
+
+        app.config['EVENT_ARCHIVE_DIR'] = str(archive_dir)
+        event['generated'] = '2020-06-07T03:00:00'
+        client.post('/v1/event', json=[event])
+        expected = _get_state()
+        assert len(expected) == 2
+
+        counts = event_archive.rebuild(str(archive_dir))
+        assert counts['incomplete'] == 1
+        assert counts['applied'] == 0
+        assert _get_state() == expected
+
+    def test_rebuild_without_created_at(self, app, client, archive_dir):
+        app.config['EVENT_ARCHIVE_DIR'] = None
+        event = fake.get_instance_event()
+        client.post('/v1/event', json=[event])
+
+        app.config['EVENT_ARCHIVE_DIR'] = str(archive_dir)
+        event['generated'] = '2020-06-07T03:00:00'
+        event['traits'] = [t for t in event['traits'] if t[0] != 'created_at']
+        client.post('/v1/event', json=[event])
+        expected = _get_state()
+
+        counts = event_archive.rebuild(str(archive_dir))
+        assert counts['incomplete'] == 1
+        assert _get_state() == expected
+
+    def test_rebuild_time_window(self, client, archive_dir, events):
+        for event in events:
+            client.post('/v1/event', json=[event])
+
+        resources = event_archive.find_resources(
+            str(archive_dir), start=datetime.datetime(2030, 1, 1))
+        assert resources == set()
+
+
+class TestParallelRebuild:
+    @pytest.fixture
+    def app(self, tmp_path, archive_dir):
+        class FakeConfig:
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///%s' % (tmp_path / 'db')
+            EVENT_ARCHIVE_DIR = str(archive_dir)
+
+        app = ingress.init_application(FakeConfig)
+        with app.app_context():
+            db.create_all()
+        return app
+
+    def test_rebuild_command(self, app, events):
+        client = app.test_client()
+        for event in events:
+            client.post('/v1/event', json=[event])
+        app.extensions['event_archive'].close()
+
+        with app.app_context():
+            expected = _get_state()
+            db.session.execute(models.Period.__table__.delete())
+            db.session.commit()
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['events', 'rebuild',
+                                     '--processes', '2'])
+        assert result.exit_code == 0, result.output
+        assert result.output.startswith('resources: 6, applied: ')
+        assert result.output.strip().endswith('incomplete: 0')
+
+        with app.app_context():
+            assert _get_state() == expected
@@ -0,0 +1,82 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+
+import prometheus_client
+import pytest
+
+from atmosphere import metrics
+from atmosphere.tests.unit import fake
+
+
+def get_sample_value(name, **labels):
+    value = prometheus_client.REGISTRY.get_sample_value(name, labels)
+    return value or 0
+
+
+@pytest.mark.usefixtures("client", "db_session")
+class TestMetrics:
+    def test_metrics(self, client):
+        response = client.get('/metrics')
+
+        assert response.status_code == 200
+        assert b'atmosphere_ingest_stage_seconds' in response.data
+
+    def test_metrics_multiprocess(self, client, monkeypatch, tmp_path):
+        monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(tmp_path))
+        response = client.get('/metrics')
+
+        assert response.status_code == 200
+
+    def test_ingest_outcomes(self, client, ignored_event):
+        applied = get_sample_value('atmosphere_ingest_events_total',
+                                   outcome='applied')
+        ignored = get_sample_value('atmosphere_ingest_events_total',
+                                   outcome='ignored')
+
+        client.post('/v1/event', json=[fake.get_instance_event()])
+        client.post('/v1/event', json=[
+            fake.get_instance_event(event_type=ignored_event)
+        ])
+
+        assert get_sample_value('atmosphere_ingest_events_total',
+                                outcome='applied') == applied + 1
+        assert get_sample_value('atmosphere_ingest_events_total',
+                                outcome='ignored') == ignored + 1
+
+    def test_ingest_stages(self, client):
+        counts = {
+            stage: get_sample_value('atmosphere_ingest_stage_seconds_count',
+                                    stage=stage)
+            for stage in ('decode', 'normalize', 'dispatch',
+                          'resource_lookup', 'spec_lookup', 'commit')
+        }
+
+        client.post('/v1/event', json=[fake.get_instance_event()])
+
+        for stage, count in counts.items():
+            assert get_sample_value('atmosphere_ingest_stage_seconds_count',
+                                    stage=stage) > count
+
+
+class TestTimedQueuePool:
+    def test_checkout(self):
+        count = get_sample_value('atmosphere_db_pool_checkout_seconds_count')
+
+        pool = metrics.TimedQueuePool(lambda: sqlite3.connect(':memory:'))
+        pool.connect().close()
+
+        assert get_sample_value(
+            'atmosphere_db_pool_checkout_seconds_count') == count + 1
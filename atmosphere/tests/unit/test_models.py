@@ -23,6 +23,7 @@ from freezegun import freeze_time
 import before_after
 
 from atmosphere.api import ingress
+from atmosphere.app import create_app
 from atmosphere import models
 from atmosphere.models import db
 from atmosphere import exceptions
@@ -37,11 +38,109 @@ def app():
     return app
 
 
-@pytest.fixture
-def _db(app):
-    db.init_app(app)
-    db.create_all()
-    return db
+@pytest.mark.usefixtures("app")
+class TestRoutingSession:
+    @pytest.fixture
+    def app(self, tmp_path):
+        class FakeConfig:
+            SQLALCHEMY_DATABASE_URI = \
+                'sqlite:///%s' % (tmp_path / 'primary.db')
+            SQLALCHEMY_READ_DATABASE_URI = \
+                'sqlite:///%s' % (tmp_path / 'replica.db')
+            SQLALCHEMY_READ_MAX_STALENESS = 0
+            SQLALCHEMY_READ_LAG_CHECK_INTERVAL = 0
+
+        app = create_app(FakeConfig)
+        with app.app_context():
+            db.create_all()
+            replica = app.extensions.setdefault('read_replica',
+                                                models.ReadReplica())
+            db.Model.metadata.create_all(replica.get_engine(app))
+        return app
+
+    def _add_resource(self):
+        db.session.add(fake.get_resource())
+        db.session.commit()
+        db.session.remove()
+
+    def test_reads_from_primary_by_default(self):
+        self._add_resource()
+        assert models.Resource.query.count() == 1
+
+    def test_reads_from_replica(self):
+        self._add_resource()
+        models.use_read_replica()
+        assert models.Resource.query.count() == 0
+
+    def test_reads_from_primary_without_replica(self, app):
+        app.config['SQLALCHEMY_READ_DATABASE_URI'] = None
+        self._add_resource()
+        models.use_read_replica()
+        assert models.Resource.query.count() == 1
+
+    def test_reads_from_primary_after_write_in_session(self):
+        models.use_read_replica()
+        db.session.add(fake.get_resource())
+        db.session.flush()
+        assert models.Resource.query.count() == 1
+
+    def _add_heartbeat(self, beat_at):
+        db.session.add(models.ReplicaHeartbeat(beat_at=beat_at))
+        db.session.commit()
+        db.session.remove()
+
+    def _replicate_heartbeats(self, app):
+        table = models.ReplicaHeartbeat.__table__
+        rows = [dict(row) for row in db.session.execute(table.select())]
+        with app.extensions['read_replica'].get_engine(app).begin() as conn:
+            conn.execute(table.delete())
+            conn.execute(table.insert(), rows)
+
+    def test_reads_from_primary_when_replica_lags(self):
+        self._add_resource()
+        self._add_heartbeat(datetime.datetime.now() - relativedelta(seconds=5))
+        models.use_read_replica()
+        assert models.Resource.query.count() == 1
+
+    def test_reads_from_replica_within_max_staleness(self, app):
+        app.config['SQLALCHEMY_READ_MAX_STALENESS'] = 60
+        self._add_resource()
+        self._add_heartbeat(datetime.datetime.now() - relativedelta(seconds=5))
+        models.use_read_replica()
+        assert models.Resource.query.count() == 0
+
+    def test_get_lag(self, app):
+        replica = app.extensions['read_replica']
+        assert replica.get_lag(app) == 0
+        assert models.ReplicaHeartbeat.query.count() == 1
+
+        # NOTE: The heartbeat written by the check never reached the replica.
+        db.session.execute(models.ReplicaHeartbeat.__table__.update().values(
+            beat_at=datetime.datetime.now() - relativedelta(minutes=1)))
+        db.session.commit()
+        assert replica.get_lag(app) >= 60
+
+        self._replicate_heartbeats(app)
+        assert replica.get_lag(app) == 0
+
+    def test_get_lag_prunes_replicated_heartbeats(self, app):
+        replica = app.extensions['read_replica']
+        for _ in range(3):
+            replica.get_lag(app)
+        self._replicate_heartbeats(app)
+        replica.get_lag(app)
+
+        ids = [h.id for h in models.ReplicaHeartbeat.query.order_by(
+            models.ReplicaHeartbeat.id)]
+        assert ids == [3, 4]
+
+    def test_get_lag_is_cached(self, app):
+        app.config['SQLALCHEMY_READ_LAG_CHECK_INTERVAL'] = 60
+        replica = app.extensions['read_replica']
+        assert replica.get_lag(app) == 0
+
+        self._add_heartbeat(datetime.datetime.now() - relativedelta(minutes=1))
+        assert replica.get_lag(app) == 0
 
 
 class GetOrCreateTestMixin:
@@ -104,6 +203,40 @@ class TestResource(GetOrCreateTestMixin):
         assert len(data) == 1
         assert data[0].periods[0].seconds == 3600
 
+    def test_get_all_by_time_range_by_multiple_projects(self):
+        for project in ('project-1', 'project-2', 'project-3'):
+            event = fake.get_normalized_instance_event()
+            event['traits']['resource_id'] = 'uuid-%s' % project
+            event['traits']['project_id'] = project
+            models.Resource.get_or_create(event)
+
+        start = event['traits']['created_at'] - relativedelta(hours=+1)
+        ended = start + relativedelta(hours=+2)
+
+        data = models.Resource.get_all_by_time_range(
+            start, ended, project=['project-1', 'project-3'])
+        assert sorted(r.project for r in data) == ['project-1', 'project-3']
+
+        data = models.Resource.get_all_by_time_range(start, ended)
+        assert len(data) == 3
+
+    def test_get_all_by_time_range_with_limit(self):
+        for resource_id in ('fake-uuid-1', 'fake-uuid-2'):
+            event = fake.get_normalized_instance_event()
+            event['traits']['resource_id'] = resource_id
+            models.Resource.get_or_create(event)
+
+        start = event['traits']['created_at'] - relativedelta(hours=+1)
+        ended = start + relativedelta(hours=+2)
+
+        data = models.Resource.get_all_by_time_range(start, ended, limit=2)
+        assert len(data) == 2
+
+        with pytest.raises(exceptions.TooManyResources) as e:
+            models.Resource.get_all_by_time_range(start, ended, limit=1)
+
+        assert e.value.code == 400
+
     def test_get_all_by_time_range_with_resource_ended_before_start(self):
         event = fake.get_normalized_instance_event()
         event['traits']['deleted_at'] = event['traits']['created_at'] + \
@@ -214,6 +347,36 @@ class TestResource(GetOrCreateTestMixin):
         assert len(data[0].periods) == 1
         assert data[0].periods[0].seconds == 2700
 
+    def test_get_all_by_time_range_only_loads_overlapping_periods(self):
+        event = fake.get_normalized_instance_event()
+        models.Resource.get_or_create(event)
+
+        event['generated'] = event['traits']['created_at'] + \
+            relativedelta(months=+3)
+        event['traits']['instance_type'] = 'v2-standard-8'
+        models.Resource.get_or_create(event)
+
+        start = event['generated'] + relativedelta(hours=+1)
+        ended = start + relativedelta(hours=+1)
+        data = models.Resource.get_all_by_time_range(start, ended)
+
+        assert len(data) == 1
+        assert len(data[0].periods) == 1
+        assert data[0].periods[0].spec.instance_type == 'v2-standard-8'
+
+    def test_get_all_by_time_range_with_long_closed_period(self):
+        event = fake.get_normalized_instance_event()
+        event['traits']['deleted_at'] = event['traits']['created_at'] + \
+            relativedelta(months=+6)
+        models.Resource.get_or_create(event)
+
+        start = event['traits']['created_at'] + relativedelta(months=+3)
+        ended = start + relativedelta(days=+1)
+        data = models.Resource.get_all_by_time_range(start, ended)
+
+        assert len(data) == 1
+        assert data[0].periods[0].seconds == 86400
+
     def test_from_event(self):
         event = fake.get_normalized_instance_event()
         resource = models.Resource.from_event(event)
@@ -337,6 +500,185 @@ class TestResource(GetOrCreateTestMixin):
         assert new_resource.get_open_period() is not None
         assert len(new_resource.periods) == 1
 
+    def _send(self, instance_type, hours, splice=False, **traits):
+        event = fake.get_normalized_instance_event()
+        event['traits'].update(traits, instance_type=instance_type)
+        event['generated'] = event['traits']['created_at'] + \
+            relativedelta(hours=hours)
+        return models.Resource.get_or_create(event, splice=splice)
+
+    def _get_periods(self, resource):
+        created_at = fake.get_normalized_instance_event()['traits'][
+            'created_at']
+
+        def hours(t):
+            return t and int((t - created_at).total_seconds() // 3600)
+
+        return sorted((hours(p.started_at), hours(p.ended_at),
+                       p.spec.instance_type) for p in resource.periods)
+
+    def test_get_or_create_late_event_without_splice(self):
+        self._send('a', 0)
+        self._send('b', 2)
+
+        with pytest.raises(exceptions.EventTooOld):
+            self._send('c', 1)
+
+    def test_splice_into_closed_period(self):
+        self._send('a', 0)
+        self._send('b', 2)
+        resource = self._send('b', 3)
+
+        self._send('c', 1, splice=True)
+        assert self._get_periods(resource) == [
+            (0, 1, 'a'),
+            (1, 2, 'c'),
+            (2, None, 'b'),
+        ]
+        assert resource.updated_at == \
+            resource.periods[0].started_at + relativedelta(hours=3)
+
+    def test_splice_into_open_period(self):
+        self._send('a', 0)
+        resource = self._send('a', 3)
+
+        self._send('b', 1, splice=True)
+        assert self._get_periods(resource) == [
+            (0, 1, 'a'),
+            (1, 3, 'b'),
+            (3, None, 'a'),
+        ]
+
+    def test_splice_extends_following_period(self):
+        self._send('a', 0)
+        self._send('b', 2)
+        resource = self._send('c', 4)
+
+        self._send('b', 1, splice=True)
+        assert self._get_periods(resource) == [
+            (0, 1, 'a'),
+            (1, 4, 'b'),
+            (4, None, 'c'),
+        ]
+
+    def test_splice_at_period_start(self):
+        self._send('a', 0)
+        self._send('b', 2)
+        resource = self._send('c', 4)
+
+        self._send('d', 2, splice=True)
+        assert self._get_periods(resource) == [
+            (0, 2, 'a'),
+            (2, 4, 'd'),
+            (4, None, 'c'),
+        ]
+
+    def test_splice_with_same_spec(self):
+        self._send('a', 0)
+        resource = self._send('b', 2)
+
+        self._send('a', 1, splice=True)
+        assert self._get_periods(resource) == [
+            (0, 2, 'a'),
+            (2, None, 'b'),
+        ]
+
+    def test_splice_rejects_late_delete(self):
+        self._send('a', 0)
+        self._send('b', 2)
+
+        with pytest.raises(exceptions.EventTooOld):
+            self._send('a', 1, splice=True, state='deleted')
+
+    def test_close_project(self):
+        for resource_id, project in (('uuid-1', 'fake-project'),
+                                     ('uuid-2', 'fake-project'),
+                                     ('uuid-3', 'other-project')):
+            event = fake.get_normalized_instance_event()
+            event['traits']['resource_id'] = resource_id
+            event['traits']['project_id'] = project
+            models.Resource.get_or_create(event)
+
+        event['traits']['resource_id'] = 'uuid-2'
+        event['traits']['project_id'] = 'fake-project'
+        event['traits']['deleted_at'] = event['generated']
+        models.Resource.get_or_create(event)
+
+        ended_at = event['generated'] + relativedelta(months=+1)
+        assert models.Resource.close_project('fake-project', ended_at) == 1
+        db.session.expire_all()
+
+        resource = models.Resource.query.get('uuid-1')
+        assert resource.updated_at == ended_at
+        assert resource.get_open_period() is None
+        assert resource.periods[0].ended_at == ended_at
+        assert resource.periods[0].duration_ms == \
+            models.Period.get_duration_ms(resource.periods[0].started_at,
+                                          ended_at)
+        assert models.PeriodBucket.query.filter_by(
+            period_id=resource.periods[0].id).count() == 2
+
+        assert models.Resource.query.get('uuid-2').periods[0].ended_at == \
+            event['generated']
+        assert models.Resource.query.get('uuid-3').get_open_period()
+
+        event['traits']['resource_id'] = 'uuid-1'
+        with pytest.raises(exceptions.EventTooOld):
+            models.Resource.get_or_create(event)
+
+    @pytest.mark.parametrize('microseconds', [1, 499, 500, 736337])
+    def test_close_project_duration(self, microseconds):
+        event = fake.get_normalized_instance_event()
+        event['traits']['created_at'] = event['generated']
+        models.Resource.get_or_create(event)
+
+        ended_at = event['generated'].replace(microsecond=microseconds) + \
+            relativedelta(hours=+1)
+        assert models.Resource.close_project('fake-project', ended_at) == 1
+        db.session.expire_all()
+
+        period = models.Period.query.one()
+        assert period.duration_ms == \
+            models.Period.get_duration_ms(period.started_at, ended_at)
+
+    def test_get_active(self):
+        event = fake.get_normalized_instance_event()
+        event['traits']['resource_id'] = 'uuid-1'
+        models.Resource.get_or_create(event)
+        started_at = event['traits']['created_at']
+
+        event['generated'] = started_at + relativedelta(hours=+1)
+        event['traits']['instance_type'] = 'v1-standard-2'
+        models.Resource.get_or_create(event)
+
+        event['traits']['resource_id'] = 'uuid-2'
+        event['traits']['project_id'] = 'other-project'
+        models.Resource.get_or_create(event)
+
+        resources = models.Resource.get_active('fake-project')
+        assert [r.uuid for r in resources] == ['uuid-1']
+        assert len(resources[0].periods) == 1
+        assert resources[0].periods[0].spec.instance_type == 'v1-standard-2'
+
+        at = started_at + relativedelta(minutes=+30)
+        resources = models.Resource.get_active('fake-project', at=at)
+        assert [r.uuid for r in resources] == ['uuid-1']
+        assert resources[0].periods[0].started_at == started_at
+        assert resources[0].periods[0].spec.instance_type == 'v1-standard-1'
+
+        assert models.Resource.get_active(
+            'fake-project', at=started_at - relativedelta(minutes=1)) == []
+
+    def test_get_active_over_limit(self):
+        for resource_id in ('uuid-1', 'uuid-2'):
+            event = fake.get_normalized_instance_event()
+            event['traits']['resource_id'] = resource_id
+            models.Resource.get_or_create(event)
+
+        assert len(models.Resource.get_active(limit=2)) == 2
+        with pytest.raises(exceptions.TooManyResources):
+            models.Resource.get_active(limit=1)
+
     def test_serialize_with_no_periods(self):
         resource = fake.get_resource()
 
@@ -583,6 +925,212 @@ class TestPeriod:
         }
 
 
+@pytest.mark.usefixtures("db_session")
+class TestPeriodDuration:
+    def _add_period(self, started_at, ended_at=None):
+        resource = fake.get_resource()
+        resource.uuid = 'uuid-%s' % started_at.isoformat()
+        spec = models.InstanceSpec.query.first() or fake.get_instance_spec()
+        resource.periods.append(models.Period(
+            started_at=started_at, ended_at=ended_at, spec=spec))
+        db.session.add(resource)
+        db.session.commit()
+        return resource.periods[0]
+
+    def test_duration_set_on_close(self):
+        period = self._add_period(datetime.datetime(2020, 11, 15))
+        assert period.duration_ms is None
+
+        period.ended_at = datetime.datetime(2020, 11, 15, 1)
+        db.session.commit()
+        assert period.duration_ms == 3600000
+
+    def test_clipped_duration(self):
+        self._add_period(datetime.datetime(2020, 11, 1),
+                         datetime.datetime(2020, 11, 1, 2))
+        self._add_period(datetime.datetime(2020, 11, 1, 3),
+                         datetime.datetime(2020, 11, 1, 4))
+        self._add_period(datetime.datetime(2020, 11, 1, 5))
+
+        start = datetime.datetime(2020, 11, 1, 1)
+        end = datetime.datetime(2020, 11, 1, 6)
+        duration = models.Period.get_clipped_duration_ms(start, end)
+        query = db.session.query(db.func.sum(duration)).filter(
+            models.Period.started_at <= end,
+            db.or_(models.Period.ended_at >= start,
+                   models.Period.ended_at.is_(None)),
+        )
+
+        assert query.scalar() == (1 + 1 + 1) * 3600000
+
+
+@pytest.mark.usefixtures("db_session")
+class TestPeriodBucket:
+    def test_get_buckets(self):
+        buckets = models.PeriodBucket.get_buckets(
+            datetime.datetime(2020, 11, 15, 10),
+            datetime.datetime(2021, 1, 1))
+
+        assert list(buckets) == [
+            datetime.datetime(2020, 11, 1),
+            datetime.datetime(2020, 12, 1),
+            datetime.datetime(2021, 1, 1),
+        ]
+
+    def _get_buckets(self, period):
+        query = models.PeriodBucket.query.filter_by(period_id=period.id)
+        return sorted(b.bucket for b in query)
+
+    def _add_period(self, **kwargs):
+        resource = fake.get_resource()
+        resource.periods.append(models.Period(
+            started_at=datetime.datetime(2020, 11, 15),
+            spec=fake.get_instance_spec(), **kwargs))
+        db.session.add(resource)
+        db.session.commit()
+        return resource.periods[0]
+
+    def test_open_period_is_not_bucketed(self):
+        period = self._add_period()
+
+        assert self._get_buckets(period) == []
+
+    def test_closing_period_buckets_it(self):
+        period = self._add_period()
+
+        period.ended_at = datetime.datetime(2020, 12, 2)
+        db.session.commit()
+
+        assert self._get_buckets(period) == [
+            datetime.datetime(2020, 11, 1),
+            datetime.datetime(2020, 12, 1),
+        ]
+
+        period.started_at = datetime.datetime(2020, 12, 1)
+        db.session.commit()
+
+        assert self._get_buckets(period) == [datetime.datetime(2020, 12, 1)]
+
+    def test_deleting_period_removes_buckets(self):
+        period = self._add_period(ended_at=datetime.datetime(2020, 11, 16))
+
+        db.session.delete(period)
+        db.session.commit()
+
+        assert models.PeriodBucket.query.count() == 0
+
+
+@pytest.mark.usefixtures("db_session")
+class TestResourceChange:
+    def _get_changes(self):
+        query = models.ResourceChange.query.order_by(models.ResourceChange.id)
+        return [c.resource_uuid for c in query]
+
+    def test_period_changes_are_recorded(self):
+        event = fake.get_normalized_instance_event()
+        models.Resource.get_or_create(event)
+
+        event['generated'] = event['generated'] + relativedelta(hours=+1)
+        models.Resource.get_or_create(event)
+
+        event['generated'] = event['generated'] + relativedelta(hours=+1)
+        event['traits']['instance_type'] = 'v1-standard-2'
+        models.Resource.get_or_create(event)
+
+        uuid = event['traits']['resource_id']
+        assert self._get_changes() == [uuid, uuid, uuid]
+
+    def test_project_is_recorded(self):
+        event = fake.get_normalized_instance_event()
+        models.Resource.get_or_create(event)
+
+        change = models.ResourceChange.query.one()
+        assert change.project == event['traits']['project_id']
+
+    def test_close_project_is_recorded(self):
+        event = fake.get_normalized_instance_event()
+        models.Resource.get_or_create(event)
+        models.Resource.close_project(
+            event['traits']['project_id'],
+            event['generated'] + relativedelta(hours=+1))
+
+        uuid = event['traits']['resource_id']
+        assert self._get_changes() == [uuid, uuid]
+
+    def test_get_page(self):
+        now = datetime.datetime.now()
+        models.ResourceChange.record(db.session, [
+            ('a', 'fake-project'), ('b', 'fake-project'),
+            ('a', 'fake-project'), ('c', 'fake-project')])
+        for resource_id in ('a', 'b'):
+            event = fake.get_normalized_instance_event()
+            event['traits']['resource_id'] = resource_id
+            models.Resource.get_or_create(event)
+
+        resources, uuids, cursor, more = models.ResourceChange.get_page(
+            0, 2, now + relativedelta(minutes=+1))
+        assert uuids == ['a', 'b']
+        assert sorted(resources) == ['a', 'b']
+        assert more
+
+        resources, uuids, cursor, more = models.ResourceChange.get_page(
+            cursor, 10, now + relativedelta(minutes=+1))
+        assert uuids == ['c', 'a', 'b']
+        assert sorted(resources) == ['a', 'b']
+        assert not more
+
+        assert models.ResourceChange.get_page(
+            cursor, 10, now + relativedelta(minutes=+1))[1:] == \
+            ([], cursor, False)
+
+    def test_get_page_by_project(self):
+        now = datetime.datetime.now()
+        for resource_id, project in (('a', 'project-1'), ('b', 'project-2'),
+                                     ('c', 'project-1')):
+            event = fake.get_normalized_instance_event()
+            event['traits']['resource_id'] = resource_id
+            event['traits']['project_id'] = project
+            models.Resource.get_or_create(event)
+
+        # NOTE: Changes of deleted resources are still found by project.
+        models.Period.query.filter_by(resource_uuid='c').delete()
+        models.Resource.query.filter_by(uuid='c').delete()
+
+        resources, uuids, _, _ = models.ResourceChange.get_page(
+            0, 10, now + relativedelta(minutes=+1), project=['project-1'])
+        assert uuids == ['a', 'c']
+        assert sorted(resources) == ['a']
+
+    def test_get_page_stops_at_unsettled_changes(self):
+        models.ResourceChange.record(db.session, [('a', 'fake-project')])
+        settled_before = datetime.datetime.now()
+        models.ResourceChange.record(db.session, [('b', 'fake-project')])
+
+        models.ResourceChange.query.filter_by(resource_uuid='a').update(
+            {'changed_at': settled_before - relativedelta(minutes=1)})
+        _, uuids, cursor, more = models.ResourceChange.get_page(
+            0, 10, settled_before)
+
+        assert uuids == ['a']
+        assert cursor == models.ResourceChange.query.filter_by(
+            resource_uuid='a').one().id
+        assert not more
+
+    def test_prune(self):
+        models.ResourceChange.record(
+            db.session, [('old', 'fake-project'), ('new', 'fake-project')])
+        models.ResourceChange.query.filter_by(resource_uuid='old').update(
+            {'changed_at': datetime.datetime(2019, 1, 1)})
+        db.session.commit()
+
+        total = models.ResourceChange.prune(datetime.datetime(2020, 1, 1),
+                                            batch_size=1)
+
+        assert total == 1
+        assert [c.resource_uuid for c in models.ResourceChange.query] == \
+            ['new']
+
+
 @pytest.mark.usefixtures("db_session")
 class TestSpec(GetOrCreateTestMixin):
     MODEL = models.Spec
@@ -602,10 +1150,49 @@ class TestSpec(GetOrCreateTestMixin):
         query = models.Spec.query_from_event(event)
 
         mock_filter_by.assert_called_with(
-            instance_type='v1-standard-1',
-            state='ACTIVE'
+            digest=models.Spec.get_digest('OS::Nova::Server', {
+                'instance_type': 'v1-standard-1',
+                'state': 'ACTIVE',
+            })
         )
 
+    def test_get_digest_is_stable(self):
+        digest = models.Spec.get_digest('OS::Cinder::Volume', {
+            'volume_type': 'ssd',
+            'volume_size': 10,
+            'state': 'available',
+        })
+
+        assert digest == models.Spec.get_digest('OS::Cinder::Volume', {
+            'state': 'available',
+            'volume_size': '10',
+            'volume_type': 'ssd',
+        })
+        assert digest != models.Spec.get_digest('OS::Nova::Server', {
+            'volume_type': 'ssd',
+            'volume_size': 10,
+            'state': 'available',
+        })
+
+    def test_digest_set_on_insert(self):
+        spec = fake.get_instance_spec()
+        db.session.add(spec)
+        db.session.commit()
+
+        assert spec.digest == models.Spec.get_digest('OS::Nova::Server', {
+            'instance_type': spec.instance_type,
+            'state': spec.state,
+        })
+
+    def test_get_or_create_matches_existing_spec(self):
+        spec = fake.get_instance_spec(instance_type='v1-standard-1',
+                                      state='ACTIVE')
+        db.session.add(spec)
+        db.session.commit()
+
+        event = fake.get_normalized_instance_event()
+        assert models.Spec.get_or_create(event) is spec
+
 
 @pytest.mark.usefixtures("db_session")
 class TestInstanceSpec:
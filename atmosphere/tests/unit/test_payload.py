@@ -0,0 +1,124 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import io
+import json
+import sys
+
+import msgpack
+import pytest
+from werkzeug import exceptions
+
+from atmosphere import payload
+from atmosphere.tests.unit import fake
+
+
+class TestPayload:
+    def _read(self, body, encoding, max_size=1024 * 1024):
+        return list(payload.iter_events(io.BytesIO(body), encoding,
+                                        'application/json', max_size))
+
+    def test_iter_events_with_gzip(self):
+        events = [fake.get_instance_event()]
+        data = json.dumps(events).encode()
+
+        assert self._read(gzip.compress(data), 'gzip', len(data)) == events
+        assert self._read(gzip.compress(data), ' GZIP ') == events
+
+    def test_iter_events_with_zstd(self):
+        zstandard = pytest.importorskip('zstandard')
+        events = [fake.get_instance_event()]
+        compressed = zstandard.ZstdCompressor().compress(
+            json.dumps(events).encode())
+
+        assert self._read(compressed, 'zstd') == events
+
+    def test_iter_events_over_decompressed_limit(self):
+        compressed = gzip.compress(b' ' * 1024 * 1024 + b'[]')
+
+        with pytest.raises(exceptions.RequestEntityTooLarge):
+            self._read(compressed, 'gzip', 1024)
+
+    def test_iter_events_with_invalid_gzip(self):
+        with pytest.raises(exceptions.BadRequest):
+            self._read(b'not gzip', 'gzip')
+
+    def test_iter_events_with_unsupported_encoding(self):
+        with pytest.raises(exceptions.UnsupportedMediaType):
+            self._read(b'[]', 'br')
+
+    def _iter_events(self, body, mimetype='application/json'):
+        return list(payload.iter_events(io.BytesIO(body), '', mimetype,
+                                        1024 * 1024))
+
+    def test_iter_events(self):
+        events = [fake.get_instance_event(resource_id='uuid-%d' % i)
+                  for i in range(3)]
+
+        assert self._iter_events(json.dumps(events).encode()) == events
+        assert self._iter_events(msgpack.packb(events),
+                                 'application/msgpack') == events
+        assert self._iter_events(b' [ ] ') == []
+
+    def test_iter_events_with_json_suffix(self):
+        events = [fake.get_instance_event()]
+
+        assert self._iter_events(json.dumps(events).encode(),
+                                 'application/vnd.atmosphere+json') == events
+
+    def test_iter_events_across_chunks(self, monkeypatch):
+        monkeypatch.setattr(payload, 'CHUNK_SIZE', 7)
+        events = [{'event_type': 'a', 'traits': [['b', 1, 'c ] , {']]},
+                  {'event_type': '\u00e9', 'value': 12345}]
+
+        assert self._iter_events(json.dumps(events).encode()) == events
+        assert self._iter_events(msgpack.packb(events),
+                                 'application/msgpack') == events
+
+    def test_iter_events_is_incremental(self):
+        events = [fake.get_instance_event(resource_id='uuid-%d' % i)
+                  for i in range(1000)]
+        stream = io.BytesIO(json.dumps(events).encode())
+
+        event = next(payload.iter_events(stream, '', 'application/json',
+                                         sys.maxsize))
+
+        assert event == events[0]
+        assert stream.tell() <= payload.CHUNK_SIZE
+
+    @pytest.mark.parametrize('body', [
+        b'', b'{}', b'[1]', b'[{"a": 1},]', b'[{"a": 1}', b'[{"a": 1}] [',
+    ])
+    def test_iter_events_invalid_json(self, body):
+        with pytest.raises(exceptions.BadRequest):
+            self._iter_events(body)
+
+    @pytest.mark.parametrize('body', [
+        b'', msgpack.packb({}), msgpack.packb([{}])[:-1],
+        msgpack.packb([{}]) + b'\x01',
+    ])
+    def test_iter_events_invalid_msgpack(self, body):
+        with pytest.raises(exceptions.BadRequest):
+            self._iter_events(body, 'application/msgpack')
+
+    def test_iter_events_over_limit(self):
+        with pytest.raises(exceptions.RequestEntityTooLarge):
+            list(payload.iter_events(io.BytesIO(b'[{}, {}, {}]'), '',
+                                     'application/json', 8))
+
+    @pytest.mark.parametrize('mimetype', ['text/plain', 'text/foo+json'])
+    def test_iter_events_with_unsupported_type(self, mimetype):
+        with pytest.raises(exceptions.BadRequest):
+            self._iter_events(b'[]', mimetype)
@@ -0,0 +1,120 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cProfile
+import pstats
+
+import pytest
+
+from atmosphere.api import ingress
+from atmosphere import profiler
+from atmosphere.tests.unit import fake
+
+
+@pytest.fixture
+def profile_dir(tmp_path):
+    return tmp_path / 'profiles'
+
+
+@pytest.fixture
+def app(profile_dir):
+    class FakeConfig:
+        PROFILE_DIR = str(profile_dir)
+        PROFILE_SECRET = 'secret'
+        PROFILE_MAX_FILES = 2
+
+    app = ingress.init_application(FakeConfig)
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.mark.usefixtures("client", "db_session")
+class TestProfiler:
+    def _post(self, client, secret='secret'):
+        headers = {}
+        if secret is not None:
+            headers[profiler.HEADER] = secret
+        return client.post('/v1/event', json=[fake.get_instance_event()],
+                           headers=headers)
+
+    def test_no_profile_without_header(self, client, profile_dir):
+        self._post(client, secret=None)
+        assert not profile_dir.exists()
+
+    def test_no_profile_with_wrong_secret(self, client, profile_dir):
+        self._post(client, secret='foobar')
+        assert not profile_dir.exists()
+
+    def test_profile_with_header(self, client, profile_dir):
+        response = self._post(client)
+        assert response.status_code == 204
+
+        profiles = list(profile_dir.iterdir())
+        assert len(profiles) == 1
+        assert 'ingress.event-compute.instance.exists' in profiles[0].name
+
+        stats = pstats.Stats(str(profiles[0]))
+        assert stats.total_calls > 0
+
+    def test_profile_sampling(self, app, client, profile_dir):
+        app.config['PROFILE_SAMPLE_RATE'] = 1
+        self._post(client, secret=None)
+
+        assert len(list(profile_dir.iterdir())) == 1
+
+    def test_profile_rotation(self, client, profile_dir):
+        for _ in range(3):
+            self._post(client)
+
+        assert len(list(profile_dir.iterdir())) == 2
+
+    def test_collapse_command(self, app, client, tmp_path):
+        self._post(client)
+
+        output = tmp_path / 'stacks.folded'
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['profile', 'collapse', '-o',
+                                     str(output)])
+
+        assert result.exit_code == 0
+        lines = output.read_text().splitlines()
+        assert len(lines) > 0
+        assert any('ingress.py' in line and 'models.py' in line
+                   for line in lines)
+
+    def test_collapse_command_without_profiles(self, app):
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['profile', 'collapse'])
+
+        assert result.exit_code != 0
+
+
+def _leaf():
+    return sum(range(10000))
+
+
+def _branch():
+    return _leaf() + _leaf()
+
+
+class TestCollapse:
+    def test_collapse(self):
+        profile = cProfile.Profile()
+        profile.runcall(_branch)
+        stacks = profiler.collapse(pstats.Stats(profile))
+
+        leaf_stacks = [stack for stack in stacks if stack.endswith('_leaf')]
+        assert len(leaf_stacks) == 1
+        assert 'test_profiler.py' in leaf_stacks[0]
+        assert ':_branch;' in leaf_stacks[0]
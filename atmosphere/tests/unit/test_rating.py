@@ -0,0 +1,246 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import datetime
+from decimal import Decimal
+import json
+
+import click
+import pytest
+
+from atmosphere import models
+from atmosphere.models import db
+from atmosphere import rating
+from atmosphere.tests.unit import fake
+
+
+def _add_resource(uuid, project, spec, *ranges):
+    resource = fake.get_resource()
+    resource.uuid = uuid
+    resource.project = project
+    for started_at, ended_at in ranges:
+        resource.periods.append(models.Period(
+            started_at=started_at, ended_at=ended_at, spec=spec))
+    db.session.add(resource)
+    db.session.commit()
+
+
+def _price(name, hourly_rate, effective_at, state=None,
+           spec_type='OS::Nova::Server'):
+    return {'type': spec_type, 'name': name, 'state': state,
+            'hourly_rate': hourly_rate, 'effective_at': effective_at}
+
+
+class TestPriceTable:
+    def test_get_rate(self):
+        prices = [(datetime(2020, 1, 1), Decimal('1')),
+                  (datetime(2020, 2, 1), Decimal('2'))]
+
+        assert rating.PriceTable.get_rate(prices, datetime(2019, 12, 31)) \
+            is None
+        assert rating.PriceTable.get_rate(prices, datetime(2020, 1, 1)) == \
+            Decimal('1')
+        assert rating.PriceTable.get_rate(prices, datetime(2020, 3, 1)) == \
+            Decimal('2')
+
+    def test_get_windows(self):
+        prices = [models.Price(effective_at=datetime(2019, 1, 1)),
+                  models.Price(effective_at=datetime(2020, 1, 15)),
+                  models.Price(effective_at=datetime(2020, 1, 15)),
+                  models.Price(effective_at=datetime(2020, 2, 1))]
+
+        assert rating.get_windows(prices, datetime(2020, 1, 1),
+                                  datetime(2020, 2, 1)) == [
+            (datetime(2020, 1, 1), datetime(2020, 1, 15)),
+            (datetime(2020, 1, 15), datetime(2020, 2, 1)),
+        ]
+
+    def test_get_prices_prefers_state(self):
+        table = rating.PriceTable([
+            models.Price(type='OS::Nova::Server', name='v1-standard-1',
+                         state=None, hourly_rate=Decimal('1'),
+                         effective_at=datetime(2020, 1, 1)),
+            models.Price(type='OS::Nova::Server', name='v1-standard-1',
+                         state='SHUTOFF', hourly_rate=Decimal('0.1'),
+                         effective_at=datetime(2020, 1, 1)),
+        ])
+
+        stopped = models.InstanceSpec(instance_type='v1-standard-1',
+                                      state='SHUTOFF')
+        active = models.InstanceSpec(instance_type='v1-standard-1',
+                                     state='ACTIVE')
+
+        assert table.get_prices(stopped) == \
+            [(datetime(2020, 1, 1), Decimal('0.1'))]
+        assert table.get_prices(active) == \
+            [(datetime(2020, 1, 1), Decimal('1'))]
+
+    def test_get_prices_per_effective_date(self):
+        table = rating.PriceTable([
+            models.Price(type='OS::Nova::Server', name='v1-standard-1',
+                         state=None, hourly_rate=Decimal('1'),
+                         effective_at=datetime(2020, 1, 1)),
+            models.Price(type='OS::Nova::Server', name='v1-standard-1',
+                         state='SHUTOFF', hourly_rate=Decimal('0.1'),
+                         effective_at=datetime(2021, 1, 1)),
+            models.Price(type='OS::Nova::Server', name='v1-standard-1',
+                         state=None, hourly_rate=Decimal('2'),
+                         effective_at=datetime(2022, 1, 1)),
+        ])
+
+        stopped = models.InstanceSpec(instance_type='v1-standard-1',
+                                      state='SHUTOFF')
+        prices = table.get_prices(stopped)
+
+        assert prices == [
+            (datetime(2020, 1, 1), Decimal('1')),
+            (datetime(2021, 1, 1), Decimal('0.1')),
+            (datetime(2022, 1, 1), Decimal('0.1')),
+        ]
+        assert table.get_rate(prices, datetime(2020, 6, 1)) == Decimal('1')
+
+
+@pytest.mark.usefixtures("db_session")
+class TestRating:
+    def test_compute_charges(self):
+        rating.load_prices([
+            _price('v2-standard-1', '1', datetime(2020, 1, 1)),
+            _price('v2-standard-1', '2', datetime(2020, 1, 1, 12)),
+            _price('7d233c12-d346-4948-8901-7afd5c5dd590', '0.01',
+                   datetime(2020, 1, 1),
+                   spec_type='OS::Cinder::Volume'),
+        ])
+        _add_resource('instance', 'project-1', fake.get_instance_spec(),
+                      (datetime(2020, 1, 1, 10), datetime(2020, 1, 1, 14)))
+        _add_resource('volume', 'project-2', fake.get_volume_spec(),
+                      (datetime(2020, 1, 1, 10), None))
+
+        charges = rating.compute_charges(
+            datetime(2020, 1, 1), datetime(2020, 1, 2),
+            now=datetime(2020, 1, 1, 20))
+
+        assert charges['project-1']['total'] == Decimal('6.00')
+        assert charges['project-1']['lines'] == [{
+            'type': 'OS::Nova::Server',
+            'spec': {'instance_type': 'v2-standard-1', 'state': 'ACTIVE'},
+            'seconds': 4 * 3600,
+            'unpriced_seconds': 0,
+            'charge': Decimal('6.00'),
+        }]
+        # NOTE: 10 hours of a 3GB volume at 0.01 per GB and hour
+        assert charges['project-2']['total'] == Decimal('0.30')
+
+    def test_compute_charges_without_price(self):
+        _add_resource('instance', 'project-1', fake.get_instance_spec(),
+                      (datetime(2020, 1, 1, 10), datetime(2020, 1, 1, 14)))
+
+        charges = rating.compute_charges(
+            datetime(2020, 1, 1), datetime(2020, 1, 2), 'project-1')
+
+        assert charges['project-1']['total'] == Decimal('0.00')
+        assert charges['project-1']['lines'][0]['unpriced_seconds'] == \
+            4 * 3600
+
+    def test_compute_charges_across_price_change(self):
+        rating.load_prices([
+            _price('v2-standard-1', '1', datetime(2020, 1, 1)),
+            _price('v2-standard-1', '2', datetime(2020, 1, 15)),
+        ])
+        _add_resource('instance', 'project-1', fake.get_instance_spec(),
+                      (datetime(2019, 12, 31, 23), datetime(2020, 1, 1, 1)),
+                      (datetime(2020, 1, 14, 23), datetime(2020, 1, 15, 1)))
+        db.session.add(models.ArchivedPeriod(
+            id=100, resource_uuid='instance',
+            started_at=datetime(2020, 1, 10),
+            ended_at=datetime(2020, 1, 10, 1),
+            duration_ms=3600000,
+            spec_id=models.Period.query.first().spec_id))
+        db.session.commit()
+
+        charges = rating.compute_charges(
+            datetime(2020, 1, 1), datetime(2020, 2, 1),
+            now=datetime(2020, 3, 1))
+
+        # NOTE: 3 hours at 1 and 1 hour at 2
+        assert charges['project-1']['lines'][0]['seconds'] == 4 * 3600
+        assert charges['project-1']['total'] == Decimal('5.00')
+
+    def test_compute_charges_total_of_rounded_lines(self):
+        rating.load_prices([
+            _price('v2-standard-1', '0.006', datetime(2020, 1, 1)),
+            _price('v2-standard-2', '0.006', datetime(2020, 1, 1)),
+        ])
+        for name in ('v2-standard-1', 'v2-standard-2'):
+            spec = fake.get_instance_spec()
+            spec.instance_type = name
+            _add_resource(name, 'project-1', spec,
+                          (datetime(2020, 1, 1), datetime(2020, 1, 1, 1)))
+
+        charges = rating.compute_charges(
+            datetime(2020, 1, 1), datetime(2020, 1, 2),
+            now=datetime(2020, 1, 3))
+
+        lines = charges['project-1']['lines']
+        assert [line['charge'] for line in lines] == \
+            [Decimal('0.01'), Decimal('0.01')]
+        assert charges['project-1']['total'] == Decimal('0.02')
+
+    def test_load_prices(self):
+        assert rating.load_prices([
+            _price('v2-standard-1', '1', '2020-01-01T00:00:00'),
+            _price('v2-standard-1', '1', '2020-01-01T00:00:00', 'SHUTOFF'),
+        ]) == 2
+        assert rating.load_prices([
+            _price('v2-standard-1', '1', '2020-01-01T00:00:00'),
+            _price('v2-standard-1', '0.5', '2020-02-01T00:00:00', 'SHUTOFF'),
+        ]) == 1
+
+        assert sorted((p.state or '', p.hourly_rate)
+                      for p in models.Price.query) == \
+            [('', Decimal('1')), ('SHUTOFF', Decimal('0.5')),
+             ('SHUTOFF', Decimal('1'))]
+
+    def test_load_prices_rejects_changed_rate(self):
+        rating.load_prices([
+            _price('v2-standard-1', '1', '2020-01-01T00:00:00'),
+        ])
+
+        with pytest.raises(click.ClickException, match='new effective date'):
+            rating.load_prices([
+                _price('v2-standard-2', '1', '2020-01-01T00:00:00'),
+                _price('v2-standard-1', '2', '2020-01-01T00:00:00'),
+            ])
+
+        assert [(p.name, p.hourly_rate) for p in models.Price.query] == \
+            [('v2-standard-1', Decimal('1'))]
+
+    def test_commands(self, app, tmp_path):
+        path = tmp_path / 'prices.csv'
+        path.write_text('type,name,state,hourly_rate,effective_at\n'
+                        'OS::Nova::Server,v2-standard-1,,1,2020-01-01\n')
+        _add_resource('instance', 'project-1', fake.get_instance_spec(),
+                      (datetime(2020, 1, 1, 10), datetime(2020, 1, 1, 14)))
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['rating', 'load', str(path)])
+
+        assert result.exit_code == 0
+        assert 'Loaded 1 prices' in result.output
+
+        result = runner.invoke(args=['rating', 'invoices',
+                                     '--start', '2020-01-01',
+                                     '--end', '2020-01-02'])
+
+        assert result.exit_code == 0
+        assert json.loads(result.output)['project-1']['total'] == '4.00'
@@ -0,0 +1,72 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+import pytest
+from sqlalchemy import exc
+
+from atmosphere.api import ingress
+from atmosphere.models import db
+from atmosphere import statements
+from atmosphere.tests.unit import fake
+
+
+@pytest.mark.usefixtures("client", "db_session")
+class TestStatements:
+    def test_no_headers_without_debug(self, client):
+        response = client.post('/v1/event', json=[fake.get_instance_event()])
+
+        assert response.status_code == 204
+        assert statements.STATEMENTS_HEADER not in response.headers
+        assert statements.TIME_HEADER not in response.headers
+
+    def test_headers_with_debug(self, app, client):
+        app.debug = True
+        response = client.post('/v1/event', json=[fake.get_instance_event()])
+
+        assert response.status_code == 204
+        assert int(response.headers[statements.STATEMENTS_HEADER]) > 0
+        assert float(response.headers[statements.TIME_HEADER]) > 0
+
+    def test_slow_query_log(self, app, client, caplog):
+        app.config['SQLALCHEMY_SLOW_QUERY_THRESHOLD'] = 0
+        with caplog.at_level(logging.WARNING, logger=statements.__name__):
+            client.post('/v1/event', json=[fake.get_instance_event()])
+
+        assert 'Slow query' in caplog.text
+        assert 'models.py' in caplog.text
+        assert 'fake-uuid' in caplog.text
+
+    def test_no_slow_query_log_under_threshold(self, app, client, caplog):
+        app.config['SQLALCHEMY_SLOW_QUERY_THRESHOLD'] = 60
+        with caplog.at_level(logging.WARNING, logger=statements.__name__):
+            client.post('/v1/event', json=[fake.get_instance_event()])
+
+        assert 'Slow query' not in caplog.text
+
+    def test_failed_query_start_time_removed(self):
+        with db.engine.connect() as connection:
+            with pytest.raises(exc.OperationalError):
+                connection.execute('SELECT * FROM foobar')
+
+            assert connection.info['query_start_time'] == []
+
+
+class TestInitApp:
+    def test_threshold_from_env(self, monkeypatch):
+        monkeypatch.setenv('DATABASE_SLOW_QUERY_THRESHOLD', '0.5')
+
+        test_app = ingress.init_application()
+        assert test_app.config['SQLALCHEMY_SLOW_QUERY_THRESHOLD'] == 0.5
@@ -0,0 +1,75 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import datetime
+
+from atmosphere import timeseries
+
+
+class TestTimeseries:
+    def test_get_bucket_starts(self):
+        starts = timeseries.get_bucket_starts(datetime(2020, 11, 15, 10),
+                                              datetime(2021, 1, 1), 'month')
+
+        assert starts == [datetime(2020, 11, 1), datetime(2020, 12, 1)]
+
+    def test_get_bucket_starts_by_hour(self):
+        starts = timeseries.get_bucket_starts(datetime(2020, 1, 1, 10, 30),
+                                              datetime(2020, 1, 1, 12, 1),
+                                              'hour')
+
+        assert starts == [datetime(2020, 1, 1, 10), datetime(2020, 1, 1, 11),
+                          datetime(2020, 1, 1, 12)]
+
+    def test_sum_by_bucket(self):
+        intervals = [
+            (datetime(2020, 1, 1, 10, 30), datetime(2020, 1, 1, 12, 15), 1),
+            (datetime(2020, 1, 1, 9), datetime(2020, 1, 1, 10, 30), 1),
+            (datetime(2020, 1, 1, 11), None, 1),
+            (datetime(2020, 1, 1, 11, 30), datetime(2020, 1, 1, 11, 45), 2),
+            (datetime(2020, 1, 1, 8), datetime(2020, 1, 1, 9), 3),
+        ]
+
+        starts, series = timeseries.sum_by_bucket(
+            intervals, datetime(2020, 1, 1, 10), datetime(2020, 1, 1, 13),
+            'hour')
+
+        assert starts == [datetime(2020, 1, 1, 10), datetime(2020, 1, 1, 11),
+                          datetime(2020, 1, 1, 12)]
+        assert series == {
+            1: [3600.0, 7200.0, 4500.0],
+            2: [0.0, 900.0, 0.0],
+        }
+
+    def test_sum_by_bucket_matches_naive_split(self):
+        start = datetime(2020, 1, 1)
+        end = datetime(2020, 3, 1)
+        intervals = [
+            (datetime(2019, 12, 20), datetime(2020, 1, 3, 5), 'a'),
+            (datetime(2020, 1, 2, 3), datetime(2020, 2, 10), 'a'),
+            (datetime(2020, 2, 1), None, 'b'),
+        ]
+
+        starts, series = timeseries.sum_by_bucket(intervals, start, end,
+                                                  'day')
+
+        for key in ('a', 'b'):
+            for i, bucket in enumerate(starts):
+                bucket_end = min(bucket + timeseries.GRANULARITIES['day'],
+                                 end)
+                expected = sum(
+                    max((min(e or end, bucket_end) -
+                         max(s, bucket)).total_seconds(), 0)
+                    for s, e, k in intervals if k == key)
+                assert series[key][i] == expected
@@ -42,6 +42,16 @@ class TestNormalizeEvent:
         assert utils.normalize_event(event) == event_expected
 
 
+class TestParseDatetime:
+    def test_iso_format(self):
+        assert utils.parse_datetime('2020-06-07T01:42:54.736337') == \
+            datetime.datetime(2020, 6, 7, 1, 42, 54, 736337)
+
+    def test_other_format(self):
+        assert utils.parse_datetime('Jun 7 2020 01:42:54') == \
+            datetime.datetime(2020, 6, 7, 1, 42, 54)
+
+
 class TestModelTypeDetection:
     def test_compute_instance(self):
         assert models.get_model_type_from_event('compute.instance.exists') == \
@@ -0,0 +1,149 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from atmosphere import models
+from atmosphere.models import db
+from atmosphere.tests.benchmarks import encoding
+from atmosphere.tests.benchmarks import ingest
+from atmosphere.tests.benchmarks import usage
+from atmosphere.tests.benchmarks import workload
+
+
+class TestWorkload:
+    def test_is_deterministic(self):
+        events_1 = workload.Workload(instances=5, volumes=5, seed=1).events()
+        events_2 = workload.Workload(instances=5, volumes=5, seed=1).events()
+
+        assert events_1 == events_2
+
+    def test_lifecycles(self):
+        events = workload.Workload(instances=3, volumes=2, days=1,
+                                   out_of_order=0, seed=1).events()
+        resources = {}
+        for event in events:
+            traits = {name: value for name, _, value in event['traits']}
+            resources.setdefault(traits['resource_id'], []).append(event)
+
+        assert len(resources) == 5
+        for resource_events in resources.values():
+            assert resource_events[0]['event_type'].endswith('create.start')
+            assert resource_events[1]['event_type'].endswith('create.end')
+
+    def test_out_of_order(self):
+        events = workload.Workload(instances=5, volumes=5, days=1,
+                                   out_of_order=0.5, seed=1).events()
+        generated = [e['generated'] for e in events]
+
+        assert generated != sorted(generated)
+
+    def test_write_and_read_events(self, tmp_path):
+        events = workload.Workload(instances=1, volumes=1, days=1,
+                                   seed=1).events()
+        path = tmp_path / 'events.jsonl'
+        with open(path, 'w') as output:
+            workload.write_events(events, output)
+
+        assert workload.read_events(path) == events
+
+
+class TestEncodingBenchmark:
+    def test_run(self):
+        events = workload.Workload(instances=2, volumes=2, days=1,
+                                   seed=1).events()
+        results = encoding.run(events, batch_size=10, repeat=1)
+
+        assert len(results) == \
+            len(encoding.CONTENT_TYPES) * len(encoding.get_encoders())
+        assert all(r['seconds_per_1000_events'] > 0 for r in results)
+        sizes = {(r['content_type'], r['content_encoding']): r['bytes']
+                 for r in results}
+        assert sizes['application/json', 'gzip'] < \
+            sizes['application/json', 'identity']
+
+
+class TestIngestBenchmark:
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        assert ingest.percentile(values, 50) == 50
+        assert ingest.percentile(values, 99) == 99
+        assert ingest.percentile([], 99) == 0
+
+    def test_run(self):
+        events = workload.Workload(instances=2, volumes=2, days=1,
+                                   out_of_order=0, seed=1).events()
+        app = ingest.create_app('sqlite://')
+        results = ingest.run(app, events)
+
+        assert results['events'] == len(events)
+        assert results['statements'] > 0
+        assert sum(results['status_codes'].values()) == len(events)
+        assert results['errors'] == 0
+        with app.app_context():
+            assert models.Resource.query.count() == 4
+
+    def test_run_counts_errors(self):
+        events = workload.Workload(instances=1, volumes=0, days=1,
+                                   out_of_order=0, seed=1).events()
+        events[0]['event_type'] = 'foo.bar.exists'
+        app = ingest.create_app('sqlite://')
+
+        assert ingest.run(app, events)['errors'] == 1
+
+    def test_main_fails_on_errors(self, tmp_path, capsys):
+        path = tmp_path / 'events.jsonl'
+        events = workload.Workload(instances=1, volumes=0, days=1,
+                                   out_of_order=0, seed=1).events()
+        events[0]['event_type'] = 'foo.bar.exists'
+        with open(path, 'w') as output:
+            workload.write_events(events, output)
+
+        with pytest.raises(SystemExit) as exc_info:
+            ingest.main([str(path)])
+        assert '1 of %d requests failed' % len(events) in \
+            str(exc_info.value.code)
+        assert '"errors": 1' in capsys.readouterr().out
+
+    def test_main_refuses_concurrency_on_sqlite(self, capsys):
+        with pytest.raises(SystemExit):
+            ingest.main(['--concurrency', '4'])
+        assert 'SQLite has no row locks' in capsys.readouterr().err
+
+
+class TestUsageBenchmark:
+    def test_load(self):
+        app = usage.create_benchmark_app('sqlite://')
+        with app.app_context():
+            db.create_all()
+            sizes = usage.load(periods=200, projects=5,
+                               periods_per_resource=4)
+
+            assert len(sizes) == 5
+            assert usage.get_sizes() == sizes
+            assert 0 < models.Period.query.count() <= 4 * sum(sizes.values())
+
+    def test_run(self):
+        app = usage.create_benchmark_app('sqlite://')
+        with app.app_context():
+            db.create_all()
+            sizes = usage.load(periods=200, projects=5,
+                               periods_per_resource=4)
+
+        results = usage.run(app, sizes, repeat=1)
+
+        assert len(results) == len(usage.WIDTHS) * 3 * 2
+        assert all(r['seconds_min'] > 0 for r in results)
+        assert all(r['peak_memory_bytes'] > 0 for r in results)
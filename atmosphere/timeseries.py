@@ -0,0 +1,93 @@
+# Copyright 2020 VEXXHOST, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time series
+
+Splits periods into fixed calendar buckets (hours, days or months) and sums
+the seconds spent in every bucket by key (usually a spec).  Rather than
+walking through every bucket of every period, the start and end of the
+periods are sorted by key and swept once across the bucket boundaries, so
+the cost grows with the number of periods plus the number of buckets
+instead of their product.
+"""
+
+import collections
+
+from dateutil.relativedelta import relativedelta
+
+GRANULARITIES = {
+    'hour': relativedelta(hours=1),
+    'day': relativedelta(days=1),
+    'month': relativedelta(months=1),
+}
+
+
+def truncate(time, granularity):
+    """Truncate a time to the start of its bucket."""
+    time = time.replace(minute=0, second=0, microsecond=0)
+    if granularity in ('day', 'month'):
+        time = time.replace(hour=0)
+    if granularity == 'month':
+        time = time.replace(day=1)
+    return time
+
+
+def get_bucket_starts(start, end, granularity):
+    """Get the start of every bucket overlapping a time range."""
+    step = GRANULARITIES[granularity]
+    bucket = truncate(start, granularity)
+    starts = []
+    while bucket < end:
+        starts.append(bucket)
+        bucket += step
+    return starts
+
+
+def sum_by_bucket(intervals, start, end, granularity):
+    """Sum the seconds of intervals in every bucket of a time range.
+
+    The intervals are `(started_at, ended_at, key)` tuples, clipped to the
+    range, where an `ended_at` of `None` means the end of the range.  This
+    returns the bucket starts and a dictionary of every key to the list of
+    seconds in each bucket.
+    """
+    starts = get_bucket_starts(start, end, granularity)
+
+    changes = collections.defaultdict(list)
+    for started_at, ended_at, key in intervals:
+        started_at = max(started_at, start)
+        ended_at = end if ended_at is None else min(ended_at, end)
+        if started_at < ended_at:
+            changes[key].append((started_at, 1))
+            changes[key].append((ended_at, -1))
+
+    series = {}
+    for key, points in changes.items():
+        points.sort()
+        seconds = [0.0] * len(starts)
+        index, active, last = 0, 0, start
+        for time, delta in points:
+            while index + 1 < len(starts) and starts[index + 1] <= time:
+                if active:
+                    seconds[index] += \
+                        active * (starts[index + 1] - last).total_seconds()
+                last = starts[index + 1]
+                index += 1
+            if active:
+                seconds[index] += active * (time - last).total_seconds()
+            last = time
+            active += delta
+        series[key] = seconds
+
+    return starts, series
@@ -16,13 +16,27 @@
 
 """
 
-from ceilometer.event import models as ceilometer_models
+import datetime
+
 from dateutil import parser
 
 
+def parse_datetime(value):
+    """Parse a timestamp, using the fast path for ISO 8601 ones."""
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return parser.parse(value)
+
+
 def normalize_event(event):
     """normalize_event"""
-    event['generated'] = parser.parse(event['generated'])
+    # NOTE: Importing ceilometer pulls in most of its dependencies, so it is
+    #       deferred until the first event is received.
+    # pylint: disable=import-outside-toplevel
+    from ceilometer.event import models as ceilometer_models
+
+    event['generated'] = parse_datetime(event['generated'])
     event['traits'] = {
         k: ceilometer_models.Trait.convert_value(t, v)
         for (k, t, v) in event['traits']